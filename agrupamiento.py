@@ -0,0 +1,265 @@
+# --- AGRUPAMIENTO JERÁRQUICO DE PUNTOS EN EL SERVIDOR ---
+# En lugar de mandar cada atención como marcador (o de agruparlas en el
+# navegador con MarkerCluster, que igual recibe todos los puntos), los grupos
+# de cada zoom se calculan aquí con una rejilla en píxeles Web Mercator, al
+# estilo de supercluster. Las celdas miden TAMANO_CELDA píxeles en todos los
+# zooms y, como dividen exactamente a una tesela, cada celda contiene justo
+# cuatro celdas del zoom siguiente: con los puntos ordenados por clave Morton
+# (Z-order) una sola vez, los grupos de cada zoom son tramos contiguos del
+# zoom siguiente y se suman con `reduceat`.
+#
+# El mapa incrusta el resumen de cada zoom (centro, atenciones y atenciones de
+# SM por grupo) y, para el detalle, los puntos en arreglos compactos ordenados
+# por grupo del último zoom. El navegador solo crea marcadores para lo visible.
+
+import html
+
+import numpy as np
+from folium.map import Layer
+from folium.template import Template
+
+from capas import PLANTILLA_POPUP, DECIMALES_COORDENADAS
+from fechas import dias_de_fechas
+from teselas import proyectar_mercator, TAMANO_TESELA
+from cache_compartido import cache
+
+# --- CONFIGURACIÓN ---
+# Lado de la celda en píxeles de pantalla; debe dividir a TAMANO_TESELA
+TAMANO_CELDA = 64
+ZOOM_MIN_GRUPOS = 8
+# Desde ZOOM_MAX_GRUPOS + 1 se muestran los puntos individuales
+ZOOM_MAX_GRUPOS = 16
+
+def _separar_bits(valores):
+    """Intercala ceros entre los bits de enteros de hasta 32 bits."""
+    v = valores.astype(np.uint64) & np.uint64(0xFFFFFFFF)
+    for desplazamiento, mascara in (
+        (16, 0x0000FFFF0000FFFF),
+        (8, 0x00FF00FF00FF00FF),
+        (4, 0x0F0F0F0F0F0F0F0F),
+        (2, 0x3333333333333333),
+        (1, 0x5555555555555555),
+    ):
+        v = (v | (v << np.uint64(desplazamiento))) & np.uint64(mascara)
+    return v
+
+def clave_morton(columna, fila):
+    """Clave Z-order de cada celda: las cuatro hijas de una celda comparten `clave >> 2`."""
+    return _separar_bits(columna) | (_separar_bits(fila) << np.uint64(1))
+
+def _mercator_a_latlon(x, y):
+    lon = x / TAMANO_TESELA * 360.0 - 180.0
+    lat = np.degrees(np.arctan(np.sinh(np.pi * (1 - 2 * y / TAMANO_TESELA))))
+    return lat, lon
+
+def _tramos(claves):
+    """Inicio de cada tramo de claves iguales en un arreglo ordenado."""
+    if len(claves) == 0:
+        return np.empty(0, dtype=np.intp)
+    return np.r_[0, np.flatnonzero(claves[1:] != claves[:-1]) + 1]
+
+class IndiceAgrupamiento:
+    """Grupos por zoom y puntos ordenados por grupo del último zoom."""
+
+    def __init__(self, lat, lon, dias, colonias, nombres_colonias, es_sm=None,
+                 zoom_min=ZOOM_MIN_GRUPOS, zoom_max=ZOOM_MAX_GRUPOS):
+        # dias: días desde 1970; colonias: código de cada punto en `nombres_colonias`
+        self.nombres_colonias = nombres_colonias
+        lat = np.asarray(lat, dtype=np.float64)
+        lon = np.asarray(lon, dtype=np.float64)
+        validos = np.isfinite(lat) & np.isfinite(lon)
+        es_sm = np.zeros(len(lat), dtype=bool) if es_sm is None else np.asarray(es_sm, dtype=bool)
+        lat, lon = lat[validos], lon[validos]
+        dias, colonias, es_sm = np.asarray(dias)[validos], np.asarray(colonias)[validos], es_sm[validos]
+        self.zoom_min, self.zoom_max = zoom_min, zoom_max
+
+        # Celda del último zoom de cada punto, en orden Morton
+        x, y = proyectar_mercator(lat, lon)
+        escala = 2 ** zoom_max / TAMANO_CELDA
+        maximo = TAMANO_TESELA * escala - 1
+        claves = clave_morton(np.clip(np.floor(x * escala), 0, maximo), np.clip(np.floor(y * escala), 0, maximo))
+        orden = np.argsort(claves, kind='stable')
+        claves, x, y = claves[orden], x[orden], y[orden]
+        self.lat, self.lon = lat[orden], lon[orden]
+        self.dias, self.colonias, self.es_sm = dias[orden], colonias[orden], es_sm[orden]
+
+        # Grupos del último zoom y, hacia atrás, la suma de sus hijos
+        inicio = _tramos(claves)
+        self.inicio_puntos = np.r_[inicio, len(claves)]
+        n = np.diff(self.inicio_puntos)
+        suma_x = np.add.reduceat(x, inicio)
+        suma_y = np.add.reduceat(y, inicio)
+        sm = np.add.reduceat(es_sm.astype(np.int64), inicio)
+        claves = claves[inicio]
+
+        self.niveles = {}
+        for zoom in range(zoom_max, zoom_min - 1, -1):
+            if zoom < zoom_max:
+                claves = claves >> np.uint64(2)
+                inicio = _tramos(claves)
+                claves = claves[inicio]
+                n, suma_x, suma_y, sm = (np.add.reduceat(arreglo, inicio) for arreglo in (n, suma_x, suma_y, sm))
+            lat_grupo, lon_grupo = _mercator_a_latlon(suma_x / np.maximum(n, 1), suma_y / np.maximum(n, 1))
+            self.niveles[zoom] = (lat_grupo, lon_grupo, n, sm)
+
+    @classmethod
+    def desde_atenciones(cls, df, col_lat, col_lon, col_fecha, col_colonia, es_sm=None):
+        """Construye el índice con las fechas como días y las colonias como códigos."""
+        dias = dias_de_fechas(df[col_fecha])
+        codigos, unicos = df[col_colonia].factorize(use_na_sentinel=True)
+        nombres = [html.escape(str(colonia).title()) for colonia in unicos] + ['']
+        # El código -1 (sin colonia) apunta al nombre vacío del final
+        codigos = np.where(codigos < 0, len(nombres) - 1, codigos)
+        return cls(df[col_lat], df[col_lon], dias, codigos, nombres, es_sm)
+
+    def __len__(self):
+        return len(self.lat)
+
+    def grupos(self, zoom):
+        """(lat, lon, atenciones, atenciones de SM) de los grupos de un zoom."""
+        return self.niveles[min(max(zoom, self.zoom_min), self.zoom_max)]
+
+    def a_datos(self):
+        """Datos compactos para el navegador: niveles como listas y puntos por columnas."""
+        decimales = DECIMALES_COORDENADAS - 1
+        niveles = []
+        for zoom in range(self.zoom_min, self.zoom_max + 1):
+            lat, lon, n, sm = self.niveles[zoom]
+            niveles.append({
+                'lat': np.round(lat, decimales).tolist(),
+                'lon': np.round(lon, decimales).tolist(),
+                'n': n.tolist(),
+                'sm': sm.tolist(),
+            })
+        dia_base = int(self.dias.min()) if len(self.dias) else 0
+        return {
+            'zmin': self.zoom_min,
+            'zmax': self.zoom_max,
+            'niveles': niveles,
+            'puntos': {
+                'inicio': self.inicio_puntos.tolist(),
+                'lat': np.round(self.lat, decimales).tolist(),
+                'lon': np.round(self.lon, decimales).tolist(),
+                # Días desde `dia_base` (enteros cortos) y colonia como código
+                'dia': (self.dias - dia_base).tolist(),
+                'colonia': self.colonias.tolist(),
+                'sm': self.es_sm.astype(np.int8).tolist(),
+            },
+            'dia_base': dia_base,
+            'colonias': self.nombres_colonias,
+        }
+
+# --- CACHÉ POR DATOS Y RANGO DE FECHAS ---
+
+def obtener_agrupamiento(clave, df, col_lat, col_lon, col_fecha, col_colonia, es_sm=None):
+    """Devuelve el índice de grupos, compartido entre sesiones para la misma clave."""
+    if clave is None:
+        return IndiceAgrupamiento.desde_atenciones(df, col_lat, col_lon, col_fecha, col_colonia, es_sm)
+    return cache.obtener(
+        ('agrupamiento', clave),
+        lambda: IndiceAgrupamiento.desde_atenciones(df, col_lat, col_lon, col_fecha, col_colonia, es_sm)
+    )
+
+# --- CAPA DEL MAPA ---
+
+def _partes_popup(etiqueta, valor):
+    """Texto del popup antes de la fecha, entre fecha y colonia, y después de la colonia."""
+    partes = PLANTILLA_POPUP.replace('{etiqueta}', etiqueta).replace('{valor}', valor)
+    inicio, resto = partes.split('{fecha}')
+    medio, fin = resto.split('{colonia}')
+    return [inicio, medio, fin]
+
+class CapaAgrupada(Layer):
+    """Capa Leaflet que dibuja los grupos precalculados del zoom actual y, de cerca, los puntos."""
+
+    _template = Template("""
+        {% macro header(this, kwargs) %}
+        <style>
+            .grupo-atenciones { border-radius: 50%; background: rgba(110, 204, 57, 0.6); }
+            .grupo-atenciones div {
+                width: 30px; height: 30px; margin: 5px; border-radius: 50%;
+                background: rgba(110, 204, 57, 0.85);
+                font: 12px Arial, sans-serif; line-height: 30px; text-align: center; color: #222;
+            }
+            .grupo-atenciones.grupo-medio { background: rgba(240, 194, 12, 0.6); }
+            .grupo-atenciones.grupo-medio div { background: rgba(241, 211, 87, 0.85); }
+            .grupo-atenciones.grupo-grande { background: rgba(253, 156, 115, 0.6); }
+            .grupo-atenciones.grupo-grande div { background: rgba(241, 128, 23, 0.85); }
+        </style>
+        {% endmacro %}
+
+        {% macro script(this, kwargs) %}
+            var {{ this.get_name() }} = L.layerGroup();
+            (function(capa, datos, estilo) {
+                function dosDigitos(v) { return (v < 10 ? '0' : '') + v; }
+                function fecha(dia) {
+                    var d = new Date((datos.dia_base + dia) * 86400000);
+                    return dosDigitos(d.getUTCDate()) + '/' + dosDigitos(d.getUTCMonth() + 1) + '/' + d.getUTCFullYear();
+                }
+                function grupo(nivel, i, zoom) {
+                    var n = nivel.n[i], centro = [nivel.lat[i], nivel.lon[i]];
+                    var clase = n < 10 ? 'grupo-chico' : (n < 100 ? 'grupo-medio' : 'grupo-grande');
+                    var marcador = L.marker(centro, {icon: L.divIcon({
+                        html: '<div>' + n + '</div>', className: 'grupo-atenciones ' + clase, iconSize: L.point(40, 40)
+                    })});
+                    var texto = n + (n == 1 ? ' atención' : ' atenciones');
+                    if (estilo.usar_sm) {
+                        texto += '<br>' + estilo.fuentes[0] + ': ' + (n - nivel.sm[i]) + '<br>' + estilo.fuentes[1] + ': ' + nivel.sm[i];
+                    }
+                    marcador.bindTooltip(texto);
+                    marcador.on('click', function() {
+                        capa._map.setView(centro, Math.min(zoom + 2, datos.zmax + 1));
+                    });
+                    return marcador;
+                }
+                function punto(j) {
+                    var p = datos.puntos, f = p.sm[j];
+                    var marcador = L.circleMarker([p.lat[j], p.lon[j]], {
+                        radius: 6, color: estilo.colores[f], fill: true, fillColor: estilo.colores[f], fillOpacity: 0.8
+                    });
+                    marcador.bindPopup(function() {
+                        var partes = estilo.popups[f];
+                        return partes[0] + fecha(p.dia[j]) + partes[1] + datos.colonias[p.colonia[j]] + partes[2];
+                    }, {maxWidth: 300});
+                    return marcador;
+                }
+                function dibujar() {
+                    var mapa = capa._map;
+                    if (!mapa) { return; }
+                    capa.clearLayers();
+                    var zoom = mapa.getZoom(), visibles = mapa.getBounds().pad(0.25);
+                    var nivel = datos.niveles[Math.min(Math.max(zoom, datos.zmin), datos.zmax) - datos.zmin];
+                    for (var i = 0; i < nivel.n.length; i++) {
+                        if (!visibles.contains([nivel.lat[i], nivel.lon[i]])) { continue; }
+                        if (zoom <= datos.zmax) {
+                            capa.addLayer(grupo(nivel, i, zoom));
+                        } else {
+                            for (var j = datos.puntos.inicio[i]; j < datos.puntos.inicio[i + 1]; j++) {
+                                capa.addLayer(punto(j));
+                            }
+                        }
+                    }
+                }
+                // Solo se redibuja mientras la capa está visible (el control de capas la quita y la pone)
+                capa.on('add', function() { capa._map.on('moveend', dibujar); dibujar(); });
+                capa.on('remove', function() { capa._map.off('moveend', dibujar); });
+            })({{ this.get_name() }}, {{ this.datos|tojson }}, {{ this.estilo|tojson }});
+        {% endmacro %}
+    """)
+
+    def __init__(self, indice, colores, usar_sm=False, name=None, overlay=True, control=True, show=True):
+        super().__init__(name=name, overlay=overlay, control=control, show=show)
+        self._name = 'CapaAgrupada'
+        self.datos = indice.a_datos()
+        fuentes = list(colores)
+        if usar_sm:
+            popups = [_partes_popup("Atendido por:", fuente) for fuente in fuentes]
+        else:
+            popups = [_partes_popup("Tipo:", "Atención médica")] * 2
+            colores = {fuente: colores[fuentes[0]] for fuente in fuentes}
+        self.estilo = {
+            'usar_sm': usar_sm,
+            'fuentes': fuentes,
+            'colores': list(colores.values()),
+            'popups': popups,
+        }
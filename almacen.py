@@ -0,0 +1,302 @@
+# --- ALMACÉN HISTÓRICO DE ATENCIONES ---
+# Cada mes se vuelve a subir una exportación acumulada que es casi idéntica a
+# la anterior. En lugar de limpiar todo otra vez, las atenciones se acumulan en
+# un almacén local de parquet particionado por mes: cada fila se identifica por
+# un hash estable de sus columnas asignadas y solo las filas que el almacén no
+# tiene pasan por la limpieza. El mapa consulta después cualquier rango de
+# fechas del historial completo.
+#
+# Estructura en disco (un almacén por combinación de columnas asignadas):
+#   <directorio>/<nombre>/manifiesto.json         partes, versión y claves vigentes
+#   <directorio>/<nombre>/mes=AAAA-MM/parte-N.parquet
+#   <directorio>/<nombre>/claves-N.npy            claves de las filas ya vistas
+# El manifiesto se reemplaza al final de cada agregado; es el único punto de
+# confirmación, así que un agregado interrumpido no deja filas a medias.
+
+import os
+import json
+import hashlib
+import datetime
+import tempfile
+import threading
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from procesamiento import limpiar_atenciones, columna_fuente, COLUMNA_FUENTE
+
+# --- CONFIGURACIÓN ---
+DIRECTORIO_ALMACEN = os.environ.get(
+    "MAPAS_ALMACEN_DIR",
+    os.path.join(os.path.expanduser("~"), ".local", "share", "mapas_prehospitalarios", "almacen")
+)
+
+# Cambiar este valor deja de leer los almacenes guardados con un formato anterior.
+VERSION_ALMACEN = "1"
+
+# Decimales con que se comparan las coordenadas (~1 cm): el mismo número leído
+# como texto o como float puede diferir en el último dígito
+DECIMALES_COORDENADAS = 7
+
+# Constantes de mezcla (razón áurea y primo de FNV) para combinar los hashes
+_MEZCLA_OCURRENCIA = np.uint64(0x9E3779B97F4A7C15)
+_MEZCLA_COLUMNA = np.uint64(0x100000001B3)
+
+# Un candado por almacén: las sesiones de Streamlit comparten el proceso
+_candados = {}
+_candados_lock = threading.Lock()
+
+def _candado(ruta):
+    with _candados_lock:
+        return _candados.setdefault(ruta, threading.Lock())
+
+# --- CLAVES DE FILA ---
+
+def claves_filas(df, columnas, coordenadas=()):
+    """Hash estable (uint64) de cada fila según el texto de sus `columnas`.
+
+    Las `coordenadas` se comparan como número redondeado y no como texto.
+
+    Las filas idénticas se numeran por orden de aparición y la repetición forma
+    parte de la clave: dos atenciones iguales del mismo archivo se guardan las
+    dos, y volver a subir el archivo no agrega ninguna.
+    """
+    if len(df) == 0:
+        return np.empty(0, dtype=np.uint64)
+    hashes = np.zeros(len(df), dtype=np.uint64)
+    with np.errstate(over='ignore'):
+        for columna in columnas:
+            hashes = hashes * _MEZCLA_COLUMNA ^ _hash_columna(df[columna], columna in coordenadas)
+        ocurrencia = pd.Series(hashes).groupby(hashes).cumcount().to_numpy().astype(np.uint64)
+        return hashes ^ (ocurrencia * _MEZCLA_OCURRENCIA)
+
+def _hash_columna(serie, coordenada):
+    """Hash uint64 de cada valor: entero escalado para coordenadas, texto para lo demás."""
+    if coordenada:
+        numeros = pd.to_numeric(serie, errors='coerce').to_numpy(dtype=np.float64)
+        escalados = np.round(numeros * 10 ** DECIMALES_COORDENADAS)
+        enteros = np.where(np.isnan(escalados), np.iinfo(np.int64).min, escalados).astype(np.int64)
+        return pd.util.hash_array(enteros)
+    # Se hashea el texto de cada valor distinto, no de cada fila; las celdas
+    # vacías (NaN, None, NaT) quedan con código -1 y cuentan igual
+    codigos, unicos = pd.factorize(serie)
+    textos = np.asarray(pd.Index(unicos).astype(str), dtype=object)
+    hashes_unicos = np.append(pd.util.hash_array(textos), pd.util.hash_array(np.array([''], dtype=object)))
+    return hashes_unicos[codigos]
+
+def _contiene(ordenadas, claves):
+    """Máscara de las `claves` presentes en el arreglo ordenado `ordenadas`."""
+    if len(ordenadas) == 0:
+        return np.zeros(len(claves), dtype=bool)
+    # Buscar las claves en orden recorre `ordenadas` una vez en lugar de saltar al azar
+    orden = np.argsort(claves)
+    buscadas = claves[orden]
+    posiciones = np.searchsorted(ordenadas, buscadas)
+    posiciones[posiciones == len(ordenadas)] = 0
+    presentes = np.empty(len(claves), dtype=bool)
+    presentes[orden] = ordenadas[posiciones] == buscadas
+    return presentes
+
+# --- ESCRITURA ATÓMICA ---
+
+def _reemplazar(ruta, escribir):
+    """Escribe con `escribir(ruta_tmp)` en un temporal y lo renombra al destino."""
+    directorio = os.path.dirname(ruta)
+    os.makedirs(directorio, exist_ok=True)
+    fd, ruta_tmp = tempfile.mkstemp(dir=directorio, suffix='.tmp')
+    os.close(fd)
+    try:
+        escribir(ruta_tmp)
+        os.replace(ruta_tmp, ruta)
+    finally:
+        if os.path.exists(ruta_tmp):
+            os.remove(ruta_tmp)
+
+def _escribir_json(datos, ruta):
+    def escribir(ruta_tmp):
+        with open(ruta_tmp, 'w', encoding='utf-8') as f:
+            json.dump(datos, f, ensure_ascii=False, indent=1)
+    _reemplazar(ruta, escribir)
+
+def _escribir_claves(claves, ruta):
+    def escribir(ruta_tmp):
+        with open(ruta_tmp, 'wb') as f:
+            np.save(f, claves)
+    _reemplazar(ruta, escribir)
+
+# --- LECTURA DE PARTICIONES ---
+
+def _concatenar(partes):
+    """Une las particiones conservando como categóricas las columnas que lo son en todas."""
+    df = pd.concat(partes, ignore_index=True)
+    for columna in partes[0].columns:
+        if all(isinstance(parte[columna].dtype, pd.CategoricalDtype) for parte in partes):
+            # Con categorías distintas por parte, concat las convierte en texto
+            df[columna] = pd.api.types.union_categoricals([parte[columna] for parte in partes])
+    return df
+
+# --- ALMACÉN ---
+
+class AlmacenAtenciones:
+    """Atenciones limpias acumuladas en disco para una combinación de columnas asignadas."""
+
+    def __init__(self, col_lat, col_lon, col_colonia, col_fecha, col_sm=None, directorio=None):
+        self.col_lat = col_lat
+        self.col_lon = col_lon
+        self.col_colonia = col_colonia
+        self.col_fecha = col_fecha
+        self.col_sm = col_sm
+        self.columnas = [col_lat, col_lon, col_colonia, col_fecha] + ([col_sm] if col_sm is not None else [])
+        firma = json.dumps({'version': VERSION_ALMACEN, 'columnas': self.columnas}, ensure_ascii=False)
+        self.nombre = f"atenciones-{hashlib.sha256(firma.encode()).hexdigest()[:16]}"
+        self.ruta = os.path.join(directorio or DIRECTORIO_ALMACEN, self.nombre)
+        self._ruta_manifiesto = os.path.join(self.ruta, 'manifiesto.json')
+
+    def manifiesto(self):
+        """Estado confirmado del almacén (vacío si todavía no existe)."""
+        try:
+            with open(self._ruta_manifiesto, 'r', encoding='utf-8') as f:
+                manifiesto = json.load(f)
+            if manifiesto.get('formato') == VERSION_ALMACEN:
+                return manifiesto
+        except (OSError, ValueError):
+            pass
+        return {
+            'formato': VERSION_ALMACEN, 'columnas': self.columnas, 'version': 0,
+            'filas': 0, 'partes': [], 'claves': None, 'fecha_min': None, 'fecha_max': None
+        }
+
+    @property
+    def version(self):
+        """Cambia con cada agregado que guarda filas nuevas (sirve como clave de caché)."""
+        return self.manifiesto()['version']
+
+    def __len__(self):
+        return self.manifiesto()['filas']
+
+    def _claves(self, manifiesto):
+        if not manifiesto['claves']:
+            return np.empty(0, dtype=np.uint64)
+        return np.load(os.path.join(self.ruta, manifiesto['claves']))
+
+    def agregar(self, df):
+        """Agrega las filas de `df` que el almacén no tiene, limpiando solo esas.
+
+        Devuelve un resumen con las filas del archivo, las nuevas, las que ya
+        estaban y las nuevas descartadas por la limpieza (sin coordenadas,
+        fecha o colonia válidas). Las descartadas también se recuerdan para no
+        volver a limpiarlas en la siguiente subida.
+        """
+        claves = claves_filas(df, self.columnas, coordenadas=(self.col_lat, self.col_lon))
+        with _candado(self.ruta):
+            manifiesto = self.manifiesto()
+            guardadas = self._claves(manifiesto)
+            nuevas = ~_contiene(guardadas, claves)
+            resumen = {
+                'filas': len(df),
+                'nuevas': int(nuevas.sum()),
+                'existentes': int(len(df) - nuevas.sum()),
+                'descartadas': 0,
+                'total': manifiesto['filas'],
+            }
+            if not nuevas.any():
+                return resumen
+
+            limpio = limpiar_atenciones(
+                df.loc[nuevas], self.col_lat, self.col_lon, self.col_colonia, self.col_fecha, self.col_sm
+            )
+            # La fuente se recalcula al consultar; se guarda solo lo asignado
+            limpio = limpio.drop(columns=[COLUMNA_FUENTE]).reset_index(drop=True)
+            limpio[self.col_lat] = limpio[self.col_lat].astype(np.float64)
+            limpio[self.col_lon] = limpio[self.col_lon].astype(np.float64)
+            resumen['descartadas'] = resumen['nuevas'] - len(limpio)
+
+            version = manifiesto['version'] + 1
+            partes = list(manifiesto['partes'])
+            meses = limpio[self.col_fecha].to_numpy().astype('datetime64[M]')
+            for mes, posiciones in limpio.groupby(meses).indices.items():
+                parte = f"mes={np.datetime64(mes, 'M')}/parte-{version:06d}.parquet"
+                tabla = pa.Table.from_pandas(limpio.iloc[posiciones], preserve_index=False)
+                _reemplazar(os.path.join(self.ruta, parte), lambda ruta_tmp: pq.write_table(tabla, ruta_tmp))
+                partes.append(parte)
+
+            archivo_claves = f"claves-{version:06d}.npy"
+            _escribir_claves(np.sort(np.concatenate([guardadas, claves[nuevas]])), os.path.join(self.ruta, archivo_claves))
+
+            fechas = [f for f in (manifiesto['fecha_min'], manifiesto['fecha_max']) if f]
+            if len(limpio):
+                fechas += [limpio[self.col_fecha].min().isoformat(), limpio[self.col_fecha].max().isoformat()]
+            _escribir_json({
+                **manifiesto,
+                'version': version,
+                'filas': manifiesto['filas'] + len(limpio),
+                'partes': partes,
+                'claves': archivo_claves,
+                'fecha_min': min(fechas) if fechas else None,
+                'fecha_max': max(fechas) if fechas else None,
+                'actualizado': datetime.datetime.now().isoformat(timespec='seconds'),
+            }, self._ruta_manifiesto)
+
+            # Las claves anteriores ya no las referencia el manifiesto
+            if manifiesto['claves']:
+                try:
+                    os.remove(os.path.join(self.ruta, manifiesto['claves']))
+                except OSError:
+                    pass
+            resumen['total'] = manifiesto['filas'] + len(limpio)
+            return resumen
+
+    def leer(self, desde=None, hasta=None):
+        """Atenciones del almacén, opcionalmente solo entre las fechas `desde` y `hasta` (inclusive).
+
+        Solo se abren las particiones de los meses del rango.
+        """
+        manifiesto = self.manifiesto()
+        desde = pd.Timestamp(desde) if desde is not None else None
+        hasta = pd.Timestamp(hasta) if hasta is not None else None
+        mes_desde = desde.strftime('%Y-%m') if desde is not None else None
+        mes_hasta = hasta.strftime('%Y-%m') if hasta is not None else None
+
+        partes = []
+        for parte in manifiesto['partes']:
+            mes = parte.split('/', 1)[0].split('=', 1)[1]
+            if (mes_desde and mes < mes_desde) or (mes_hasta and mes > mes_hasta):
+                continue
+            partes.append(pq.read_table(os.path.join(self.ruta, parte)).to_pandas())
+        if not partes:
+            return pd.DataFrame({
+                self.col_lat: pd.Series(dtype=np.float64),
+                self.col_lon: pd.Series(dtype=np.float64),
+                self.col_colonia: pd.Series(dtype=object),
+                self.col_fecha: pd.Series(dtype='datetime64[ns]'),
+                **({self.col_sm: pd.Series(dtype=object)} if self.col_sm is not None else {}),
+            })
+
+        df = _concatenar(partes)
+        if desde is not None:
+            df = df[df[self.col_fecha] >= desde.normalize()]
+        if hasta is not None:
+            df = df[df[self.col_fecha] < hasta.normalize() + pd.Timedelta(days=1)]
+        return df.reset_index(drop=True)
+
+    def leer_limpias(self, desde=None, hasta=None):
+        """Como `leer`, con la forma que deja `limpiar_atenciones`: colonia categórica y fuente.
+
+        Las filas se limpiaron al agregarse; aquí no se vuelven a convertir.
+        """
+        df = self.leer(desde, hasta)
+        if not isinstance(df[self.col_colonia].dtype, pd.CategoricalDtype):
+            df[self.col_colonia] = df[self.col_colonia].astype('category')
+        df[COLUMNA_FUENTE] = columna_fuente(df, self.col_sm)
+        return df
+
+    def resumen(self):
+        """Texto corto con el tamaño y el periodo del historial."""
+        manifiesto = self.manifiesto()
+        if not manifiesto['filas']:
+            return "almacén vacío"
+        desde = manifiesto['fecha_min'][:10]
+        hasta = manifiesto['fecha_max'][:10]
+        return f"{manifiesto['filas']:,} atenciones del {desde} al {hasta}"
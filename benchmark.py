@@ -0,0 +1,332 @@
+# --- BENCHMARK DEL FLUJO COMPLETO ---
+# Mide con datos sintéticos cada etapa del flujo de la aplicación (ingesta,
+# limpieza, filtro de fechas, centroides, creación del mapa y serialización a
+# HTML) para varios tamaños de archivo. Los resultados se guardan en JSON para
+# comparar corridas y marcar regresiones.
+#
+# Uso:
+#   python benchmark.py --filas 1000 100000 1000000 --salida benchmark.json
+#   python benchmark.py --filas 1000 100000 --comparar benchmark.json --umbral 0.2
+#
+# Con --comparar el programa termina con código 1 si alguna etapa tarda (o
+# algún HTML pesa) más que en la corrida base por encima del umbral.
+
+import io
+import sys
+import json
+import math
+import time
+import argparse
+import datetime
+import platform
+import tempfile
+
+import numpy as np
+import pandas as pd
+import folium
+
+from ingesta import parsear_datos, cargar_datos
+from normalizacion import limpiar_columna, limpiar_memo
+from geometria import IndiceGeometrico, obtener_indice
+from geojson_columnar import leer_geojson
+from procesamiento import procesar_atenciones
+from composicion import ComposicionMapa
+from mapa import crear_mapa, guardar_mapa_html
+from exportacion import exportar_html
+
+# Cambiar este valor cuando cambie el formato del JSON de resultados
+VERSION_RESULTADOS = 1
+
+FILAS_POR_DEFECTO = (1_000, 100_000, 1_000_000)
+
+# Centro de los datos sintéticos y tamaño de cada colonia (grados)
+CENTRO_SINTETICO = (19.43, -99.13)
+LADO_COLONIA = 0.01
+
+# Nombres base con acentos y mayúsculas para que la normalización tenga trabajo
+NOMBRES_BASE = ('Centro', 'San Ángel', 'Niño Perdido', 'Jardines del Pedregal', 'Santa María', 'Peñón')
+
+# Columnas del archivo sintético
+COLUMNAS_SINTETICAS = {'lat': 'LAT', 'lon': 'LON', 'colonia': 'COLONIA', 'fecha': 'FECHA', 'sm': 'SM'}
+CAMPO_SINTETICO = 'NOMBRE'
+
+# Diferencia mínima para considerar una regresión de tiempo (evita el ruido de etapas de milisegundos)
+MINIMO_REGRESION_S = 0.005
+
+# --- DATOS SINTÉTICOS ---
+
+def _nombre_colonia(i):
+    return f"{NOMBRES_BASE[i % len(NOMBRES_BASE)]} {i}"
+
+def generar_colonias(colonias=200, vertices=40, semilla=0):
+    """GeoJSON con `colonias` polígonos de `vertices` vértices en una rejilla sin traslapes."""
+    rng = np.random.default_rng(semilla)
+    columnas = math.ceil(math.sqrt(colonias))
+    lat0 = CENTRO_SINTETICO[0] - columnas * LADO_COLONIA / 2
+    lon0 = CENTRO_SINTETICO[1] - columnas * LADO_COLONIA / 2
+    angulos = np.linspace(0, 2 * np.pi, vertices, endpoint=False)
+    features = []
+    for i in range(colonias):
+        fila, columna = divmod(i, columnas)
+        centro_lat = lat0 + (fila + 0.5) * LADO_COLONIA
+        centro_lon = lon0 + (columna + 0.5) * LADO_COLONIA
+        # Radio irregular, siempre dentro de su celda
+        radios = LADO_COLONIA * rng.uniform(0.35, 0.5, vertices)
+        anillo = np.column_stack([
+            centro_lon + radios * np.cos(angulos),
+            centro_lat + radios * np.sin(angulos)
+        ]).round(6).tolist()
+        anillo.append(anillo[0])
+        features.append({
+            'type': 'Feature',
+            'properties': {CAMPO_SINTETICO: _nombre_colonia(i)},
+            'geometry': {'type': 'Polygon', 'coordinates': [anillo]}
+        })
+    return {'type': 'FeatureCollection', 'features': features}
+
+def _ensuciar(nombres, rng, proporcion):
+    """Variantes de captura: mayúsculas, espacios sobrantes y acentos omitidos."""
+    nombres = nombres.astype(object)
+    sucios = np.flatnonzero(rng.random(len(nombres)) < proporcion)
+    variante = rng.integers(0, 3, len(sucios))
+    base = pd.Series(nombres[sucios])
+    nombres[sucios[variante == 0]] = base[variante == 0].str.upper().to_numpy()
+    nombres[sucios[variante == 1]] = (' ' + base[variante == 1] + '  ').to_numpy()
+    nombres[sucios[variante == 2]] = (
+        base[variante == 2].str.normalize('NFD').str.encode('ascii', 'ignore').str.decode('ascii').to_numpy()
+    )
+    return nombres
+
+def generar_atenciones(filas, gj_data, proporcion_sm=0.3, proporcion_sucia=0.2,
+                       proporcion_invalida=0.02, semilla=0):
+    """Tabla de atenciones como la de un export real, con textos sucios y coordenadas inválidas."""
+    rng = np.random.default_rng(semilla)
+    centros = np.array([
+        np.mean(feature['geometry']['coordinates'][0][:-1], axis=0) for feature in gj_data['features']
+    ])
+    nombres = np.array([feature['properties'][CAMPO_SINTETICO] for feature in gj_data['features']], dtype=object)
+
+    # Colonias con frecuencia desigual, como en los datos reales
+    pesos = rng.pareto(1.5, len(centros)) + 1
+    colonia = rng.choice(len(centros), filas, p=pesos / pesos.sum())
+    distancia = LADO_COLONIA * 0.3 * np.sqrt(rng.random(filas))
+    angulo = rng.uniform(0, 2 * np.pi, filas)
+    lat = (centros[colonia, 1] + distancia * np.sin(angulo)).round(6).astype(object)
+    lon = (centros[colonia, 0] + distancia * np.cos(angulo)).round(6).astype(object)
+
+    # Coordenadas vacías, texto o (0, 0)
+    invalidas = np.flatnonzero(rng.random(filas) < proporcion_invalida)
+    tipo = rng.integers(0, 3, len(invalidas))
+    lat[invalidas[tipo == 0]] = None
+    lon[invalidas[tipo == 1]] = 'sin dato'
+    lat[invalidas[tipo == 2]] = 0.0
+    lon[invalidas[tipo == 2]] = 0.0
+
+    dias = rng.integers(0, 365, filas)
+    fechas = pd.Timestamp('2024-01-01') + pd.to_timedelta(dias, unit='D')
+    sm = np.where(rng.random(filas) < proporcion_sm, 'SM', 'PC').astype(object)
+
+    return pd.DataFrame({
+        'FOLIO': np.arange(1, filas + 1),
+        COLUMNAS_SINTETICAS['lat']: lat,
+        COLUMNAS_SINTETICAS['lon']: lon,
+        COLUMNAS_SINTETICAS['colonia']: _ensuciar(nombres[colonia], rng, proporcion_sucia),
+        COLUMNAS_SINTETICAS['fecha']: fechas.strftime('%Y-%m-%d'),
+        COLUMNAS_SINTETICAS['sm']: _ensuciar(sm, rng, proporcion_sucia),
+    })
+
+# --- MEDICIÓN ---
+
+def _medir(funcion, repeticiones=1):
+    """Devuelve (mejor tiempo en segundos, resultado de la última llamada)."""
+    mejor = math.inf
+    resultado = None
+    for _ in range(max(1, repeticiones)):
+        inicio = time.perf_counter()
+        resultado = funcion()
+        mejor = min(mejor, time.perf_counter() - inicio)
+    return mejor, resultado
+
+def medir_flujo(filas, gj_data, repeticiones=1, semilla=0, directorio_cache=None, **opciones_datos):
+    """Mide cada etapa del flujo para `filas` atenciones; devuelve {etapa: {'segundos': ..., ...}}."""
+    c = COLUMNAS_SINTETICAS
+    df_sintetico = generar_atenciones(filas, gj_data, semilla=semilla, **opciones_datos)
+    datos_csv = df_sintetico.to_csv(index=False).encode('utf-8')
+    resultados = {}
+
+    segundos, df = _medir(lambda: parsear_datos('atenciones.csv', datos_csv), repeticiones)
+    resultados['ingesta_csv'] = {'segundos': segundos, 'bytes': len(datos_csv)}
+
+    # Ingesta desde el caché en disco (ya escrito en la primera lectura)
+    cargar_datos(io.BytesIO(datos_csv), 'atenciones.csv', directorio=directorio_cache)
+    segundos, _ = _medir(
+        lambda: cargar_datos(io.BytesIO(datos_csv), 'atenciones.csv', directorio=directorio_cache),
+        repeticiones
+    )
+    resultados['ingesta_cache'] = {'segundos': segundos}
+
+    def limpiar_sin_memo():
+        limpiar_memo()
+        return limpiar_columna(df[c['colonia']])
+    segundos, _ = _medir(limpiar_sin_memo, repeticiones)
+    resultados['limpieza_texto'] = {'segundos': segundos}
+
+    segundos, (indice_fechas, _) = _medir(lambda: procesar_atenciones(
+        df, c['lat'], c['lon'], c['colonia'], c['fecha'], c['sm']
+    ), repeticiones)
+    resultados['limpieza'] = {'segundos': segundos, 'filas_validas': len(indice_fechas)}
+
+    # Un trimestre a la mitad del año
+    desde, hasta = datetime.date(2024, 4, 1), datetime.date(2024, 6, 30)
+    segundos, df_filtrado = _medir(lambda: indice_fechas.filtrar(desde, hasta), max(repeticiones, 5))
+    resultados['filtro_fechas'] = {'segundos': segundos, 'filas': len(df_filtrado)}
+
+    # Anclas de etiqueta de todas las colonias en una sola pasada vectorizada
+    segundos, _ = _medir(lambda: IndiceGeometrico.desde_geojson(gj_data).anclas, repeticiones)
+    resultados['centroides'] = {'segundos': segundos, 'colonias': len(gj_data['features'])}
+
+    datos_geojson = json.dumps(gj_data).encode('utf-8')
+    segundos, colonias = _medir(lambda: leer_geojson(datos_geojson), repeticiones)
+    resultados['ingesta_geojson'] = {'segundos': segundos, 'bytes': len(datos_geojson)}
+
+    indice_geometrico = obtener_indice(colonias)
+    # Composición nueva en cada llamada: se mide la construcción completa, sin capas reutilizadas
+    segundos, mapa = _medir(lambda: crear_mapa(
+        df_filtrado, colonias, CAMPO_SINTETICO, c['lat'], c['lon'], c['colonia'], c['fecha'],
+        mostrar_leyenda=True, usar_sm=True, indice_geometrico=indice_geometrico, resolucion_calor=50,
+        composicion=ComposicionMapa()
+    ), repeticiones)
+    resultados['crear_mapa'] = {'segundos': segundos}
+
+    segundos, html = _medir(lambda: guardar_mapa_html(mapa), repeticiones)
+    resultados['html'] = {'segundos': segundos, 'bytes': len(html.encode('utf-8'))}
+
+    segundos, (comprimido, _, _) = _medir(
+        lambda: exportar_html(html, 'HTML comprimido (.zip)', minificar=True), repeticiones
+    )
+    resultados['exportacion_zip'] = {'segundos': segundos, 'bytes': len(comprimido)}
+    return resultados
+
+def _entorno():
+    return {
+        'python': platform.python_version(),
+        'plataforma': platform.platform(),
+        'procesador': platform.processor() or platform.machine(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+        'folium': folium.__version__,
+    }
+
+def ejecutar_benchmark(filas=FILAS_POR_DEFECTO, colonias=200, vertices=40, proporcion_sm=0.3,
+                       proporcion_sucia=0.2, proporcion_invalida=0.02, semilla=0, repeticiones=1,
+                       progreso=None):
+    """Corre el benchmark para cada tamaño y devuelve el documento de resultados."""
+    gj_data = generar_colonias(colonias, vertices, semilla)
+    parametros = {
+        'colonias': colonias,
+        'vertices': vertices,
+        'proporcion_sm': proporcion_sm,
+        'proporcion_sucia': proporcion_sucia,
+        'proporcion_invalida': proporcion_invalida,
+        'semilla': semilla,
+        'repeticiones': repeticiones,
+    }
+    resultados = {}
+    with tempfile.TemporaryDirectory() as directorio_cache:
+        for n in filas:
+            resultados[str(n)] = medir_flujo(
+                n, gj_data, repeticiones, semilla, directorio_cache,
+                proporcion_sm=proporcion_sm,
+                proporcion_sucia=proporcion_sucia,
+                proporcion_invalida=proporcion_invalida
+            )
+            if progreso:
+                progreso(n, resultados[str(n)])
+    return {
+        'version': VERSION_RESULTADOS,
+        'fecha': datetime.datetime.now().isoformat(timespec='seconds'),
+        'entorno': _entorno(),
+        'parametros': parametros,
+        'resultados': resultados,
+    }
+
+# --- COMPARACIÓN ---
+
+def comparar_resultados(actual, base, umbral=0.2, minimo_s=MINIMO_REGRESION_S):
+    """Regresiones de `actual` respecto a `base`: lista de (filas, etapa, medida, antes, después).
+
+    Solo se comparan los tamaños y etapas presentes en ambas corridas. Una
+    etapa es regresión si su tiempo crece más del `umbral` (y más de
+    `minimo_s` segundos) o si sus bytes crecen más del `umbral`.
+    """
+    if base.get('parametros') != actual.get('parametros'):
+        print("Aviso: la corrida base usó otros parámetros de datos sintéticos.", file=sys.stderr)
+    regresiones = []
+    for filas, etapas in actual['resultados'].items():
+        etapas_base = base['resultados'].get(filas, {})
+        for etapa, medidas in etapas.items():
+            medidas_base = etapas_base.get(etapa)
+            if medidas_base is None:
+                continue
+            for medida in ('segundos', 'bytes'):
+                antes, despues = medidas_base.get(medida), medidas.get(medida)
+                if antes is None or despues is None or despues <= antes * (1 + umbral):
+                    continue
+                if medida == 'segundos' and despues - antes < minimo_s:
+                    continue
+                regresiones.append((filas, etapa, medida, antes, despues))
+    return regresiones
+
+def _formatear(medida, valor):
+    if medida == 'segundos':
+        return f"{valor:.3f} s"
+    return f"{valor / 1024 / 1024:.2f} MB" if valor >= 1024 * 1024 else f"{valor / 1024:.1f} KB"
+
+def _imprimir_tamano(filas, etapas):
+    print(f"— {filas} filas")
+    for etapa, medidas in etapas.items():
+        detalle = f"  ({_formatear('bytes', medidas['bytes'])})" if 'bytes' in medidas else ''
+        print(f"  {etapa:<16} {_formatear('segundos', medidas['segundos'])}{detalle}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark del flujo de mapas con datos sintéticos.")
+    parser.add_argument('--filas', type=int, nargs='+', default=list(FILAS_POR_DEFECTO),
+                        help="Tamaños a medir (por defecto: 1000 100000 1000000)")
+    parser.add_argument('--colonias', type=int, default=200, help="Polígonos del GeoJSON sintético")
+    parser.add_argument('--vertices', type=int, default=40, help="Vértices por polígono")
+    parser.add_argument('--proporcion-sm', type=float, default=0.3, help="Fracción de atenciones de SM")
+    parser.add_argument('--sucios', type=float, default=0.2, help="Fracción de textos con variantes de captura")
+    parser.add_argument('--invalidos', type=float, default=0.02, help="Fracción de coordenadas inválidas")
+    parser.add_argument('--semilla', type=int, default=0)
+    parser.add_argument('--repeticiones', type=int, default=1, help="Se reporta el mejor tiempo de N corridas")
+    parser.add_argument('--salida', help="Archivo JSON donde guardar los resultados")
+    parser.add_argument('--comparar', help="JSON de una corrida anterior para marcar regresiones")
+    parser.add_argument('--umbral', type=float, default=0.2, help="Aumento tolerado antes de marcar regresión (0.2 = 20%%)")
+    args = parser.parse_args(argv)
+
+    documento = ejecutar_benchmark(
+        args.filas, args.colonias, args.vertices, args.proporcion_sm, args.sucios, args.invalidos,
+        args.semilla, args.repeticiones, progreso=_imprimir_tamano
+    )
+    if args.salida:
+        with open(args.salida, 'w', encoding='utf-8') as f:
+            json.dump(documento, f, ensure_ascii=False, indent=2)
+        print(f"Resultados guardados en {args.salida}")
+
+    if args.comparar:
+        with open(args.comparar, 'r', encoding='utf-8') as f:
+            base = json.load(f)
+        regresiones = comparar_resultados(documento, base, args.umbral)
+        for filas, etapa, medida, antes, despues in regresiones:
+            print(
+                f"✗ {filas} filas · {etapa}: {_formatear(medida, antes)} → {_formatear(medida, despues)} "
+                f"(+{(despues / antes - 1) * 100:.0f}%)",
+                file=sys.stderr
+            )
+        if regresiones:
+            return 1
+        print(f"Sin regresiones respecto a {args.comparar}")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,212 @@
+# --- CACHÉ COMPARTIDO ENTRE SESIONES ---
+# Los objetos pesados (conjunto limpio, GeoJSON, índices geométricos, límites
+# simplificados, cubos, capas ya renderizadas) se guardan una sola vez por
+# proceso, con la clave de su contenido (hash del archivo y parámetros). Las
+# sesiones de Streamlit solo guardan claves: veinte sesiones con el mismo
+# archivo comparten un único conjunto limpio en lugar de veinte copias.
+#
+# Los valores son de solo lectura: quien los obtiene no debe modificarlos.
+#
+# Cada sesión retiene lo que usa con "ranuras" (p. ej. 'limpieza' o la capa
+# 'puntos_pc'): una ranura apunta a una sola clave y al cambiarla se suelta la
+# anterior. Una entrada con ranuras que la apuntan no se desaloja; las demás
+# se desalojan de la menos usada a la más usada cuando el total supera
+# LIMITE_MEMORIA_BYTES. Como Streamlit no avisa cuando se cierra una pestaña,
+# las ranuras de una sesión inactiva por RETENCION_SESION_S se sueltan solas.
+
+import os
+import sys
+import time
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+MB = 1024 * 1024
+
+# --- CONFIGURACIÓN ---
+LIMITE_MEMORIA_BYTES = int(os.environ.get("MAPAS_MEMORIA_COMPARTIDA_MB", "1024")) * MB
+RETENCION_SESION_S = int(os.environ.get("MAPAS_RETENCION_SESION_S", "1800"))
+
+def tamano_aproximado(objeto):
+    """Bytes aproximados de un objeto y de todo lo que contiene (sin contar dos veces lo compartido)."""
+    vistos = set()
+    total = 0
+    pendientes = [objeto]
+    while pendientes:
+        actual = pendientes.pop()
+        if id(actual) in vistos:
+            continue
+        vistos.add(id(actual))
+        if isinstance(actual, np.ndarray):
+            total += actual.nbytes
+        elif isinstance(actual, (pd.DataFrame, pd.Series)):
+            uso = actual.memory_usage(deep=True, index=True)
+            total += int(uso.sum() if isinstance(uso, pd.Series) else uso)
+        elif isinstance(actual, pd.Index):
+            total += actual.memory_usage(deep=True)
+        elif isinstance(actual, dict):
+            total += sys.getsizeof(actual)
+            pendientes.extend(actual.keys())
+            pendientes.extend(actual.values())
+        elif isinstance(actual, (list, tuple, set, frozenset)):
+            total += sys.getsizeof(actual)
+            pendientes.extend(actual)
+        elif hasattr(actual, '__dict__') and not isinstance(actual, type):
+            total += sys.getsizeof(actual)
+            pendientes.append(vars(actual))
+        else:
+            total += sys.getsizeof(actual)
+    return total
+
+class _Entrada:
+    __slots__ = ('valor', 'tamano', 'referencias')
+
+    def __init__(self, valor, tamano):
+        self.valor = valor
+        self.tamano = tamano
+        self.referencias = 0
+
+class CacheCompartido:
+    """Objetos de solo lectura por clave de contenido, con presupuesto de memoria y retención por sesión."""
+
+    def __init__(self, limite_bytes=None, retencion_s=None):
+        self.limite_bytes = LIMITE_MEMORIA_BYTES if limite_bytes is None else limite_bytes
+        self.retencion_s = RETENCION_SESION_S if retencion_s is None else retencion_s
+        self._entradas = OrderedDict()
+        self._ranuras = {}
+        self._actividad = {}
+        self._construyendo = {}
+        self._candado = threading.Lock()
+        self.bytes = 0
+        self.aciertos = 0
+        self.fallos = 0
+        self.desalojos = 0
+
+    def obtener(self, clave, constructor, sesion=None, ranura=None):
+        """Devuelve el valor de `clave`, construyéndolo una sola vez aunque lo pidan varias sesiones.
+
+        Con `sesion` y `ranura` la sesión retiene la entrada hasta que la ranura
+        apunte a otra clave o la sesión quede inactiva.
+        """
+        with self._candado:
+            entrada = self._entradas.get(clave)
+            if entrada is not None:
+                self.aciertos += 1
+                self._entradas.move_to_end(clave)
+                self._retener(sesion, ranura, clave)
+                return entrada.valor
+            candado_clave = self._construyendo.setdefault(clave, threading.Lock())
+
+        # Un candado por clave: la segunda sesión espera al constructor de la primera
+        with candado_clave:
+            with self._candado:
+                entrada = self._entradas.get(clave)
+                if entrada is not None:
+                    self.aciertos += 1
+                    self._retener(sesion, ranura, clave)
+                    return entrada.valor
+            try:
+                valor = constructor()
+                tamano = tamano_aproximado(valor)
+                with self._candado:
+                    self.fallos += 1
+                    self._entradas[clave] = _Entrada(valor, tamano)
+                    self.bytes += tamano
+                    self._retener(sesion, ranura, clave)
+                    self._desalojar()
+            finally:
+                with self._candado:
+                    self._construyendo.pop(clave, None)
+        return valor
+
+    def buscar(self, clave, sesion=None, ranura=None):
+        """Devuelve el valor de `clave` si está en el caché; si no, None."""
+        with self._candado:
+            entrada = self._entradas.get(clave)
+            if entrada is None:
+                return None
+            self._entradas.move_to_end(clave)
+            self._retener(sesion, ranura, clave)
+            return entrada.valor
+
+    def retener(self, sesion, ranura, clave):
+        """Hace que la ranura de la sesión apunte a `clave` (y suelta la clave anterior)."""
+        with self._candado:
+            self._retener(sesion, ranura, clave)
+
+    def liberar(self, sesion, ranura=None):
+        """Suelta una ranura de la sesión o, sin `ranura`, todas."""
+        with self._candado:
+            ranuras = self._ranuras.get(sesion, {})
+            for nombre in ([ranura] if ranura is not None else list(ranuras)):
+                self._soltar(ranuras.pop(nombre, None))
+            if not ranuras:
+                self._ranuras.pop(sesion, None)
+                self._actividad.pop(sesion, None)
+            self._desalojar()
+
+    def _retener(self, sesion, ranura, clave):
+        if sesion is None:
+            return
+        self._actividad[sesion] = time.monotonic()
+        if ranura is None:
+            return
+        ranuras = self._ranuras.setdefault(sesion, {})
+        anterior = ranuras.get(ranura)
+        if anterior == clave:
+            return
+        entrada = self._entradas.get(clave)
+        if entrada is None:
+            return
+        self._soltar(anterior)
+        ranuras[ranura] = clave
+        entrada.referencias += 1
+
+    def _soltar(self, clave):
+        entrada = self._entradas.get(clave) if clave is not None else None
+        if entrada is not None:
+            entrada.referencias -= 1
+
+    def _expirar_sesiones(self):
+        limite = time.monotonic() - self.retencion_s
+        for sesion in [s for s, momento in self._actividad.items() if momento < limite]:
+            for clave in self._ranuras.pop(sesion, {}).values():
+                self._soltar(clave)
+            del self._actividad[sesion]
+
+    def _desalojar(self):
+        if self.bytes <= self.limite_bytes:
+            return
+        self._expirar_sesiones()
+        # De la menos usada a la más usada, saltando las retenidas por alguna sesión
+        for clave in [c for c, e in self._entradas.items() if e.referencias <= 0]:
+            if self.bytes <= self.limite_bytes:
+                break
+            entrada = self._entradas.pop(clave)
+            self.bytes -= entrada.tamano
+            self.desalojos += 1
+
+    def estadisticas(self):
+        with self._candado:
+            return {
+                'entradas': len(self._entradas),
+                'retenidas': sum(1 for e in self._entradas.values() if e.referencias > 0),
+                'sesiones': len(self._actividad),
+                'mb': round(self.bytes / MB, 1),
+                'limite_mb': round(self.limite_bytes / MB, 1),
+                'aciertos': self.aciertos,
+                'fallos': self.fallos,
+                'desalojos': self.desalojos,
+            }
+
+    def limpiar(self):
+        with self._candado:
+            self._entradas.clear()
+            self._ranuras.clear()
+            self._actividad.clear()
+            self.bytes = 0
+
+# Caché único del proceso
+cache = CacheCompartido()
@@ -0,0 +1,147 @@
+# --- CONSTRUCCIÓN VECTORIZADA DE CAPAS DEL MAPA ---
+# Las atenciones se convierten en una sola FeatureCollection por fuente, con un
+# único estilo de marcador y una única plantilla de popup en JavaScript. Así el
+# HTML crece con los datos de cada punto y no con un objeto Leaflet por fila.
+
+import json
+import html
+
+import numpy as np
+import pandas as pd
+import folium
+from folium.plugins import HeatMap
+
+# Decimales conservados en las coordenadas (~10 cm), suficientes para el mapa
+DECIMALES_COORDENADAS = 6
+
+# Estilo común de los mapas de calor
+RADIO_CALOR = 15
+GRADIENTE_CALOR = {0.4: 'blue', 0.65: 'lime', 1: 'red'}
+
+# Metros por grado de latitud (aproximación esférica)
+METROS_POR_GRADO = 111_320.0
+
+PLANTILLA_POPUP = (
+    '<div style="font-family: Arial; font-size: 12px;">'
+    '<b>Fecha:</b> {fecha}<br>'
+    '<b>Colonia:</b> {colonia}<br>'
+    '<b>{etiqueta}</b> {valor}'
+    '</div>'
+)
+
+def _formatear_valores_unicos(serie, funcion):
+    """Aplica `funcion` una vez por valor distinto y reparte el resultado a las filas."""
+    codigos, unicos = pd.factorize(serie, use_na_sentinel=True)
+    formateados = np.array([funcion(valor) for valor in unicos] + [''], dtype=object)
+    # El código -1 (valores nulos) apunta al último elemento: cadena vacía
+    return formateados[codigos]
+
+def _formatear_fechas(serie):
+    """Formatea las fechas como dd/mm/aaaa calculando el texto una vez por día."""
+    if pd.api.types.is_datetime64_any_dtype(serie):
+        return _formatear_valores_unicos(serie.dt.normalize(), lambda f: f.strftime('%d/%m/%Y'))
+    return _formatear_valores_unicos(serie, lambda f: f.strftime('%d/%m/%Y') if hasattr(f, 'strftime') else str(f))
+
+def puntos_a_geojson(df, col_lat, col_lon, col_colonia, col_fecha):
+    """Convierte las atenciones en una FeatureCollection de puntos, columna por columna."""
+    latitudes = np.round(df[col_lat].to_numpy(dtype=float), DECIMALES_COORDENADAS)
+    longitudes = np.round(df[col_lon].to_numpy(dtype=float), DECIMALES_COORDENADAS)
+    fechas = _formatear_fechas(df[col_fecha])
+    colonias = _formatear_valores_unicos(df[col_colonia], lambda c: html.escape(str(c).title()))
+
+    validos = np.isfinite(latitudes) & np.isfinite(longitudes)
+    features = [
+        {
+            'type': 'Feature',
+            'geometry': {'type': 'Point', 'coordinates': [lon, lat]},
+            'properties': {'fecha': fecha, 'colonia': colonia},
+        }
+        for lon, lat, fecha, colonia in zip(
+            longitudes[validos].tolist(),
+            latitudes[validos].tolist(),
+            fechas[validos].tolist(),
+            colonias[validos].tolist(),
+        )
+    ]
+    return {'type': 'FeatureCollection', 'features': features}
+
+def _popup_compartido(etiqueta, valor):
+    """Devuelve la función JS que enlaza la misma plantilla de popup a cada punto."""
+    partes = PLANTILLA_POPUP.replace('{etiqueta}', etiqueta).replace('{valor}', valor)
+    inicio, resto = partes.split('{fecha}')
+    medio, fin = resto.split('{colonia}')
+    return folium.JsCode(
+        "function(feature, layer) {\n"
+        "    layer.bindPopup(function() {\n"
+        "        var p = feature.properties;\n"
+        f"        return {json.dumps(inicio)} + p.fecha + {json.dumps(medio)} + p.colonia + {json.dumps(fin)};\n"
+        "    }, {maxWidth: 300});\n"
+        "}"
+    )
+
+def capa_puntos(df, col_lat, col_lon, col_colonia, col_fecha, nombre, color, etiqueta, valor, tooltip):
+    """Crea la capa de puntos de una fuente como un único GeoJson con estilo compartido."""
+    return folium.GeoJson(
+        puntos_a_geojson(df, col_lat, col_lon, col_colonia, col_fecha),
+        name=nombre,
+        show=True,
+        marker=folium.CircleMarker(
+            radius=6,
+            color=color,
+            fill=True,
+            fill_color=color,
+            fill_opacity=0.8
+        ),
+        on_each_feature=_popup_compartido(etiqueta, valor),
+        tooltip=tooltip
+    )
+
+# --- MAPAS DE CALOR AGREGADOS EN EL SERVIDOR ---
+
+def celdas_rejilla(lat, lon, resolucion_m):
+    """Rejilla de celdas de `resolucion_m` metros: (inversa, lat_celda, lon_celda, conteos).
+
+    `lat` y `lon` son arreglos float64 sin NaN y no vacíos; `inversa` es la
+    celda de cada punto. El calor, el cubo de densidad y la cobertura usan esta
+    misma rejilla.
+    """
+    # Proyección local equirectangular: basta para celdas de decenas de metros
+    escala_lon = METROS_POR_GRADO * np.cos(np.radians(lat.mean()))
+    fila = np.floor(lat * METROS_POR_GRADO / resolucion_m).astype(np.int64)
+    columna = np.floor(lon * escala_lon / resolucion_m).astype(np.int64)
+    fila -= fila.min()
+    columna -= columna.min()
+    clave = fila * (int(columna.max()) + 1) + columna
+
+    celdas, inversa = np.unique(clave, return_inverse=True)
+    conteos = np.bincount(inversa, minlength=len(celdas)).astype(np.float64)
+    # Cada celda se dibuja en el centroide de sus puntos, no en el centro geométrico
+    lat_celda = np.round(np.bincount(inversa, weights=lat, minlength=len(celdas)) / conteos, DECIMALES_COORDENADAS)
+    lon_celda = np.round(np.bincount(inversa, weights=lon, minlength=len(celdas)) / conteos, DECIMALES_COORDENADAS)
+    return inversa, lat_celda, lon_celda, conteos
+
+def agregar_densidad(latitudes, longitudes, resolucion_m):
+    """Agrupa los puntos en celdas de `resolucion_m` metros y devuelve [lat, lon, peso] por celda no vacía."""
+    lat = np.asarray(latitudes, dtype=np.float64)
+    lon = np.asarray(longitudes, dtype=np.float64)
+    validos = np.isfinite(lat) & np.isfinite(lon)
+    lat, lon = lat[validos], lon[validos]
+    if len(lat) == 0:
+        return np.empty((0, 3))
+    _, lat_celda, lon_celda, pesos = celdas_rejilla(lat, lon, resolucion_m)
+    return np.column_stack([lat_celda, lon_celda, pesos])
+
+def capa_calor(df, col_lat, col_lon, resolucion_m=None):
+    """Crea el HeatMap de las atenciones; con `resolucion_m` envía celdas con peso en vez de puntos."""
+    if resolucion_m:
+        datos = agregar_densidad(df[col_lat], df[col_lon], resolucion_m).tolist()
+    else:
+        datos = df[[col_lat, col_lon]].values
+    # Leaflet.heat suma las intensidades de los puntos que caen en cada celda de
+    # pantalla, así que una celda con peso n se ve igual que n puntos sueltos
+    # mientras la celda del servidor sea menor que la de pantalla.
+    return HeatMap(
+        datos,
+        radius=RADIO_CALOR,
+        gradient=GRADIENTE_CALOR
+    )
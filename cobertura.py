@@ -0,0 +1,313 @@
+# --- COBERTURA Y DISTANCIA A LAS BASES ---
+# Distancia de cada atención a la base (ambulancias, hospitales) más cercana y
+# colonias cuyas atenciones quedan fuera del radio de N minutos.
+#
+# Las bases se indexan en un árbol k-d sobre vectores unitarios 3D: la cuerda
+# entre dos vectores crece con la distancia sobre la esfera, así que la base
+# más cercana en 3D es también la más cercana por haversine, sin deformar la
+# longitud. Todas las atenciones bajan juntas por el árbol (una operación por
+# nodo, no por punto); cada nodo lejano solo se visita con las atenciones cuya
+# mejor distancia supera la del plano de corte. La distancia final a la base
+# elegida se calcula con la fórmula de haversine.
+
+import numpy as np
+import pandas as pd
+import folium
+import branca.colormap as cm
+
+from capas import celdas_rejilla
+from normalizacion import limpiar_texto
+from cache_compartido import cache
+
+# --- CONFIGURACIÓN ---
+RADIO_TIERRA_M = 6_371_008.8
+# Bases por hoja del árbol
+BASES_POR_HOJA = 8
+# Atenciones consultadas a la vez (acota la memoria de los índices por nodo)
+TAMANO_BLOQUE = 250_000
+
+# Valores por defecto del radio de cobertura
+MINUTOS_COBERTURA = 10
+VELOCIDAD_KMH = 30
+
+# Celda (metros) de la capa de distancias; se duplica mientras haya más de MAX_CELDAS
+RESOLUCION_COBERTURA = 150
+MAX_CELDAS = 20_000
+# Clases de distancia como múltiplos del radio; las dos primeras quedan dentro
+CLASES_RADIO = (0.5, 1.0, 1.5, 2.0)
+COLORES_DISTANCIA = ('#1a9850', '#91cf60', '#fee08b', '#fc8d59', '#d73027')
+
+# Nombres de columna reconocidos en la tabla de bases (ya normalizados)
+COLUMNAS_LAT = ('lat', 'latitud', 'latitude', 'y')
+COLUMNAS_LON = ('lon', 'lng', 'long', 'longitud', 'longitude', 'x')
+COLUMNAS_NOMBRE = ('nombre', 'base', 'hospital', 'unidad', 'name')
+
+def radio_cobertura(minutos, velocidad_kmh=VELOCIDAD_KMH):
+    """Metros recorridos en `minutos` a la velocidad media indicada."""
+    return minutos * velocidad_kmh * 1000.0 / 60.0
+
+def distancia_haversine(lat1, lon1, lat2, lon2):
+    """Distancia en metros sobre la esfera entre pares de puntos (vectorizada)."""
+    lat1, lon1, lat2, lon2 = (np.radians(np.asarray(v, dtype=np.float64)) for v in (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * RADIO_TIERRA_M * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+def _vectores(lat, lon):
+    lat, lon = np.radians(lat), np.radians(lon)
+    coseno = np.cos(lat)
+    return np.column_stack([coseno * np.cos(lon), coseno * np.sin(lon), np.sin(lat)])
+
+def _buscar_columna(columnas, candidatos):
+    normalizadas = {limpiar_texto(str(c)): c for c in columnas}
+    for candidato in candidatos:
+        if candidato in normalizadas:
+            return normalizadas[candidato]
+    return None
+
+class IndiceBases:
+    """Árbol k-d de las bases para buscar la más cercana a muchas atenciones a la vez."""
+
+    def __init__(self, nombres, lat, lon):
+        self.nombres = np.asarray(nombres, dtype=object)
+        self.lat = np.asarray(lat, dtype=np.float64)
+        self.lon = np.asarray(lon, dtype=np.float64)
+        self.vectores = _vectores(self.lat, self.lon)
+
+        # Nodos en arreglos paralelos; eje -1 marca una hoja con las bases orden[inicio:fin]
+        self.orden = np.arange(len(self.lat))
+        ejes, cortes, hijos, tramos = [], [], [], []
+        pendientes = [(0, len(self.orden), None)]
+        while pendientes:
+            inicio, fin, padre = pendientes.pop()
+            nodo = len(ejes)
+            if padre is not None:
+                hijos[padre[0]][padre[1]] = nodo
+            ejes.append(-1)
+            cortes.append(0.0)
+            hijos.append([-1, -1])
+            tramos.append((inicio, fin))
+            if fin - inicio <= BASES_POR_HOJA:
+                continue
+            # Se corta por la mediana del eje con mayor extensión
+            puntos = self.vectores[self.orden[inicio:fin]]
+            eje = int(np.argmax(puntos.max(axis=0) - puntos.min(axis=0)))
+            self.orden[inicio:fin] = self.orden[inicio:fin][np.argsort(puntos[:, eje], kind='stable')]
+            medio = (inicio + fin) // 2
+            ejes[nodo] = eje
+            cortes[nodo] = float(self.vectores[self.orden[medio], eje])
+            pendientes.append((medio, fin, (nodo, 1)))
+            pendientes.append((inicio, medio, (nodo, 0)))
+        self.ejes = np.asarray(ejes, dtype=np.int64)
+        self.cortes = np.asarray(cortes, dtype=np.float64)
+        self.hijos = np.asarray(hijos, dtype=np.int64)
+        self.tramos = np.asarray(tramos, dtype=np.int64)
+
+    @classmethod
+    def desde_tabla(cls, df):
+        """Construye el índice desde una tabla con columnas de latitud, longitud y (opcional) nombre."""
+        col_lat = _buscar_columna(df.columns, COLUMNAS_LAT)
+        col_lon = _buscar_columna(df.columns, COLUMNAS_LON)
+        if col_lat is None or col_lon is None:
+            raise ValueError("La tabla de bases debe tener columnas de latitud y longitud (p. ej. LAT y LON).")
+        col_nombre = _buscar_columna(df.columns, COLUMNAS_NOMBRE)
+
+        lat = pd.to_numeric(df[col_lat], errors='coerce').to_numpy(dtype=np.float64)
+        lon = pd.to_numeric(df[col_lon], errors='coerce').to_numpy(dtype=np.float64)
+        if col_nombre is not None:
+            nombres = df[col_nombre].astype(str).str.strip().to_numpy(dtype=object)
+        else:
+            nombres = np.array([f"Base {i + 1}" for i in range(len(df))], dtype=object)
+        validas = np.isfinite(lat) & np.isfinite(lon) & (np.abs(lat) <= 90) & (np.abs(lon) <= 180)
+        if not validas.any():
+            raise ValueError("La tabla de bases no tiene coordenadas válidas.")
+        return cls(nombres[validas], lat[validas], lon[validas])
+
+    def __len__(self):
+        return len(self.lat)
+
+    def _cercanas(self, consultas):
+        """Índice de la base más cercana a cada vector unitario de `consultas`."""
+        n = len(consultas)
+        mejor_d2 = np.full(n, np.inf)
+        mejor = np.zeros(n, dtype=np.int64)
+        # (nodo, atenciones, distancia al plano al cuadrado o None si es el lado cercano)
+        pendientes = [(0, np.arange(n), None)]
+        while pendientes:
+            nodo, filas, plano_d2 = pendientes.pop()
+            if plano_d2 is not None:
+                # Lado lejano: solo si el plano está más cerca que la mejor base hallada
+                filas = filas[plano_d2 < mejor_d2[filas]]
+            if len(filas) == 0:
+                continue
+            eje = self.ejes[nodo]
+            if eje < 0:
+                inicio, fin = self.tramos[nodo]
+                bases = self.orden[inicio:fin]
+                d2 = ((consultas[filas, None, :] - self.vectores[bases][None, :, :]) ** 2).sum(axis=2)
+                elegida = d2.argmin(axis=1)
+                d2 = d2[np.arange(len(filas)), elegida]
+                mejora = d2 < mejor_d2[filas]
+                mejor_d2[filas[mejora]] = d2[mejora]
+                mejor[filas[mejora]] = bases[elegida[mejora]]
+                continue
+            delta = consultas[filas, eje] - self.cortes[nodo]
+            izquierda = delta < 0
+            menor, mayor = self.hijos[nodo]
+            # La pila visita primero el lado de cada atención y después el opuesto
+            pendientes.append((mayor, filas[izquierda], delta[izquierda] ** 2))
+            pendientes.append((menor, filas[~izquierda], delta[~izquierda] ** 2))
+            pendientes.append((menor, filas[izquierda], None))
+            pendientes.append((mayor, filas[~izquierda], None))
+        return mejor
+
+    def mas_cercana(self, lat, lon):
+        """(distancia en metros, índice de la base) más cercana a cada punto; NaN y -1 sin coordenadas."""
+        lat = np.asarray(lat, dtype=np.float64)
+        lon = np.asarray(lon, dtype=np.float64)
+        distancias = np.full(len(lat), np.nan, dtype=np.float32)
+        bases = np.full(len(lat), -1, dtype=np.int32)
+        validas = np.flatnonzero(np.isfinite(lat) & np.isfinite(lon))
+        for inicio in range(0, len(validas), TAMANO_BLOQUE):
+            filas = validas[inicio:inicio + TAMANO_BLOQUE]
+            cercana = self._cercanas(_vectores(lat[filas], lon[filas]))
+            distancias[filas] = distancia_haversine(lat[filas], lon[filas], self.lat[cercana], self.lon[cercana])
+            bases[filas] = cercana
+        return distancias, bases
+
+class AnalisisCobertura:
+    """Distancias de las atenciones del mapa a su base más cercana, con el radio de cobertura."""
+
+    def __init__(self, bases, distancias, base_cercana, radio_m, clave=None):
+        # distancias y base_cercana están alineadas con las filas del mapa
+        self.bases = bases
+        self.distancias = distancias
+        self.base_cercana = base_cercana
+        self.radio_m = radio_m
+        self.clave = clave
+
+    def resumen(self):
+        """Atenciones dentro y fuera del radio y distancias típicas (metros)."""
+        distancias = self.distancias[np.isfinite(self.distancias)]
+        if len(distancias) == 0:
+            return {'atenciones': 0, 'fuera': 0, 'porcentaje_fuera': 0.0, 'mediana_m': 0.0, 'p90_m': 0.0}
+        fuera = int((distancias > self.radio_m).sum())
+        return {
+            'atenciones': len(distancias),
+            'fuera': fuera,
+            'porcentaje_fuera': 100.0 * fuera / len(distancias),
+            'mediana_m': float(np.median(distancias)),
+            'p90_m': float(np.quantile(distancias, 0.9)),
+        }
+
+    def por_colonia(self, colonias):
+        """Tabla por colonia: atenciones, fuera del radio y distancias; primero las peor cubiertas."""
+        tabla = pd.DataFrame({
+            'colonia': np.asarray(colonias),
+            'distancia': self.distancias / 1000.0,
+            'fuera': self.distancias > self.radio_m,
+        }).dropna(subset=['distancia'])
+        grupos = tabla.groupby('colonia', observed=True, sort=False)
+        resultado = pd.DataFrame({
+            'Atenciones': grupos.size(),
+            'Fuera del radio': grupos['fuera'].sum(),
+            'Distancia mediana (km)': grupos['distancia'].median().round(2),
+            'Distancia P90 (km)': grupos['distancia'].quantile(0.9).round(2),
+        })
+        resultado.insert(2, '% fuera', (100 * resultado['Fuera del radio'] / resultado['Atenciones']).round(1))
+        resultado = resultado.sort_values(['Fuera del radio', 'Distancia P90 (km)'], ascending=False)
+        resultado.index = [str(c).title() for c in resultado.index]
+        return resultado.rename_axis('Colonia').reset_index()
+
+    def por_base(self):
+        """Atenciones cuya base más cercana es cada base."""
+        conteos = np.bincount(self.base_cercana[self.base_cercana >= 0], minlength=len(self.bases))
+        return pd.DataFrame({'Base': self.bases.nombres, 'Atenciones más cercanas': conteos}).sort_values(
+            'Atenciones más cercanas', ascending=False, ignore_index=True
+        )
+
+# --- CAPA DEL MAPA ---
+
+def escala_cobertura(radio_m):
+    """Escala por clases de distancia (km) relativas al radio de cobertura."""
+    cortes = [0.0] + [radio_m * f / 1000.0 for f in CLASES_RADIO] + [radio_m * (CLASES_RADIO[-1] + 0.5) / 1000.0]
+    return cm.StepColormap(
+        list(COLORES_DISTANCIA),
+        index=cortes,
+        vmin=cortes[0],
+        vmax=cortes[-1],
+        caption='Distancia a la base más cercana (km)'
+    )
+
+def celdas_distancia(lat, lon, distancias, resolucion_m=RESOLUCION_COBERTURA):
+    """Celdas de `resolucion_m` metros con [lat, lon, atenciones, distancia media] (misma rejilla que el calor)."""
+    lat = np.asarray(lat, dtype=np.float64)
+    lon = np.asarray(lon, dtype=np.float64)
+    distancias = np.asarray(distancias, dtype=np.float64)
+    validos = np.isfinite(lat) & np.isfinite(lon) & np.isfinite(distancias)
+    lat, lon, distancias = lat[validos], lon[validos], distancias[validos]
+    if len(lat) == 0:
+        return np.empty((0, 4))
+
+    inversa, lat_celda, lon_celda, conteos = celdas_rejilla(lat, lon, resolucion_m)
+    distancia_media = np.bincount(inversa, weights=distancias, minlength=len(conteos)) / conteos
+    return np.column_stack([lat_celda, lon_celda, conteos, distancia_media])
+
+def capa_cobertura(cobertura, lat, lon, nombre="🚑 Cobertura de bases", resolucion_m=RESOLUCION_COBERTURA):
+    """Celdas coloreadas por distancia a la base más cercana, bases y círculos del radio."""
+    capa = folium.FeatureGroup(name=nombre, show=True)
+
+    # Color de cada celda por clase, calculado de forma vectorizada
+    celdas = celdas_distancia(lat, lon, cobertura.distancias, resolucion_m)
+    while len(celdas) > MAX_CELDAS:
+        resolucion_m *= 2
+        celdas = celdas_distancia(lat, lon, cobertura.distancias, resolucion_m)
+    clases = np.digitize(celdas[:, 3], [cobertura.radio_m * f for f in CLASES_RADIO])
+    colores = np.asarray(COLORES_DISTANCIA, dtype=object)[clases]
+    features = [
+        {
+            'type': 'Feature',
+            'geometry': {'type': 'Point', 'coordinates': [lon_celda, lat_celda]},
+            'properties': {'color': color, 'atenciones': int(conteo), 'distancia': f"{distancia / 1000:.2f} km"},
+        }
+        for lat_celda, lon_celda, conteo, distancia, color in zip(
+            celdas[:, 0].tolist(), celdas[:, 1].tolist(), celdas[:, 2].tolist(), celdas[:, 3].tolist(), colores.tolist()
+        )
+    ]
+    folium.GeoJson(
+        {'type': 'FeatureCollection', 'features': features},
+        marker=folium.CircleMarker(radius=5, weight=0, fill=True, fill_opacity=0.75),
+        # El color se aplica en el navegador: sin un estilo por feature en el HTML
+        on_each_feature=folium.JsCode(
+            "function(feature, layer) { layer.setStyle({fillColor: feature.properties.color}); }"
+        ),
+        tooltip=folium.GeoJsonTooltip(
+            fields=['distancia', 'atenciones'],
+            aliases=['Distancia media a la base:', 'Atenciones:'],
+            style="font-family: Arial; font-size: 12px;"
+        )
+    ).add_to(capa)
+
+    bases = cobertura.bases
+    for nombre_base, lat_base, lon_base in zip(bases.nombres, bases.lat.tolist(), bases.lon.tolist()):
+        folium.Circle(
+            location=[lat_base, lon_base],
+            radius=cobertura.radio_m,
+            color='#333333',
+            weight=1,
+            fill=True,
+            fill_opacity=0.04
+        ).add_to(capa)
+        folium.Marker(
+            location=[lat_base, lon_base],
+            tooltip=str(nombre_base),
+            icon=folium.Icon(color='red', icon='plus-sign')
+        ).add_to(capa)
+    return capa
+
+# --- CACHÉ POR CONJUNTO LIMPIO Y BASES ---
+
+def obtener_distancias(clave, bases, lat, lon):
+    """(distancias, base más cercana) de cada atención, compartidas entre sesiones para la misma clave."""
+    if clave is None:
+        return bases.mas_cercana(lat, lon)
+    return cache.obtener(('distancias_bases', clave), lambda: bases.mas_cercana(lat, lon))
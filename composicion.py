@@ -0,0 +1,132 @@
+# --- COMPOSICIÓN INCREMENTAL DEL MAPA ---
+# Cada capa pesada (límites, nombres, puntos, calor) se construye y se renderiza
+# una sola vez por combinación de entradas. El resultado (JavaScript, HTML y
+# cabeceras ya generados) se guarda con la clave de sus entradas y se vuelve a
+# montar en el mapa nuevo de cada rerun sin tocar los datos. El mapa usa un id
+# fijo para que los scripts guardados sigan apuntando a la variable correcta.
+#
+# Las piezas renderizadas son texto de solo lectura y viven en el caché
+# compartido: dos sesiones con el mismo archivo y rango usan las mismas. Cada
+# mapa recibe su propio elemento CapaRenderizada, que solo apunta a ellas.
+
+import folium
+from branca.element import Element
+from folium.elements import JSCSSMixin
+from folium.map import Layer
+from jinja2 import Template
+
+from cache_compartido import cache
+
+# Id fijo del mapa: las capas guardadas hacen `.addTo(map_principal)`
+ID_MAPA = "principal"
+
+class _Texto(Element):
+    """Fragmento ya renderizado que se inserta tal cual, sin pasar por Jinja."""
+
+    def __init__(self, texto):
+        super().__init__()
+        self.texto = texto
+
+    def render(self, **kwargs):
+        return self.texto
+
+def _recorrer(elemento):
+    yield elemento
+    for hijo in elemento._children.values():
+        yield from _recorrer(hijo)
+
+def _secciones(figura):
+    return {
+        'header': figura.header._children,
+        'html': figura.html._children,
+        'script': figura.script._children,
+    }
+
+class PiezasRenderizadas:
+    """Lo que una capa Folium agrega a la figura al renderizarse, como texto."""
+
+    def __init__(self, capa):
+        self.nombre_capa = capa.layer_name
+        self.overlay = capa.overlay
+        self.control = capa.control
+        self.show = capa.show
+        self.nombre = capa.get_name()
+
+        # Librerías JS/CSS que necesita la capa (streamlit-folium las busca aquí)
+        self.default_js, self.default_css = [], []
+        for elemento in _recorrer(capa):
+            self.default_js.extend(getattr(elemento, 'default_js', []))
+            self.default_css.extend(getattr(elemento, 'default_css', []))
+        self.default_js = list(dict.fromkeys(self.default_js))
+        self.default_css = list(dict.fromkeys(self.default_css))
+
+        # Se renderiza en un mapa de trabajo con el mismo id que el mapa real
+        # y se guarda solo lo que la capa agregó a la figura
+        mapa = folium.Map(tiles=None)
+        mapa._id = ID_MAPA
+        figura = mapa.get_root()
+        figura.render()
+        base = {seccion: set(hijos) for seccion, hijos in _secciones(figura).items()}
+        mapa.add_child(capa)
+        figura.render()
+        piezas = {
+            seccion: [(nombre, hijo.render()) for nombre, hijo in hijos.items() if nombre not in base[seccion]]
+            for seccion, hijos in _secciones(figura).items()
+        }
+        self.header = piezas['header']
+        self.html = piezas['html']
+        self.script = "\n".join(texto for _, texto in piezas['script'])
+
+class CapaRenderizada(JSCSSMixin, Layer):
+    """Capa que monta en un mapa las piezas ya renderizadas de otra."""
+
+    # streamlit-folium arma el mapa con la macro `script` de cada hijo y no con render()
+    _template = Template("{% macro script(this, kwargs) %}{{ this.piezas.script }}{% endmacro %}")
+
+    def __init__(self, piezas):
+        super().__init__(
+            name=piezas.nombre_capa,
+            overlay=piezas.overlay,
+            control=piezas.control,
+            show=piezas.show
+        )
+        self.piezas = piezas
+        # Librerías JS/CSS que necesita la capa (streamlit-folium las busca aquí)
+        self.default_js = piezas.default_js
+        self.default_css = piezas.default_css
+
+    def get_name(self):
+        return self.piezas.nombre
+
+    def render(self, **kwargs):
+        figura = self.get_root()
+        for nombre, texto in self.piezas.header:
+            figura.header.add_child(_Texto(texto), name=nombre)
+        for nombre, texto in self.piezas.html:
+            figura.html.add_child(_Texto(texto), name=nombre)
+        figura.script.add_child(_Texto(self.piezas.script), name=self.get_name())
+
+class ComposicionMapa:
+    """Claves de las capas de una sesión; las capas renderizadas están en el caché compartido."""
+
+    def __init__(self, sesion=None):
+        self.sesion = sesion
+        self._claves = {}
+
+    def capa(self, nombre, clave, constructor):
+        """Devuelve la capa ya renderizada para esa clave; si no existe, la construye y la guarda."""
+        if clave is None:
+            return constructor()
+        piezas = cache.obtener(
+            ('capa', nombre, clave),
+            lambda: PiezasRenderizadas(constructor()),
+            sesion=self.sesion,
+            ranura=('capa', nombre)
+        )
+        self._claves[nombre] = clave
+        return CapaRenderizada(piezas)
+
+    def limpiar(self):
+        for nombre in self._claves:
+            cache.liberar(self.sesion, ('capa', nombre))
+        self._claves.clear()
@@ -0,0 +1,127 @@
+# --- MAPA COROPLÉTICO POR COLONIA ---
+# Para vistas de toda la ciudad no hacen falta los puntos: las atenciones se
+# cuentan por colonia normalizada (y por fuente) con un groupby vectorizado, los
+# conteos se unen a las colonias del GeoJSON por su nombre normalizado y cada
+# polígono se colorea según su clase. El HTML depende del número de polígonos y
+# no del de filas, así que un rango de varios años carga igual de rápido.
+# Conteos y escala se calculan una vez por datos y rango de fechas, y los usan
+# tanto la capa como las métricas de la página.
+
+import numpy as np
+import folium
+import branca.colormap as cm
+
+from cache_compartido import cache
+from normalizacion import limpiar_columna
+from procesamiento import COLUMNA_FUENTE
+from union_espacial import nombres_de_features
+
+FUENTES = ('Protección Civil', 'Servicios Médicos')
+
+# Escala secuencial (ColorBrewer YlOrRd) y relleno de las colonias sin atenciones
+COLORES_COROPLETAS = ('#ffffb2', '#fecc5c', '#fd8d3c', '#f03b20', '#bd0026')
+COLOR_SIN_ATENCIONES = '#f2f2f2'
+
+def conteos_por_colonia(df, col_colonia, usar_sm=False):
+    """Atenciones por colonia normalizada: columna 'total' y, con SM, una por fuente."""
+    colonias = limpiar_columna(df[col_colonia])
+    if usar_sm:
+        conteos = df.groupby([colonias, df[COLUMNA_FUENTE]], observed=True).size().unstack(fill_value=0)
+        conteos = conteos.reindex(columns=list(FUENTES), fill_value=0)
+        conteos['total'] = conteos.sum(axis=1)
+    else:
+        conteos = df.groupby(colonias, observed=True).size().to_frame('total')
+    conteos.index = conteos.index.astype(object)
+    return conteos
+
+def atenciones_sin_poligono(conteos, gj_data, campo):
+    """Atenciones cuya colonia no coincide con ninguna colonia del GeoJSON."""
+    nombres = set(nombres_de_features(gj_data, campo))
+    return int(conteos.loc[~conteos.index.isin(nombres), 'total'].sum())
+
+def dias_del_rango(df, col_fecha):
+    """Días entre la primera y la última atención, inclusive (para el promedio diario)."""
+    if df.empty:
+        return 1
+    fechas = df[col_fecha]
+    return max(1, (fechas.max().normalize() - fechas.min().normalize()).days + 1)
+
+def escala_coropletas(totales):
+    """Escala por clases de cuantiles de las colonias con atenciones."""
+    valores = np.asarray(totales, dtype=np.float64)
+    valores = valores[valores > 0]
+    if len(valores) == 0:
+        cortes = [0, 1]
+    else:
+        cortes = np.unique(np.round(np.quantile(valores, np.linspace(0, 1, len(COLORES_COROPLETAS) + 1))))
+        cortes = cortes.tolist() if len(cortes) > 1 else [cortes[0], cortes[0] + 1]
+    return cm.StepColormap(
+        list(COLORES_COROPLETAS[:len(cortes) - 1]),
+        index=cortes,
+        vmin=cortes[0],
+        vmax=cortes[-1],
+        caption='Atenciones por colonia'
+    )
+
+def obtener_conteos(clave, df, col_colonia, usar_sm=False):
+    """(conteos, escala) de las atenciones por colonia, compartidos entre sesiones para la misma clave."""
+    def construir():
+        conteos = conteos_por_colonia(df, col_colonia, usar_sm)
+        return conteos, escala_coropletas(conteos['total'])
+    if clave is None:
+        return construir()
+    return cache.obtener(('conteos_colonias', clave), construir)
+
+def propiedades_coropletas(gj_data, campo, conteos, escala, usar_sm=False, dias=1):
+    """Propiedades de cada feature (en el orden del GeoJSON) con conteos, tasas y color."""
+    nombres = nombres_de_features(gj_data, campo)
+    alineados = conteos.reindex(nombres).fillna(0).astype(np.int64)
+    total_general = int(conteos['total'].sum()) or 1
+    propiedades = []
+    for original, fila in zip(gj_data.columna(campo), alineados.to_dict('records')):
+        total = int(fila['total'])
+        valores = {
+            'colonia': str(original).title() if original is not None else '',
+            'atenciones': total,
+            'porcentaje': f"{100 * total / total_general:.1f}%",
+            'por_dia': f"{total / dias:.2f}",
+            'relleno': escala.rgb_hex_str(total) if total > 0 else COLOR_SIN_ATENCIONES,
+        }
+        if usar_sm:
+            valores['pc'] = int(fila[FUENTES[0]])
+            valores['sm'] = int(fila[FUENTES[1]])
+            valores['porcentaje_sm'] = f"{100 * valores['sm'] / total:.0f}%" if total else '—'
+        propiedades.append(valores)
+    return propiedades
+
+def capa_coropletas(gj_data, campo, conteos, escala, usar_sm=False, dias=1, limites=None):
+    """GeoJson (o TopoJson con límites simplificados) de colonias coloreadas por atenciones."""
+    propiedades = propiedades_coropletas(gj_data, campo, conteos, escala, usar_sm, dias)
+    campos = ['colonia', 'atenciones', 'porcentaje', 'por_dia']
+    alias = ['Colonia:', 'Atenciones:', '% del total:', 'Promedio diario:']
+    if usar_sm:
+        campos += ['pc', 'sm', 'porcentaje_sm']
+        alias += ['Protección Civil:', 'Servicios Médicos:', '% Servicios Médicos:']
+    estilo = lambda x: {
+        'fillColor': x['properties']['relleno'],
+        'color': '#808080',
+        'weight': 1,
+        'fillOpacity': 0.7
+    }
+    tooltip = folium.GeoJsonTooltip(fields=campos, aliases=alias, style="font-family: Arial; font-size: 12px;")
+
+    # Las geometrías (originales o simplificadas) se comparten; solo se copian las propiedades
+    if limites is not None and limites.es_topojson:
+        objeto = limites.datos['objects']['colonias']
+        geometrias = [{**geometria, 'properties': valores} for geometria, valores in zip(objeto['geometries'], propiedades)]
+        datos = {**limites.datos, 'objects': {'colonias': {**objeto, 'geometries': geometrias}}}
+        return folium.TopoJson(
+            datos, 'objects.colonias', name='Atenciones por colonia', style_function=estilo, tooltip=tooltip
+        )
+    # Sin límites simplificados el árbol GeoJSON se arma solo para esta capa (que queda en caché)
+    base = limites.datos if limites is not None else gj_data.a_geojson()
+    datos = {
+        **base,
+        'features': [{**feature, 'properties': valores} for feature, valores in zip(base['features'], propiedades)]
+    }
+    return folium.GeoJson(datos, name='Atenciones por colonia', style_function=estilo, tooltip=tooltip)
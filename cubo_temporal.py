@@ -0,0 +1,199 @@
+# --- CUBO ESPACIO-TIEMPO DE DENSIDAD ---
+# Las atenciones de todo el conjunto limpio se asignan una sola vez a celdas de
+# `resolucion_m` metros y se cuentan por día. El cubo guarda, para cada celda
+# no vacía, la suma acumulada de atenciones a lo largo del eje de días: las
+# atenciones de un rango de fechas son la resta de dos filas del cubo, sin
+# volver a recorrer las filas del rango. El mismo cubo da los cuadros (por
+# día o por semana) del mapa de calor animado, así que el navegador recibe
+# celdas con peso y no los puntos de cada cuadro.
+#
+# Con muchos días y muchas celdas el cubo diario no cabe en MAX_BYTES_CUBO; en
+# ese caso se acumula cada PASOS_CUBO días y los días sueltos de los extremos
+# del rango se suman desde las atenciones ordenadas por día.
+
+import datetime
+
+import numpy as np
+from folium.plugins import HeatMap, HeatMapWithTime
+
+from capas import celdas_rejilla, DECIMALES_COORDENADAS, RADIO_CALOR, GRADIENTE_CALOR
+from fechas import EPOCA
+from cache_compartido import cache
+
+# --- CONFIGURACIÓN ---
+# Memoria máxima de las sumas acumuladas de un cubo
+MAX_BYTES_CUBO = 64 * 1024 * 1024
+# Días entre filas acumuladas, del más fino al más grueso
+PASOS_CUBO = (1, 7, 28, 91)
+
+# Días por cuadro de la animación
+PASOS_ANIMACION = {'dia': 1, 'semana': 7}
+# Si el rango tiene más cuadros, cada cuadro abarca más días
+MAX_CUADROS_ANIMACION = 366
+# Celda (metros) de la animación cuando el calor no usa celdas
+RESOLUCION_ANIMACION = 50
+
+def _fecha_a_dia(fecha):
+    return (fecha - EPOCA).days
+
+def _dia_a_texto(dia):
+    return (EPOCA + datetime.timedelta(days=int(dia))).strftime('%d/%m/%Y')
+
+class CuboDensidad:
+    """Sumas acumuladas por día de las atenciones de cada celda de la rejilla."""
+
+    def __init__(self, lat, lon, dias, resolucion_m):
+        # dias: días desde 1970 de cada atención
+        lat = np.asarray(lat, dtype=np.float64)
+        lon = np.asarray(lon, dtype=np.float64)
+        dias = np.asarray(dias, dtype=np.int64)
+        validos = np.isfinite(lat) & np.isfinite(lon)
+        lat, lon, dias = lat[validos], lon[validos], dias[validos]
+        self.resolucion_m = resolucion_m
+
+        if len(lat) == 0:
+            self.lat_celda = self.lon_celda = np.empty(0)
+            self.dia_min, self.n_dias, self.paso = 0, 0, 1
+            self.dias_evento = np.empty(0, dtype=np.int64)
+            self.celda_evento = np.empty(0, dtype=np.int64)
+            self.acumulado = np.zeros((1, 0), dtype=np.uint32)
+            return
+
+        # Misma rejilla que el calor (`celdas_rejilla`), fija para todo el conjunto
+        inversa, self.lat_celda, self.lon_celda, _ = celdas_rejilla(lat, lon, resolucion_m)
+        n_celdas = len(self.lat_celda)
+
+        # Atenciones ordenadas por día, para los días sueltos de los extremos
+        orden = np.argsort(dias, kind='stable')
+        self.dias_evento = dias[orden]
+        self.celda_evento = inversa[orden]
+        self.dia_min = int(self.dias_evento[0])
+        self.n_dias = int(self.dias_evento[-1]) - self.dia_min + 1
+
+        # El paso más fino cuyas sumas acumuladas caben en el presupuesto
+        tipo = np.uint32 if len(lat) > np.iinfo(np.uint16).max else np.uint16
+        for paso in PASOS_CUBO:
+            filas = -(-self.n_dias // paso) + 1
+            if filas * n_celdas * np.dtype(tipo).itemsize <= MAX_BYTES_CUBO:
+                break
+        self.paso = paso
+
+        # acumulado[k]: atenciones de cada celda antes del día dia_min + k * paso
+        bloques = (self.dias_evento - self.dia_min) // paso
+        limites = np.searchsorted(bloques, np.arange(filas - 1), side='right')
+        self.acumulado = np.zeros((filas, n_celdas), dtype=tipo)
+        suma = np.zeros(n_celdas, dtype=np.int64)
+        inicio = 0
+        for k, fin in enumerate(limites):
+            suma += np.bincount(self.celda_evento[inicio:fin], minlength=n_celdas)
+            self.acumulado[k + 1] = suma
+            inicio = fin
+
+    def __len__(self):
+        return len(self.dias_evento)
+
+    @property
+    def n_celdas(self):
+        return len(self.lat_celda)
+
+    @property
+    def nbytes(self):
+        return self.acumulado.nbytes + self.dias_evento.nbytes + self.celda_evento.nbytes
+
+    def _sueltos(self, desde, hasta):
+        """Atenciones por celda de los días [desde, hasta) relativos a dia_min."""
+        inicio, fin = np.searchsorted(self.dias_evento, [self.dia_min + desde, self.dia_min + hasta])
+        return np.bincount(self.celda_evento[inicio:fin], minlength=self.n_celdas)
+
+    def conteos_dias(self, dia_inicio, dia_fin):
+        """Atenciones de cada celda entre dos días desde 1970, inclusive."""
+        desde = min(max(dia_inicio - self.dia_min, 0), self.n_dias)
+        hasta = min(max(dia_fin - self.dia_min + 1, 0), self.n_dias)
+        if hasta <= desde:
+            return np.zeros(self.n_celdas, dtype=np.int64)
+        k_desde = -(-desde // self.paso)
+        # El último bloque puede ser más corto que el paso: termina en n_dias
+        k_hasta = len(self.acumulado) - 1 if hasta == self.n_dias else hasta // self.paso
+        if k_hasta <= k_desde:
+            return self._sueltos(desde, hasta)
+        conteos = self.acumulado[k_hasta].astype(np.int64) - self.acumulado[k_desde]
+        if desde < k_desde * self.paso:
+            conteos += self._sueltos(desde, k_desde * self.paso)
+        if min(k_hasta * self.paso, self.n_dias) < hasta:
+            conteos += self._sueltos(k_hasta * self.paso, hasta)
+        return conteos
+
+    def _celdas_con_peso(self, conteos):
+        presentes = np.flatnonzero(conteos)
+        return np.column_stack([
+            self.lat_celda[presentes], self.lon_celda[presentes], conteos[presentes].astype(np.float64)
+        ])
+
+    def rango(self, fecha_inicio, fecha_fin):
+        """[lat, lon, peso] de las celdas con atenciones entre ambas fechas (inclusive)."""
+        return self._celdas_con_peso(self.conteos_dias(_fecha_a_dia(fecha_inicio), _fecha_a_dia(fecha_fin)))
+
+    def cuadros(self, fecha_inicio, fecha_fin, dias_por_cuadro=1):
+        """Cuadros consecutivos de `dias_por_cuadro` días: (datos de cada cuadro, etiquetas)."""
+        dia_inicio, dia_fin = _fecha_a_dia(fecha_inicio), _fecha_a_dia(fecha_fin)
+        total = dia_fin - dia_inicio + 1
+        if total <= 0:
+            return [], []
+        dias_por_cuadro = max(dias_por_cuadro, -(-total // MAX_CUADROS_ANIMACION))
+        datos, etiquetas = [], []
+        for inicio in range(dia_inicio, dia_fin + 1, dias_por_cuadro):
+            fin = min(inicio + dias_por_cuadro - 1, dia_fin)
+            celdas = self._celdas_con_peso(self.conteos_dias(inicio, fin))
+            celdas[:, :2] = np.round(celdas[:, :2], DECIMALES_COORDENADAS - 1)
+            datos.append(celdas.tolist())
+            etiquetas.append(_dia_a_texto(inicio) if fin == inicio else f"{_dia_a_texto(inicio)} – {_dia_a_texto(fin)}")
+        return datos, etiquetas
+
+# --- CAPAS ---
+
+def capa_calor_cubo(cubo, fecha_inicio, fecha_fin):
+    """HeatMap del rango de fechas a partir de las sumas acumuladas del cubo."""
+    return HeatMap(
+        cubo.rango(fecha_inicio, fecha_fin).tolist(),
+        radius=RADIO_CALOR,
+        gradient=GRADIENTE_CALOR
+    )
+
+def capa_calor_animada(cubo, fecha_inicio, fecha_fin, dias_por_cuadro=1, nombre="🎞️ Calor en el tiempo"):
+    """HeatMapWithTime con un cuadro por día o por semana del rango."""
+    datos, etiquetas = cubo.cuadros(fecha_inicio, fecha_fin, dias_por_cuadro)
+    return HeatMapWithTime(
+        datos,
+        index=etiquetas,
+        name=nombre,
+        radius=RADIO_CALOR,
+        # HeatMapWithTime espera las claves del gradiente como texto
+        gradient={str(clave): color for clave, color in GRADIENTE_CALOR.items()},
+        min_opacity=0.3,
+        max_opacity=0.8,
+        show=False
+    )
+
+# --- CACHÉ POR CONJUNTO LIMPIO Y RESOLUCIÓN ---
+
+def obtener_cubo(clave, lat, lon, dias, resolucion_m):
+    """Devuelve el cubo de densidad, compartido entre sesiones para la misma clave."""
+    if clave is None:
+        return CuboDensidad(lat, lon, dias, resolucion_m)
+    return cache.obtener(('cubo', clave), lambda: CuboDensidad(lat, lon, dias, resolucion_m))
+
+def obtener_cubos(clave, df, col_lat, col_lon, dias, resolucion_m, fuentes=None):
+    """Cubos de densidad por llave: 'todas' y, con `fuentes`, uno por fuente.
+
+    `fuentes` es la Serie con la fuente de cada atención, alineada con `df` y `dias`.
+    """
+    lat, lon = df[col_lat].to_numpy(dtype=float), df[col_lon].to_numpy(dtype=float)
+    cubos = {'todas': obtener_cubo(None if clave is None else (clave, 'todas'), lat, lon, dias, resolucion_m)}
+    if fuentes is not None:
+        fuentes = fuentes.to_numpy()
+        for fuente in ('Protección Civil', 'Servicios Médicos'):
+            filas = fuentes == fuente
+            cubos[fuente] = obtener_cubo(
+                None if clave is None else (clave, fuente), lat[filas], lon[filas], dias[filas], resolucion_m
+            )
+    return cubos
@@ -0,0 +1,73 @@
+# --- EXPORTACIÓN DEL MAPA ---
+# El HTML ya renderizado se empaqueta en memoria, sin archivos temporales:
+# tal cual, comprimido en .zip o .gz y, opcionalmente, minificado (sin
+# sangrías y con los datos JSON en forma compacta).
+
+import io
+import re
+import gzip
+import json
+import zipfile
+
+# Nombre del archivo descargado (sin extensión)
+NOMBRE_EXPORTACION = "mapa_atenciones_prehospitalarias"
+
+# Formato: (extensión, tipo MIME)
+FORMATOS_EXPORTACION = {
+    'HTML': ('.html', 'text/html'),
+    'HTML comprimido (.zip)': ('.zip', 'application/zip'),
+    'HTML comprimido (.gz)': ('.html.gz', 'application/gzip'),
+}
+
+# Argumento JSON de una llamada: `nombre({...})` o `nombre([...])`
+_INICIO_JSON = re.compile(r'\((?=[\[{])')
+
+# Caracteres que no pueden quedar sin escapar dentro de un <script>
+_ESCAPES_SCRIPT = {'<': '\\u003c', '>': '\\u003e', '&': '\\u0026', '\u2028': '\\u2028', '\u2029': '\\u2029'}
+
+def _json_compacto(valor):
+    texto = json.dumps(valor, ensure_ascii=False, separators=(',', ':'))
+    for caracter, escape in _ESCAPES_SCRIPT.items():
+        texto = texto.replace(caracter, escape)
+    return texto
+
+def _compactar_json(html):
+    """Reescribe sin espacios los argumentos JSON de las llamadas del script."""
+    decodificador = json.JSONDecoder()
+    partes, posicion = [], 0
+    for coincidencia in _INICIO_JSON.finditer(html):
+        inicio = coincidencia.end()
+        if inicio < posicion:
+            continue
+        try:
+            valor, fin = decodificador.raw_decode(html, inicio)
+        except ValueError:
+            # Objetos de JavaScript (funciones, comas finales): se dejan igual
+            continue
+        partes.append(html[posicion:inicio])
+        partes.append(_json_compacto(valor))
+        posicion = fin
+    partes.append(html[posicion:])
+    return ''.join(partes)
+
+def minificar_html(html):
+    """Quita sangrías y líneas vacías y compacta los datos JSON del mapa."""
+    html = _compactar_json(html)
+    html = re.sub(r'[ \t]+\n', '\n', html)
+    html = re.sub(r'\n[ \t]+', '\n', html)
+    return re.sub(r'\n{2,}', '\n', html)
+
+def exportar_html(html, formato='HTML', minificar=False):
+    """Devuelve (bytes, nombre de archivo, tipo MIME) del mapa en el formato pedido."""
+    extension, mime = FORMATOS_EXPORTACION[formato]
+    if minificar:
+        html = minificar_html(html)
+    datos = html.encode('utf-8')
+    if extension == '.zip':
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, 'w', compression=zipfile.ZIP_DEFLATED, compresslevel=9) as archivo:
+            archivo.writestr(f"{NOMBRE_EXPORTACION}.html", datos)
+        datos = buffer.getvalue()
+    elif extension == '.html.gz':
+        datos = gzip.compress(datos, compresslevel=9, mtime=0)
+    return datos, f"{NOMBRE_EXPORTACION}{extension}", mime
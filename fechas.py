@@ -0,0 +1,60 @@
+# --- ÍNDICE ORDENADO DE FECHAS ---
+# El conjunto limpio se ordena una sola vez por fecha y se guarda el día de cada
+# fila como entero (días desde 1970). Filtrar un rango es buscar dos posiciones
+# con searchsorted y tomar un slice: no se crean objetos date por fila ni se
+# recorre toda la columna en cada rerun.
+
+import datetime
+
+import numpy as np
+
+EPOCA = datetime.date(1970, 1, 1)
+
+def _a_dia(fecha):
+    """Día ordinal (desde 1970) de una fecha."""
+    return (fecha - EPOCA).days
+
+def _a_fecha(dia):
+    """Fecha correspondiente a un día ordinal."""
+    return EPOCA + datetime.timedelta(days=int(dia))
+
+def dias_de_fechas(fechas):
+    """Día (desde 1970) de cada valor de una Serie datetime, en la fecha local."""
+    if fechas.dt.tz is not None:
+        # Se usa la fecha local, igual que `.dt.date`
+        fechas = fechas.dt.tz_localize(None)
+    return fechas.to_numpy(dtype='datetime64[ns]').astype('datetime64[D]').astype(np.int64)
+
+class IndiceFechas:
+    """Atenciones ordenadas por fecha, con el día de cada fila precalculado."""
+
+    def __init__(self, df, col_fecha):
+        fechas = df[col_fecha]
+        # Orden cronológico por instante; con zona horaria el día de cada fila
+        # sigue siendo su fecha local, que no retrocede a lo largo del orden
+        orden = np.argsort(fechas.to_numpy(dtype='datetime64[ns]'), kind='stable')
+        self.orden = orden
+        self.df = df.iloc[orden]
+        self.dias = dias_de_fechas(fechas)[orden]
+
+    def __len__(self):
+        return len(self.dias)
+
+    @property
+    def fecha_min(self):
+        return _a_fecha(self.dias[0])
+
+    @property
+    def fecha_max(self):
+        return _a_fecha(self.dias[-1])
+
+    def posiciones(self, fecha_inicio, fecha_fin):
+        """Devuelve (inicio, fin) del slice con las filas entre ambas fechas, inclusive."""
+        inicio = int(np.searchsorted(self.dias, _a_dia(fecha_inicio), side='left'))
+        fin = int(np.searchsorted(self.dias, _a_dia(fecha_fin), side='right'))
+        return inicio, max(inicio, fin)
+
+    def filtrar(self, fecha_inicio, fecha_fin):
+        """Filas entre ambas fechas (inclusive) como slice del DataFrame ordenado."""
+        inicio, fin = self.posiciones(fecha_inicio, fecha_fin)
+        return self.df.iloc[inicio:fin]
@@ -0,0 +1,354 @@
+# --- GEOJSON DE COLONIAS EN COLUMNAS ---
+# `json.load` de un GeoJSON estatal (50–200 MB) arma un árbol de diccionarios
+# y listas de floats de Python que ocupa varias veces el archivo. Aquí el
+# archivo se lee por bloques y cada feature se decodifica sola (con el
+# decodificador de C de `json`) y se pasa de inmediato a columnas: una lista
+# por propiedad y las coordenadas en un único arreglo float64 con los
+# desplazamientos anillo -> parte -> feature de `geometria.IndiceGeometrico`.
+# En memoria solo vive el bloque leído y la feature en curso.
+#
+# El resultado se puede guardar en un solo archivo (cabecera JSON y arreglos
+# crudos alineados) que se vuelve a abrir con np.memmap: los vértices quedan en
+# el caché de páginas del sistema y no en la memoria del proceso. El árbol de
+# diccionarios solo se arma, una vez por capa en caché, cuando Folium necesita
+# el GeoJSON completo (límites sin simplificar o coropletas).
+
+import os
+import json
+import codecs
+import itertools
+import struct
+import tempfile
+from io import BytesIO
+
+import numpy as np
+
+# --- CONFIGURACIÓN ---
+# Bytes leídos del archivo por bloque
+TAMANO_LECTURA = 4 * 1024 * 1024
+
+# Firma y versión del archivo guardado
+FIRMA_ARCHIVO = b'COLONIAS'
+VERSION_ARCHIVO = 1
+
+_ESPACIOS = '\x20\t\n\r'
+
+class ColoniasGeoJSON:
+    """Features de un GeoJSON como columnas de propiedades y arreglos planos de anillos."""
+
+    def __init__(self, propiedades, coordenadas, inicio_anillos, inicio_partes, inicio_features,
+                 otras_geometrias=None, cabecera=None, bytes_geojson=0):
+        # propiedades: {campo: lista con el valor de cada feature (None si falta)}
+        # coordenadas: (n_vertices, 2) en orden [lon, lat]
+        # inicio_anillos, inicio_partes, inicio_features: como en IndiceGeometrico
+        # otras_geometrias: {feature: geometría} de las que no son polígonos
+        self.propiedades = propiedades
+        self.coordenadas = coordenadas
+        self.inicio_anillos = inicio_anillos
+        self.inicio_partes = inicio_partes
+        self.inicio_features = inicio_features
+        self.otras_geometrias = otras_geometrias or {}
+        self.cabecera = cabecera if cabecera is not None else {'type': 'FeatureCollection'}
+        self.bytes_geojson = bytes_geojson
+        self.n_features = len(inicio_features) - 1
+
+    @classmethod
+    def desde_geojson(cls, gj_data):
+        """Pasa a columnas un GeoJSON ya cargado como diccionario."""
+        acumulador = _Acumulador()
+        for feature in gj_data.get('features', []):
+            acumulador.agregar(feature)
+        cabecera = {k: v for k, v in gj_data.items() if k != 'features'}
+        return acumulador.terminar(cabecera, len(json.dumps(gj_data)))
+
+    def __len__(self):
+        return self.n_features
+
+    @property
+    def campos(self):
+        """Nombres de las propiedades, en el orden en que aparecen en el archivo."""
+        return list(self.propiedades)
+
+    def columna(self, campo):
+        """Valor de la propiedad en cada feature (None donde falta)."""
+        valores = self.propiedades.get(campo)
+        return list(valores) if valores is not None else [None] * self.n_features
+
+    def propiedades_de(self, k):
+        return {campo: valores[k] for campo, valores in self.propiedades.items() if valores[k] is not None}
+
+    def geometria(self, k):
+        """Geometría GeoJSON de la feature k, armada desde los arreglos."""
+        if k in self.otras_geometrias:
+            return self.otras_geometrias[k]
+        poligonos = []
+        for parte in range(self.inicio_features[k], self.inicio_features[k + 1]):
+            poligonos.append([
+                self.coordenadas[self.inicio_anillos[anillo]:self.inicio_anillos[anillo + 1]].tolist()
+                for anillo in range(self.inicio_partes[parte], self.inicio_partes[parte + 1])
+            ])
+        if len(poligonos) == 1:
+            return {'type': 'Polygon', 'coordinates': poligonos[0]}
+        if poligonos:
+            return {'type': 'MultiPolygon', 'coordinates': poligonos}
+        return None
+
+    def a_geojson(self, columnas=None):
+        """FeatureCollection completa; `columnas` ({campo: valores}) reemplaza o agrega propiedades."""
+        features = []
+        for k in range(self.n_features):
+            propiedades = self.propiedades_de(k)
+            for campo, valores in (columnas or {}).items():
+                propiedades[campo] = valores[k]
+            features.append({'type': 'Feature', 'properties': propiedades, 'geometry': self.geometria(k)})
+        return {**self.cabecera, 'features': features}
+
+    # --- ARCHIVO CON ARREGLOS MAPEABLES ---
+
+    def guardar(self, ruta):
+        """Escribe la cabecera JSON y los arreglos crudos en un archivo (de forma atómica)."""
+        arreglos = {
+            'coordenadas': np.ascontiguousarray(self.coordenadas, dtype=np.float64),
+            'inicio_anillos': np.ascontiguousarray(self.inicio_anillos, dtype=np.int64),
+            'inicio_partes': np.ascontiguousarray(self.inicio_partes, dtype=np.int64),
+            'inicio_features': np.ascontiguousarray(self.inicio_features, dtype=np.int64),
+        }
+        descripcion, posicion = {}, 0
+        for nombre, arreglo in arreglos.items():
+            descripcion[nombre] = {'dtype': arreglo.dtype.str, 'forma': list(arreglo.shape), 'inicio': posicion}
+            posicion += arreglo.nbytes
+        cabecera = json.dumps({
+            'version': VERSION_ARCHIVO,
+            'cabecera': self.cabecera,
+            'propiedades': self.propiedades,
+            'otras_geometrias': {str(k): v for k, v in self.otras_geometrias.items()},
+            'bytes_geojson': self.bytes_geojson,
+            'arreglos': descripcion,
+        }, ensure_ascii=False).encode('utf-8')
+        # Los arreglos empiezan alineados a 8 bytes
+        cabecera += b' ' * (-(len(FIRMA_ARCHIVO) + 8 + len(cabecera)) % 8)
+
+        directorio = os.path.dirname(ruta) or '.'
+        os.makedirs(directorio, exist_ok=True)
+        fd, ruta_tmp = tempfile.mkstemp(dir=directorio, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(FIRMA_ARCHIVO)
+                f.write(struct.pack('<Q', len(cabecera)))
+                f.write(cabecera)
+                for arreglo in arreglos.values():
+                    f.write(arreglo.tobytes())
+            os.replace(ruta_tmp, ruta)
+        except BaseException:
+            try:
+                os.remove(ruta_tmp)
+            except OSError:
+                pass
+            raise
+
+    @classmethod
+    def abrir(cls, ruta, mapear=True):
+        """Abre un archivo guardado; con `mapear` los arreglos se leen del disco bajo demanda."""
+        with open(ruta, 'rb') as f:
+            if f.read(len(FIRMA_ARCHIVO)) != FIRMA_ARCHIVO:
+                raise ValueError(f"{ruta} no es un archivo de colonias")
+            largo, = struct.unpack('<Q', f.read(8))
+            cabecera = json.loads(f.read(largo))
+            inicio_datos = f.tell()
+            if cabecera.get('version') != VERSION_ARCHIVO:
+                raise ValueError(f"{ruta} tiene una versión de formato distinta")
+            arreglos = {}
+            for nombre, info in cabecera['arreglos'].items():
+                dtype, forma = np.dtype(info['dtype']), tuple(info['forma'])
+                if mapear and int(np.prod(forma)) > 0:
+                    arreglos[nombre] = np.memmap(ruta, dtype=dtype, mode='r', offset=inicio_datos + info['inicio'], shape=forma)
+                else:
+                    f.seek(inicio_datos + info['inicio'])
+                    arreglos[nombre] = np.fromfile(f, dtype=dtype, count=int(np.prod(forma))).reshape(forma)
+        return cls(
+            cabecera['propiedades'],
+            arreglos['coordenadas'],
+            arreglos['inicio_anillos'],
+            arreglos['inicio_partes'],
+            arreglos['inicio_features'],
+            {int(k): v for k, v in cabecera['otras_geometrias'].items()},
+            cabecera['cabecera'],
+            cabecera['bytes_geojson']
+        )
+
+def _anillo(vertices):
+    """Arreglo (n, 2+) de un anillo; con vértices [lon, lat] evita el recorrido anidado de np.asarray."""
+    try:
+        plano = np.fromiter(itertools.chain.from_iterable(vertices), dtype=np.float64)
+        if len(plano) == 2 * len(vertices):
+            return plano.reshape(-1, 2)
+        return np.asarray(vertices, dtype=np.float64)
+    except (TypeError, ValueError):
+        return np.empty((0, 0))
+
+class _Acumulador:
+    """Pasa features a columnas una por una, con las mismas reglas que IndiceGeometrico."""
+
+    def __init__(self):
+        self.propiedades = {}
+        self.otras_geometrias = {}
+        self.anillos = []
+        self.inicio_anillos, self.inicio_partes, self.inicio_features = [0], [0], [0]
+        self.total_vertices = 0
+        self.n = 0
+
+    def agregar(self, feature):
+        if not isinstance(feature, dict):
+            raise ValueError("El GeoJSON tiene una feature que no es un objeto.")
+        for campo, valor in (feature.get('properties') or {}).items():
+            valores = self.propiedades.get(campo)
+            if valores is None:
+                valores = self.propiedades[campo] = [None] * self.n
+            if len(valores) == self.n:
+                valores.append(valor)
+        # Campos que esta feature no tiene
+        for valores in self.propiedades.values():
+            if len(valores) == self.n:
+                valores.append(None)
+
+        geom = feature.get('geometry') or {}
+        gtype, coords = geom.get('type'), geom.get('coordinates') or []
+        if gtype == 'Polygon':
+            partes = [coords]
+        elif gtype == 'MultiPolygon':
+            partes = coords
+        else:
+            partes = []
+            if geom:
+                self.otras_geometrias[self.n] = geom
+        for parte in partes:
+            for j, anillo in enumerate(parte):
+                arreglo = _anillo(anillo)
+                if arreglo.ndim != 2 or arreglo.shape[0] < 3 or arreglo.shape[1] < 2:
+                    if j == 0:
+                        break  # sin exterior válido se descarta la parte completa
+                    continue
+                self.anillos.append(arreglo[:, :2])
+                self.total_vertices += arreglo.shape[0]
+                self.inicio_anillos.append(self.total_vertices)
+            if len(self.inicio_anillos) - 1 > self.inicio_partes[-1]:
+                self.inicio_partes.append(len(self.inicio_anillos) - 1)
+        self.inicio_features.append(len(self.inicio_partes) - 1)
+        self.n += 1
+
+    def terminar(self, cabecera, bytes_geojson):
+        coordenadas = np.concatenate(self.anillos) if self.anillos else np.empty((0, 2), dtype=np.float64)
+        return ColoniasGeoJSON(
+            self.propiedades,
+            coordenadas,
+            np.asarray(self.inicio_anillos, dtype=np.int64),
+            np.asarray(self.inicio_partes, dtype=np.int64),
+            np.asarray(self.inicio_features, dtype=np.int64),
+            self.otras_geometrias,
+            cabecera,
+            bytes_geojson
+        )
+
+# --- LECTURA POR BLOQUES ---
+
+class _LectorJSON:
+    """Texto JSON leído por bloques, con decodificación de un valor a la vez."""
+
+    def __init__(self, flujo, tamano_lectura):
+        self.flujo = flujo
+        self.tamano_lectura = tamano_lectura
+        self.decodificador = codecs.getincrementaldecoder('utf-8-sig')()
+        self.json = json.JSONDecoder()
+        self.texto = ''
+        self.pos = 0
+        self.fin = False
+        self.bytes = 0
+
+    def _leer_mas(self, tamano=None):
+        if self.fin:
+            return False
+        datos = self.flujo.read(tamano or self.tamano_lectura)
+        self.bytes += len(datos)
+        self.fin = not datos
+        # Se descarta lo ya consumido antes de agregar el bloque nuevo
+        self.texto = self.texto[self.pos:] + self.decodificador.decode(datos, final=self.fin)
+        self.pos = 0
+        return True
+
+    def caracter(self):
+        """Siguiente carácter que no es espacio ('' al final del archivo)."""
+        while True:
+            largo = len(self.texto)
+            while self.pos < largo and self.texto[self.pos] in _ESPACIOS:
+                self.pos += 1
+            if self.pos < largo or not self._leer_mas():
+                return self.texto[self.pos] if self.pos < largo else ''
+
+    def consumir(self, esperados):
+        caracter = self.caracter()
+        if not caracter or caracter not in esperados:
+            raise ValueError(f"GeoJSON inválido: se esperaba {' o '.join(esperados)} cerca del byte {self.bytes}.")
+        self.pos += 1
+        return caracter
+
+    def valor(self):
+        """Decodifica el siguiente valor; si el bloque lo corta a la mitad, lee más y reintenta."""
+        self.caracter()
+        tamano = self.tamano_lectura
+        while True:
+            try:
+                valor, fin = self.json.raw_decode(self.texto, self.pos)
+                # Un número al final del bloque puede continuar en el siguiente
+                if fin < len(self.texto) or self.fin:
+                    self.pos = fin
+                    return valor
+            except json.JSONDecodeError as e:
+                if self.fin:
+                    raise ValueError(f"GeoJSON inválido: {e.msg}.") from None
+            # Valores más grandes que un bloque: cada reintento lee el doble
+            self._leer_mas(tamano)
+            tamano *= 2
+
+def _abrir(archivo):
+    if isinstance(archivo, (bytes, bytearray)):
+        return BytesIO(archivo), True
+    if isinstance(archivo, (str, os.PathLike)):
+        return open(archivo, 'rb'), True
+    archivo.seek(0)
+    return archivo, False
+
+def leer_geojson(archivo, tamano_lectura=TAMANO_LECTURA):
+    """Lee un GeoJSON (ruta, bytes o archivo subido) por bloques, directo a ColoniasGeoJSON."""
+    flujo, cerrar = _abrir(archivo)
+    try:
+        lector = _LectorJSON(flujo, tamano_lectura)
+        acumulador = _Acumulador()
+        cabecera = {}
+        lector.consumir('{')
+        if lector.caracter() == '}':
+            lector.pos += 1
+        else:
+            while True:
+                clave = lector.valor()
+                lector.consumir(':')
+                if clave == 'features':
+                    lector.consumir('[')
+                    if lector.caracter() == ']':
+                        lector.pos += 1
+                    else:
+                        while True:
+                            acumulador.agregar(lector.valor())
+                            if lector.consumir(',]') == ']':
+                                break
+                else:
+                    cabecera[clave] = lector.valor()
+                if lector.consumir(',}') == '}':
+                    break
+        # Un archivo con una sola Feature se trata como una colección de una
+        if cabecera.get('type') == 'Feature':
+            acumulador.agregar(cabecera)
+            cabecera = {'type': 'FeatureCollection'}
+        return acumulador.terminar(cabecera, lector.bytes)
+    finally:
+        if cerrar:
+            flujo.close()
@@ -0,0 +1,132 @@
+# --- ÍNDICE GEOMÉTRICO DE COLONIAS ---
+# Los anillos de todos los polígonos del GeoJSON se guardan como un único arreglo
+# plano de coordenadas con desplazamientos (anillo -> parte -> feature). Con eso
+# las áreas, cajas envolventes y anclas de etiqueta (centroide ponderado por
+# área de la parte más grande) se calculan de forma vectorizada una sola vez por
+# GeoJSON. Los arreglos son los mismos de geojson_columnar.ColoniasGeoJSON, que
+# ya vienen planos.
+
+import numpy as np
+
+from cache_compartido import cache
+from geojson_columnar import ColoniasGeoJSON
+
+class IndiceGeometrico:
+    """Geometría de un GeoJSON en arreglos planos, con medidas precalculadas por feature."""
+
+    def __init__(self, coordenadas, inicio_anillos, inicio_partes, inicio_features):
+        # coordenadas: (n_vertices, 2) en orden [lon, lat]
+        # inicio_anillos[i]: primer vértice del anillo i (longitud n_anillos + 1)
+        # inicio_partes[j]: primer anillo de la parte j; el primero es el exterior
+        # inicio_features[k]: primera parte de la feature k
+        self.coordenadas = coordenadas
+        self.inicio_anillos = inicio_anillos
+        self.inicio_partes = inicio_partes
+        self.inicio_features = inicio_features
+        self.n_features = len(inicio_features) - 1
+        self._calcular_medidas()
+
+    @classmethod
+    def desde_colonias(cls, colonias):
+        """Usa los arreglos de un ColoniasGeoJSON tal cual (sin copiarlos)."""
+        return cls(colonias.coordenadas, colonias.inicio_anillos, colonias.inicio_partes, colonias.inicio_features)
+
+    @classmethod
+    def desde_geojson(cls, gj_data):
+        """Construye el índice de un GeoJSON cargado como diccionario."""
+        return cls.desde_colonias(ColoniasGeoJSON.desde_geojson(gj_data))
+
+    # --- MEDIDAS VECTORIZADAS ---
+
+    def _calcular_medidas(self):
+        n_anillos = len(self.inicio_anillos) - 1
+        n_partes = len(self.inicio_partes) - 1
+        n = self.n_features
+
+        self.areas = np.zeros(n)
+        self.anclas = np.full((n, 2), np.nan)      # [lat, lon] de la parte más grande
+        self.cajas = np.full((n, 4), np.nan)       # [lon_min, lat_min, lon_max, lat_max]
+        if n_anillos == 0:
+            return
+
+        # Se resta una referencia para no perder precisión en el producto cruz
+        referencia = self.coordenadas.mean(axis=0)
+        xy = self.coordenadas - referencia
+        longitudes_anillo = np.diff(self.inicio_anillos)
+        anillo_de_vertice = np.repeat(np.arange(n_anillos), longitudes_anillo)
+
+        # Siguiente vértice dentro del mismo anillo (el último cierra con el primero)
+        siguiente = np.arange(len(xy)) + 1
+        ultimos = self.inicio_anillos[1:] - 1
+        siguiente[ultimos] = self.inicio_anillos[:-1]
+
+        x0, y0 = xy[:, 0], xy[:, 1]
+        x1, y1 = xy[siguiente, 0], xy[siguiente, 1]
+        cruz = x0 * y1 - x1 * y0
+
+        inicios = self.inicio_anillos[:-1]
+        area_firmada = 0.5 * np.add.reduceat(cruz, inicios)
+        momento_x = np.add.reduceat((x0 + x1) * cruz, inicios) / 6.0
+        momento_y = np.add.reduceat((y0 + y1) * cruz, inicios) / 6.0
+
+        # El exterior suma y los huecos restan, sin importar la orientación del anillo
+        parte_de_anillo = np.repeat(np.arange(n_partes), np.diff(self.inicio_partes))
+        signo = np.where(np.isin(np.arange(n_anillos), self.inicio_partes[:-1]), 1.0, -1.0)
+        orientacion = np.sign(area_firmada)
+        area_anillo = signo * np.abs(area_firmada)
+        mx_anillo = signo * orientacion * momento_x
+        my_anillo = signo * orientacion * momento_y
+
+        area_parte = np.bincount(parte_de_anillo, weights=area_anillo, minlength=n_partes)
+        mx_parte = np.bincount(parte_de_anillo, weights=mx_anillo, minlength=n_partes)
+        my_parte = np.bincount(parte_de_anillo, weights=my_anillo, minlength=n_partes)
+
+        # Promedio simple de vértices del exterior para partes degeneradas (área cero)
+        exterior_de_parte = self.inicio_partes[:-1]
+        suma_x = np.bincount(anillo_de_vertice, weights=x0, minlength=n_anillos)[exterior_de_parte]
+        suma_y = np.bincount(anillo_de_vertice, weights=y0, minlength=n_anillos)[exterior_de_parte]
+        conteo = longitudes_anillo[exterior_de_parte]
+        degenerada = np.abs(area_parte) <= np.finfo(float).tiny
+        with np.errstate(divide='ignore', invalid='ignore'):
+            cx_parte = np.where(degenerada, suma_x / conteo, mx_parte / area_parte)
+            cy_parte = np.where(degenerada, suma_y / conteo, my_parte / area_parte)
+
+        # Agregación por feature
+        feature_de_parte = np.repeat(np.arange(n), np.diff(self.inicio_features))
+        con_partes = np.diff(self.inicio_features) > 0
+        self.areas = np.bincount(feature_de_parte, weights=area_parte, minlength=n)
+
+        # Parte más grande por área dentro de cada feature
+        orden = np.lexsort((-area_parte, feature_de_parte))
+        primera = np.searchsorted(feature_de_parte[orden], np.arange(n))
+        mayor = orden[np.minimum(primera, len(orden) - 1)]
+        ancla_x, ancla_y = cx_parte[mayor], cy_parte[mayor]
+        self.anclas[con_partes] = np.column_stack([ancla_y, ancla_x])[con_partes] + referencia[::-1]
+
+        # Cajas envolventes a partir de todos los vértices de cada feature
+        vertice_de_feature = feature_de_parte[parte_de_anillo[anillo_de_vertice]]
+        lon, lat = self.coordenadas[:, 0], self.coordenadas[:, 1]
+        for columna, valores, funcion in (
+            (0, lon, np.minimum), (1, lat, np.minimum), (2, lon, np.maximum), (3, lat, np.maximum)
+        ):
+            inicial = np.inf if funcion is np.minimum else -np.inf
+            acumulado = np.full(n, inicial)
+            funcion.at(acumulado, vertice_de_feature, valores)
+            self.cajas[con_partes, columna] = acumulado[con_partes]
+
+    # --- CONSULTAS ---
+
+    def ancla(self, i):
+        """Devuelve (lat, lon) para la etiqueta de la feature i, o None si no tiene polígonos."""
+        lat, lon = self.anclas[i]
+        if np.isnan(lat) or np.isnan(lon):
+            return None
+        return (float(lat), float(lon))
+
+# --- CACHÉ DE ÍNDICES POR GEOJSON ---
+
+def obtener_indice(gj_data, clave=None):
+    """Devuelve el índice de las colonias (ColoniasGeoJSON), compartido entre sesiones para la misma clave."""
+    if clave is None:
+        return IndiceGeometrico.desde_colonias(gj_data)
+    return cache.obtener(('indice_geometrico', clave), lambda: IndiceGeometrico.desde_colonias(gj_data))
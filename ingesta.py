@@ -0,0 +1,395 @@
+# --- CAPA DE INGESTA CON CACHÉ EN DISCO ---
+# Los archivos subidos se identifican por el hash de su contenido. El resultado
+# ya parseado (DataFrame de atenciones como parquet, GeoJSON de colonias en
+# columnas mapeables; ver geojson_columnar) se guarda en un directorio local con
+# desalojo LRU, de modo que los reruns de Streamlit y las re-subidas del mismo
+# archivo no vuelven a parsear nada.
+
+import os
+import json
+import hashlib
+import tempfile
+from io import BytesIO
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from pandas.tseries.api import guess_datetime_format
+
+from geojson_columnar import ColoniasGeoJSON, leer_geojson
+
+# --- CONFIGURACIÓN ---
+DIRECTORIO_CACHE = os.environ.get(
+    "MAPAS_CACHE_DIR",
+    os.path.join(os.path.expanduser("~"), ".cache", "mapas_prehospitalarios", "ingesta")
+)
+LIMITE_CACHE_BYTES = int(os.environ.get("MAPAS_CACHE_MAX_MB", "1024")) * 1024 * 1024
+
+# Filas leídas por bloque en la ingesta por bloques de archivos grandes
+FILAS_POR_BLOQUE = 200_000
+
+# Cambiar este valor invalida todas las entradas guardadas con un formato anterior.
+VERSION_CACHE = "2"
+
+# Extensiones de las entradas del caché en disco
+EXTENSION_TABLA = '.parquet'
+EXTENSION_COLONIAS = '.colonias'
+
+# --- FUNCIONES DE APOYO ---
+
+def hash_contenido(datos):
+    """Devuelve el hash SHA-256 (hex) del contenido de un archivo."""
+    return hashlib.sha256(datos).hexdigest()
+
+def clave_archivo(archivo):
+    """Devuelve el hash del contenido de un archivo subido o una ruta."""
+    return hash_contenido(_leer_bytes(archivo))
+
+def _leer_bytes(archivo):
+    """Obtiene los bytes de un archivo subido, una ruta o bytes ya leídos."""
+    if isinstance(archivo, (bytes, bytearray)):
+        return bytes(archivo)
+    if isinstance(archivo, (str, os.PathLike)):
+        with open(archivo, 'rb') as f:
+            return f.read()
+    if hasattr(archivo, 'getvalue'):
+        return archivo.getvalue()
+    archivo.seek(0)
+    return archivo.read()
+
+def _ruta_cache(clave, directorio, extension=EXTENSION_TABLA):
+    return os.path.join(directorio, f"{clave}{extension}")
+
+def _escribir_atomico(tabla, ruta):
+    """Escribe la tabla parquet en un temporal y lo renombra al destino."""
+    directorio = os.path.dirname(ruta)
+    os.makedirs(directorio, exist_ok=True)
+    fd, ruta_tmp = tempfile.mkstemp(dir=directorio, suffix='.tmp')
+    os.close(fd)
+    try:
+        pq.write_table(tabla, ruta_tmp)
+        os.replace(ruta_tmp, ruta)
+    finally:
+        if os.path.exists(ruta_tmp):
+            os.remove(ruta_tmp)
+
+def _leer_cache(ruta):
+    """Lee una entrada del caché y la marca como usada recientemente."""
+    if not os.path.exists(ruta):
+        return None
+    try:
+        tabla = pq.read_table(ruta)
+        os.utime(ruta)
+        return tabla
+    except (OSError, pa.ArrowException):
+        # Entrada corrupta o borrada a medias: se descarta y se vuelve a parsear
+        try:
+            os.remove(ruta)
+        except OSError:
+            pass
+        return None
+
+def desalojar_cache(directorio=None, limite_bytes=None):
+    """Elimina las entradas menos usadas hasta quedar bajo el límite de bytes."""
+    directorio = directorio or DIRECTORIO_CACHE
+    limite_bytes = LIMITE_CACHE_BYTES if limite_bytes is None else limite_bytes
+    if not os.path.isdir(directorio):
+        return
+    entradas = []
+    for nombre in os.listdir(directorio):
+        if not nombre.endswith((EXTENSION_TABLA, EXTENSION_COLONIAS)):
+            continue
+        ruta = os.path.join(directorio, nombre)
+        try:
+            info = os.stat(ruta)
+        except OSError:
+            continue
+        entradas.append((info.st_mtime, info.st_size, ruta))
+
+    total = sum(tam for _, tam, _ in entradas)
+    for _, tam, ruta in sorted(entradas):
+        if total <= limite_bytes:
+            break
+        try:
+            os.remove(ruta)
+            total -= tam
+        except OSError:
+            continue
+
+# --- DATAFRAME DE ATENCIONES ---
+
+def parsear_datos(nombre_archivo, datos):
+    """Parsea el archivo de atenciones (Excel o CSV) a un DataFrame."""
+    if nombre_archivo.lower().endswith('.xlsx'):
+        return pd.read_excel(BytesIO(datos))
+    return pd.read_csv(BytesIO(datos))
+
+def _dataframe_a_tabla(df):
+    """Convierte el DataFrame a tabla Arrow, uniformando columnas de tipo mixto."""
+    try:
+        return pa.Table.from_pandas(df, preserve_index=False)
+    except (pa.ArrowException, TypeError, ValueError):
+        pass
+    # Excel suele traer columnas con números y textos mezclados; se guardan
+    # como texto, que después `pd.to_numeric`/`pd.to_datetime` interpretan igual.
+    df = df.copy()
+    for columna in df.columns:
+        if df[columna].dtype == object:
+            tipo = pd.api.types.infer_dtype(df[columna], skipna=True)
+            if tipo.startswith('mixed') or tipo in ('bytes', 'decimal'):
+                df[columna] = df[columna].where(df[columna].isna(), df[columna].astype(str))
+    return pa.Table.from_pandas(df, preserve_index=False)
+
+def cargar_datos(archivo, nombre_archivo=None, directorio=None, hash_archivo=None):
+    """Carga el archivo de atenciones usando el caché por hash de contenido."""
+    directorio = directorio or DIRECTORIO_CACHE
+    nombre_archivo = nombre_archivo or getattr(archivo, 'name', str(archivo))
+    datos = _leer_bytes(archivo)
+    hash_archivo = hash_archivo or hash_contenido(datos)
+    extension = os.path.splitext(nombre_archivo)[1].lower()
+    clave = f"datos-v{VERSION_CACHE}-{hash_archivo}{extension.replace('.', '-')}"
+    ruta = _ruta_cache(clave, directorio)
+
+    tabla = _leer_cache(ruta)
+    if tabla is not None:
+        return tabla.to_pandas()
+
+    df = parsear_datos(nombre_archivo, datos)
+    try:
+        if all(isinstance(c, str) for c in df.columns):
+            _escribir_atomico(_dataframe_a_tabla(df), ruta)
+            desalojar_cache(directorio)
+    except (OSError, pa.ArrowException, TypeError, ValueError):
+        # Si no se puede guardar en caché se sigue con el DataFrame ya parseado
+        pass
+    return df
+
+# --- INGESTA POR BLOQUES DE ARCHIVOS GRANDES ---
+# Para exportaciones de millones de filas se leen solo las columnas asignadas,
+# bloque por bloque, y cada bloque se compacta y se copia a los arreglos del
+# resultado antes de leer el siguiente: coordenadas a float32, fechas a
+# datetime64 y textos a códigos de categoría. Los arreglos se reservan con el
+# total de filas estimado por lo ya leído, así que el pico de memoria es el
+# DataFrame compacto final (con poca holgura) más un bloque.
+
+# Tipos de columna de la ingesta por bloques
+COORDENADA = 'coordenada'
+FECHA = 'fecha'
+CATEGORIA = 'categoria'
+
+# Holgura sobre el total de filas estimado al reservar, y crecimiento mínimo
+HOLGURA_RESERVA = 1.05
+CRECIMIENTO_MINIMO = 1.25
+
+def leer_encabezado(archivo, nombre_archivo=None):
+    """Devuelve los nombres de columna del archivo de atenciones sin leer sus filas."""
+    nombre_archivo = nombre_archivo or getattr(archivo, 'name', str(archivo))
+    datos = _leer_bytes(archivo)
+    if nombre_archivo.lower().endswith('.xlsx'):
+        return pd.read_excel(BytesIO(datos), nrows=0).columns.tolist()
+    return pd.read_csv(BytesIO(datos), nrows=0).columns.tolist()
+
+def _formato_fecha(serie):
+    """Formato de fecha de la columna según su primer valor, como lo infiere pandas al leerla completa.
+
+    None si el bloque no tiene valores; 'mixed' (cada valor por separado) si el
+    primero no es texto o no tiene un formato reconocible.
+    """
+    valores = serie.dropna()
+    if valores.empty:
+        return None
+    primero = valores.iloc[0]
+    if isinstance(primero, str):
+        return guess_datetime_format(primero) or 'mixed'
+    return 'mixed'
+
+class _ColumnasCompactas:
+    """Columnas compactas que crecen bloque a bloque sin conservar los bloques."""
+
+    def __init__(self, tipos):
+        self.tipos = tipos
+        self.filas = 0
+        self.capacidad = 0
+        # Arreglo de cada columna: float32, datetime64 o códigos de categoría
+        self.arreglos = {}
+        # {texto: código} de cada columna categórica, en orden de aparición
+        self.categorias = {columna: {} for columna, tipo in tipos.items() if tipo == CATEGORIA}
+        # Un solo formato de fecha para todos los bloques, fijado por el primer valor
+        self.formatos = {}
+
+    def _valores(self, columna, tipo, serie):
+        if tipo == COORDENADA:
+            return pd.to_numeric(serie, errors='coerce').to_numpy(dtype=np.float32)
+        if tipo == FECHA:
+            if self.formatos.get(columna) is None:
+                self.formatos[columna] = _formato_fecha(serie)
+            return pd.to_datetime(serie, errors='coerce', format=self.formatos[columna]).to_numpy()
+        # Categorías siempre de texto; las celdas vacías quedan con código -1
+        serie = serie.astype(object)
+        codigos, unicos = pd.factorize(serie.where(serie.isna(), serie.astype(str)))
+        indice = self.categorias[columna]
+        globales = np.array([indice.setdefault(valor, len(indice)) for valor in unicos] + [-1], dtype=np.int32)
+        return globales[codigos]
+
+    def _reservar(self, filas, estimadas):
+        """Asegura lugar para `filas` más; al crecer reserva el total estimado con holgura."""
+        necesarias = self.filas + filas
+        if necesarias <= self.capacidad:
+            return
+        self.capacidad = max(
+            necesarias, int(estimadas * HOLGURA_RESERVA), int(self.capacidad * CRECIMIENTO_MINIMO)
+        )
+        # Una columna a la vez: el pico extra es una sola columna copiada
+        for columna, arreglo in self.arreglos.items():
+            nuevo = np.empty(self.capacidad, dtype=arreglo.dtype)
+            nuevo[:self.filas] = arreglo[:self.filas]
+            self.arreglos[columna] = nuevo
+
+    def agregar(self, bloque, fraccion):
+        """Agrega un bloque; `fraccion` es la parte del archivo leída hasta él (0 a 1)."""
+        filas = len(bloque)
+        if filas == 0:
+            return
+        # Total de filas estimado por el avance en el archivo
+        estimadas = (self.filas + filas) / fraccion if fraccion else 0
+        self._reservar(filas, estimadas)
+        for columna, tipo in self.tipos.items():
+            valores = self._valores(columna, tipo, bloque[columna])
+            if columna not in self.arreglos:
+                self.arreglos[columna] = np.empty(self.capacidad, dtype=valores.dtype)
+            self.arreglos[columna][self.filas:self.filas + filas] = valores
+        self.filas += filas
+
+    def dataframe(self):
+        """DataFrame con las filas leídas; las columnas son vistas de los arreglos, sin copiarlos."""
+        columnas = {}
+        for columna, tipo in self.tipos.items():
+            if tipo == CATEGORIA:
+                codigos = self.arreglos[columna][:self.filas] if columna in self.arreglos else np.empty(0, dtype=np.int32)
+                columnas[columna] = pd.Categorical.from_codes(
+                    codigos, categories=pd.Index(list(self.categorias[columna]), dtype=object)
+                )
+            elif columna in self.arreglos:
+                columnas[columna] = self.arreglos[columna][:self.filas]
+            else:
+                columnas[columna] = np.empty(0, dtype=np.float32 if tipo == COORDENADA else 'datetime64[ns]')
+        return pd.DataFrame(columnas, copy=False)
+
+def _bloques_csv(datos, tipos, filas_por_bloque):
+    """Itera (bloque, fracción leída) de un CSV leyendo solo las columnas de `tipos`."""
+    buffer = BytesIO(datos)
+    lector = pd.read_csv(
+        buffer,
+        usecols=list(tipos),
+        dtype={columna: object for columna, tipo in tipos.items() if tipo == CATEGORIA},
+        chunksize=filas_por_bloque
+    )
+    with lector:
+        for bloque in lector:
+            yield bloque, buffer.tell() / max(1, len(datos))
+
+def _bloques_excel(datos, tipos, filas_por_bloque):
+    """Itera (bloque, fracción leída) de la primera hoja de un Excel con el iterador de solo lectura de openpyxl."""
+    from openpyxl import load_workbook
+
+    encabezado = pd.read_excel(BytesIO(datos), nrows=0).columns.tolist()
+    posiciones = [encabezado.index(columna) for columna in tipos]
+    libro = load_workbook(BytesIO(datos), read_only=True, data_only=True)
+    try:
+        hoja = libro.worksheets[0]
+        total = max(1, (hoja.max_row or 1) - 1)
+        filas, leidas = [], 0
+        for fila in hoja.iter_rows(min_row=2, values_only=True):
+            filas.append([fila[i] if i < len(fila) else None for i in posiciones])
+            if len(filas) == filas_por_bloque:
+                leidas += len(filas)
+                yield pd.DataFrame(filas, columns=list(tipos)), min(1.0, leidas / total)
+                filas = []
+        if filas:
+            yield pd.DataFrame(filas, columns=list(tipos)), 1.0
+    finally:
+        libro.close()
+
+def cargar_columnas(archivo, tipos, nombre_archivo=None, directorio=None, hash_archivo=None,
+                    filas_por_bloque=FILAS_POR_BLOQUE, progreso=None):
+    """Lee por bloques solo las columnas de `tipos` ({columna: tipo}) y las compacta.
+
+    `progreso`, si se da, recibe la fracción leída (0 a 1) después de cada bloque.
+    El resultado también se guarda en el caché, con la clave del archivo y de las columnas.
+    """
+    directorio = directorio or DIRECTORIO_CACHE
+    nombre_archivo = nombre_archivo or getattr(archivo, 'name', str(archivo))
+    datos = _leer_bytes(archivo)
+    hash_archivo = hash_archivo or hash_contenido(datos)
+    hash_columnas = hash_contenido(json.dumps(sorted(tipos.items()), default=str).encode())[:16]
+    clave = f"compacto-v{VERSION_CACHE}-{hash_archivo}-{hash_columnas}"
+    ruta = _ruta_cache(clave, directorio)
+
+    tabla = _leer_cache(ruta)
+    if tabla is not None:
+        if progreso:
+            progreso(1.0)
+        return tabla.to_pandas()
+
+    if nombre_archivo.lower().endswith('.xlsx'):
+        bloques = _bloques_excel(datos, tipos, filas_por_bloque)
+    else:
+        bloques = _bloques_csv(datos, tipos, filas_por_bloque)
+    compactas = _ColumnasCompactas(tipos)
+    for bloque, fraccion in bloques:
+        compactas.agregar(bloque, fraccion)
+        if progreso:
+            progreso(fraccion)
+    df = compactas.dataframe()
+    if progreso:
+        progreso(1.0)
+
+    try:
+        if all(isinstance(c, str) for c in df.columns):
+            _escribir_atomico(pa.Table.from_pandas(df, preserve_index=False), ruta)
+            desalojar_cache(directorio)
+    except (OSError, pa.ArrowException, TypeError, ValueError):
+        pass
+    return df
+
+# --- GEOJSON DE COLONIAS ---
+
+def _abrir_colonias(ruta):
+    """Abre una entrada de colonias del caché y la marca como usada recientemente."""
+    if not os.path.exists(ruta):
+        return None
+    try:
+        colonias = ColoniasGeoJSON.abrir(ruta)
+        os.utime(ruta)
+        return colonias
+    except (OSError, ValueError, KeyError):
+        # Entrada corrupta o de otro formato: se descarta y se vuelve a leer
+        try:
+            os.remove(ruta)
+        except OSError:
+            pass
+        return None
+
+def cargar_geojson(archivo, directorio=None, hash_archivo=None):
+    """Carga el GeoJSON de colonias en columnas usando el caché por hash de contenido.
+
+    La primera vez se lee por bloques, sin armar el árbol de diccionarios; el
+    resultado se guarda en el caché y se devuelve mapeado desde el disco.
+    """
+    directorio = directorio or DIRECTORIO_CACHE
+    hash_archivo = hash_archivo or clave_archivo(archivo)
+    clave = f"geojson-v{VERSION_CACHE}-{hash_archivo}"
+    ruta = _ruta_cache(clave, directorio, EXTENSION_COLONIAS)
+
+    colonias = _abrir_colonias(ruta)
+    if colonias is not None:
+        return colonias
+
+    colonias = leer_geojson(archivo)
+    try:
+        colonias.guardar(ruta)
+        desalojar_cache(directorio)
+        return ColoniasGeoJSON.abrir(ruta)
+    except (OSError, ValueError):
+        return colonias
@@ -0,0 +1,145 @@
+# --- INSTRUMENTACIÓN POR ETAPAS ---
+# Registra el tiempo de reloj y la memoria de cada etapa del flujo (lectura,
+# limpieza, filtro, mapa, HTML...) junto con las filas, colonias y bytes que
+# pasan por ella. Cada medición se escribe como una línea JSON en el log, así
+# se pueden perfilar sesiones reales sin adjuntar un profiler; la aplicación
+# además las muestra en un panel de diagnóstico opcional.
+#
+# La memoria del proceso (RSS actual y pico) es barata y se mide siempre. El
+# pico de memoria de Python de cada etapa usa tracemalloc, que vuelve más
+# lentas todas las asignaciones del proceso. Por eso se enciende para todo el
+# servidor (MAPAS_MEMORIA_PYTHON=1 o PYTHONTRACEMALLOC) y no desde una sesión:
+# una sesión no puede apagarlo a media medición de otra. tracemalloc mide todo
+# el proceso: con varias sesiones a la vez, el pico incluye las demás. Su pico
+# también es uno solo para el proceso, así que una etapa que lo reinicia guarda
+# antes el pico en curso en las demás etapas abiertas (anidadas o de otras
+# sesiones), que lo combinan con el suyo al terminar.
+
+import os
+import sys
+import json
+import time
+import logging
+import datetime
+import threading
+import tracemalloc
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:
+    # Windows no tiene `resource`: solo se reporta el RSS actual si se puede
+    resource = None
+
+MB = 1024 * 1024
+
+# Rastrear la memoria de Python en todo el proceso (vuelve más lentas las asignaciones)
+MEMORIA_PYTHON = os.environ.get("MAPAS_MEMORIA_PYTHON", "0") == "1"
+if MEMORIA_PYTHON and not tracemalloc.is_tracing():
+    tracemalloc.start()
+
+# Líneas JSON sin prefijo, a stderr, para que los recolectores de logs las lean tal cual
+registro = logging.getLogger('mapas_prehospitalarios.instrumentacion')
+if not registro.handlers:
+    _manejador = logging.StreamHandler(sys.stderr)
+    _manejador.setFormatter(logging.Formatter('%(message)s'))
+    registro.addHandler(_manejador)
+    registro.setLevel(os.environ.get('MAPAS_LOG_NIVEL', 'INFO').upper())
+    registro.propagate = False
+
+def memoria_proceso():
+    """Devuelve (RSS actual, pico de RSS) del proceso en bytes; None donde no se puede medir."""
+    actual = pico = None
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            actual = int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError, IndexError):
+        pass
+    if resource is not None:
+        pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux reporta KB y macOS bytes
+        pico = pico if sys.platform == 'darwin' else pico * 1024
+    return actual, pico
+
+# Pico de Python guardado de cada etapa abierta en el proceso
+_picos_abiertos = {}
+_candado_picos = threading.Lock()
+
+def _abrir_pico():
+    """Reinicia el pico de tracemalloc para una etapa nueva; devuelve (marca, memoria actual)."""
+    with _candado_picos:
+        actual, pico = tracemalloc.get_traced_memory()
+        for marca in _picos_abiertos:
+            _picos_abiertos[marca] = max(_picos_abiertos[marca], pico)
+        tracemalloc.reset_peak()
+        marca = object()
+        _picos_abiertos[marca] = actual
+    return marca, actual
+
+def _cerrar_pico(marca):
+    """Pico de Python desde que se abrió la etapa, aunque otra etapa lo haya reiniciado."""
+    with _candado_picos:
+        return max(_picos_abiertos.pop(marca), tracemalloc.get_traced_memory()[1])
+
+def _mb(valor):
+    return None if valor is None else round(valor / MB, 2)
+
+class Instrumentacion:
+    """Mediciones de las etapas de una ejecución (un rerun de la app o un mapa del lote)."""
+
+    def __init__(self, sesion=None, corrida=None, memoria_python=False):
+        # memoria_python solo agrega el pico de Python a las mediciones cuando
+        # el servidor ya rastrea las asignaciones; nunca enciende ni apaga tracemalloc
+        self.sesion = sesion
+        self.corrida = corrida
+        self.memoria_python = memoria_python
+        self.etapas = []
+
+    @contextmanager
+    def etapa(self, nombre, **conteos):
+        """Mide el bloque `with`; los conteos (filas, bytes...) se pueden agregar al dict que devuelve."""
+        conteos = dict(conteos)
+        rastrear = self.memoria_python and tracemalloc.is_tracing()
+        if rastrear:
+            marca, python_inicial = _abrir_pico()
+        _, pico_inicial = memoria_proceso()
+        inicio = time.perf_counter()
+        error = None
+        try:
+            yield conteos
+        except BaseException as e:
+            # También st.stop() y los reruns, que no heredan de Exception
+            error = type(e).__name__
+            raise
+        finally:
+            segundos = time.perf_counter() - inicio
+            actual, pico = memoria_proceso()
+            medicion = {
+                'etapa': nombre,
+                'segundos': round(segundos, 6),
+                'rss_mb': _mb(actual),
+                'pico_rss_mb': _mb(pico),
+                'aumento_pico_rss_mb': _mb(pico - pico_inicial) if pico is not None else None,
+            }
+            if rastrear:
+                medicion['pico_python_mb'] = _mb(_cerrar_pico(marca) - python_inicial)
+            medicion.update({clave: valor for clave, valor in conteos.items() if valor is not None})
+            if error:
+                medicion['error'] = error
+            self.etapas.append(medicion)
+            self._escribir(medicion)
+
+    def _escribir(self, medicion):
+        if not registro.isEnabledFor(logging.INFO):
+            return
+        linea = {
+            'evento': 'etapa',
+            'momento': datetime.datetime.now().isoformat(timespec='milliseconds'),
+            'sesion': self.sesion,
+            'corrida': self.corrida,
+            **medicion,
+        }
+        registro.info(json.dumps(linea, ensure_ascii=False, default=str))
+
+    def total_segundos(self):
+        return sum(medicion['segundos'] for medicion in self.etapas)
@@ -0,0 +1,311 @@
+# --- GENERACIÓN DE MAPAS POR LOTES ---
+# Modo de línea de comandos, sin Streamlit, para producir muchos mapas HTML de
+# una sola vez (reportes mensuales por zona, por turno, etc.). Los archivos se
+# leen y se limpian una sola vez; los mapas se generan en paralelo en un pool
+# de procesos que recibe los datos ya limpios al arrancar cada proceso (con
+# `fork` se heredan sin copiarse ni volver a parsearse).
+#
+# Uso:
+#   python lote.py atenciones.xlsx colonias.geojson especificacion.json --salida mapas/ --procesos 8
+#
+# Especificación (JSON):
+#   {
+#     "columnas": {"lat": "LAT", "lon": "LON", "colonia": "COLONIA", "fecha": "FECHA", "sm": "SM"},
+#     "campo_geojson": "NOMBRE",
+#     "bases": "bases.csv",
+#     "opciones": {"leyenda": true, "resolucion_calor": 50, "tolerancia_limites": 5, "topojson": false,
+#                  "verificar_colonia": false, "asignar_colonia": false, "teselas": false,
+#                  "agregado": false, "agrupar": false, "animacion_calor": null,
+#                  "minutos_cobertura": null, "velocidad_kmh": 30,
+#                  "radio_puntos_calientes": null, "min_puntos_calientes": 20},
+#     "mapas": [
+#       {"nombre": "2024-01", "desde": "2024-01-01", "hasta": "2024-01-31"},
+#       {"nombre": "centro-nocturno", "filtros": {"COLONIA": ["Centro"], "TURNO": ["Nocturno"]},
+#        "opciones": {"resolucion_calor": null}}
+#     ]
+#   }
+#
+# "sm" es opcional (sin ella no se distingue la fuente). Cada mapa puede
+# omitir "desde"/"hasta" (todo el rango), filtrar por los valores normalizados
+# de cualquier columna del archivo y sobrescribir las opciones generales.
+# "animacion_calor" puede ser "dia" o "semana" para agregar el calor animado.
+# "bases" (opcional, relativa al archivo de la especificación) es una tabla con
+# nombre, latitud y longitud de las bases;
+# con "minutos_cobertura" se agrega la capa de distancia a la base más cercana.
+# Con "radio_puntos_calientes" (metros) se agregan los puntos calientes de las
+# atenciones de cada mapa.
+# "asignar_colonia" y "verificar_colonia" solo se leen de las opciones generales
+# porque cambian la limpieza, que se hace una vez para todo el lote.
+
+import os
+import re
+import sys
+import json
+import time
+import argparse
+import datetime
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from ingesta import cargar_datos, cargar_geojson, cargar_columnas, clave_archivo, COORDENADA, FECHA, CATEGORIA
+from geometria import obtener_indice
+from composicion import ComposicionMapa
+from mapa import crear_mapa, guardar_mapa_html
+from procesamiento import procesar_atenciones, filtrar_valores, COLUMNA_COLONIA_POLIGONO, COLUMNA_FUENTE
+from simplificacion import obtener_limites
+from cobertura import IndiceBases, AnalisisCobertura, radio_cobertura, VELOCIDAD_KMH
+from puntos_calientes import PuntosCalientes, MIN_ATENCIONES_PUNTO_CALIENTE
+
+OPCIONES_POR_DEFECTO = {
+    'leyenda': True,
+    'resolucion_calor': 50,
+    'tolerancia_limites': 5,
+    'topojson': False,
+    'verificar_colonia': False,
+    'asignar_colonia': False,
+    'teselas': False,
+    'agregado': False,
+    'agrupar': False,
+    'animacion_calor': None,
+    'minutos_cobertura': None,
+    'velocidad_kmh': VELOCIDAD_KMH,
+    'radio_puntos_calientes': None,
+    'min_puntos_calientes': MIN_ATENCIONES_PUNTO_CALIENTE,
+}
+
+# Estado compartido por las tareas de cada proceso (se fija al iniciarlo)
+_estado = None
+
+def _inicializar(estado):
+    global _estado
+    _estado = estado
+    # Las capas de colonias se renderizan una vez por proceso y se reutilizan
+    _estado['composicion'] = ComposicionMapa()
+
+def _nombre_archivo(nombre):
+    """Nombre de archivo seguro a partir del nombre del mapa."""
+    return re.sub(r'[^\w.-]+', '_', str(nombre)).strip('_') or 'mapa'
+
+def _a_fecha(valor, por_defecto):
+    return datetime.date.fromisoformat(valor) if valor else por_defecto
+
+def leer_especificacion(ruta):
+    """Lee la especificación del lote y completa las opciones de cada mapa."""
+    with open(ruta, 'r', encoding='utf-8') as f:
+        especificacion = json.load(f)
+    columnas = especificacion['columnas']
+    for requerida in ('lat', 'lon', 'colonia', 'fecha'):
+        if requerida not in columnas:
+            raise ValueError(f"Falta la columna '{requerida}' en la especificación")
+    if 'campo_geojson' not in especificacion:
+        raise ValueError("Falta 'campo_geojson' en la especificación")
+
+    generales = {**OPCIONES_POR_DEFECTO, **especificacion.get('opciones', {})}
+    mapas = []
+    for i, mapa in enumerate(especificacion.get('mapas', [])):
+        mapas.append({
+            'nombre': mapa.get('nombre', f'mapa_{i + 1:03d}'),
+            'desde': mapa.get('desde'),
+            'hasta': mapa.get('hasta'),
+            'filtros': mapa.get('filtros', {}),
+            'opciones': {**generales, **mapa.get('opciones', {})},
+        })
+    if not mapas:
+        raise ValueError("La especificación no tiene mapas")
+    # Las rutas de la especificación son relativas a su propio archivo, no al directorio de trabajo
+    ruta_bases = especificacion.get('bases')
+    if ruta_bases:
+        ruta_bases = os.path.join(os.path.dirname(os.path.abspath(ruta)), ruta_bases)
+    return columnas, especificacion['campo_geojson'], generales, mapas, ruta_bases
+
+def preparar_lote(ruta_datos, ruta_geojson, columnas, campo_geojson, generales, mapas, por_bloques=False, ruta_bases=None):
+    """Lee y limpia los archivos una vez y calcula lo que comparten todos los mapas."""
+    col_lat, col_lon = columnas['lat'], columnas['lon']
+    col_colonia, col_fecha, col_sm = columnas['colonia'], columnas['fecha'], columnas.get('sm')
+    # Columnas del archivo que solo se usan para filtrar (las generadas no vienen en él)
+    mapeadas = {col_lat, col_lon, col_colonia, col_fecha, col_sm, COLUMNA_COLONIA_POLIGONO, COLUMNA_FUENTE}
+    columnas_extra = sorted({c for mapa in mapas for c in mapa['filtros'] if c not in mapeadas})
+
+    if por_bloques:
+        tipos = {col_lat: COORDENADA, col_lon: COORDENADA, col_fecha: FECHA, col_colonia: CATEGORIA}
+        for columna in columnas_extra + ([col_sm] if col_sm else []):
+            tipos[columna] = CATEGORIA
+        df = cargar_columnas(ruta_datos, tipos)
+    else:
+        df = cargar_datos(ruta_datos)
+    clave_geojson = clave_archivo(ruta_geojson)
+    gj_data = cargar_geojson(ruta_geojson, hash_archivo=clave_geojson)
+    indice_geometrico = obtener_indice(gj_data, clave_geojson)
+
+    indice_fechas, _ = procesar_atenciones(
+        df, col_lat, col_lon, col_colonia, col_fecha, col_sm,
+        gj_data=gj_data,
+        campo_geojson=campo_geojson,
+        clave_geojson=clave_geojson,
+        verificar_colonia=generales['verificar_colonia'] or generales['asignar_colonia'],
+        asignar_colonia=generales['asignar_colonia'],
+        columnas_extra=columnas_extra
+    )
+
+    # Límites simplificados: uno por combinación de parámetros usada en el lote
+    limites = {}
+    for mapa in mapas:
+        opciones = mapa['opciones']
+        clave = (opciones['tolerancia_limites'], bool(opciones['topojson']))
+        if opciones['tolerancia_limites'] is not None and clave not in limites:
+            limites[clave] = obtener_limites(
+                gj_data, indice_geometrico, campo_geojson, opciones['tolerancia_limites'],
+                clave=clave_geojson, topojson=bool(opciones['topojson'])
+            )
+
+    # Índice de las bases, compartido por todos los mapas con cobertura
+    bases = IndiceBases.desde_tabla(cargar_datos(ruta_bases)) if ruta_bases else None
+
+    return {
+        'bases': bases,
+        'indice_fechas': indice_fechas,
+        'gj_data': gj_data,
+        'clave_geojson': clave_geojson,
+        'indice_geometrico': indice_geometrico,
+        'campo_geojson': campo_geojson,
+        'col_lat': col_lat,
+        'col_lon': col_lon,
+        'col_colonia': col_colonia,
+        'col_fecha': col_fecha,
+        'usar_sm': col_sm is not None,
+        'limites': limites,
+    }
+
+def generar_mapa(mapa, directorio_salida):
+    """Genera un mapa del lote con el estado del proceso; devuelve (nombre, ruta, atenciones, segundos)."""
+    inicio = time.perf_counter()
+    estado = _estado
+    indice_fechas = estado['indice_fechas']
+    opciones = mapa['opciones']
+
+    df = indice_fechas.filtrar(
+        _a_fecha(mapa['desde'], indice_fechas.fecha_min),
+        _a_fecha(mapa['hasta'], indice_fechas.fecha_max)
+    )
+    if mapa['filtros']:
+        df = filtrar_valores(df, mapa['filtros'])
+    if df.empty:
+        return mapa['nombre'], None, 0, time.perf_counter() - inicio
+
+    limites = None
+    if opciones['tolerancia_limites'] is not None:
+        limites = estado['limites'][(opciones['tolerancia_limites'], bool(opciones['topojson']))]
+    cobertura = None
+    if opciones['minutos_cobertura'] and estado['bases'] is not None:
+        distancias, base_cercana = estado['bases'].mas_cercana(df[estado['col_lat']], df[estado['col_lon']])
+        cobertura = AnalisisCobertura(
+            estado['bases'], distancias, base_cercana,
+            radio_cobertura(opciones['minutos_cobertura'], opciones['velocidad_kmh'])
+        )
+    puntos_calientes = None
+    if opciones['radio_puntos_calientes']:
+        puntos_calientes = PuntosCalientes(
+            df[estado['col_lat']],
+            df[estado['col_lon']],
+            opciones['radio_puntos_calientes'],
+            opciones['min_puntos_calientes'],
+            (df[COLUMNA_FUENTE] == 'Servicios Médicos').to_numpy() if estado['usar_sm'] else None,
+            df[estado['col_colonia']]
+        )
+    mapa_folium = crear_mapa(
+        df,
+        estado['gj_data'],
+        estado['campo_geojson'],
+        estado['col_lat'],
+        estado['col_lon'],
+        estado['col_colonia'],
+        estado['col_fecha'],
+        mostrar_leyenda=opciones['leyenda'],
+        usar_sm=estado['usar_sm'],
+        indice_geometrico=estado['indice_geometrico'],
+        resolucion_calor=opciones['resolucion_calor'],
+        limites=limites,
+        composicion=estado['composicion'],
+        clave_geojson=estado['clave_geojson'],
+        puntos_en_teselas=opciones['teselas'],
+        modo_agregado=opciones['agregado'],
+        agrupar_puntos=opciones['agrupar'],
+        animacion_calor=opciones['animacion_calor'],
+        cobertura=cobertura,
+        puntos_calientes=puntos_calientes
+    )
+    ruta = os.path.join(directorio_salida, f"{_nombre_archivo(mapa['nombre'])}.html")
+    with open(ruta, 'w', encoding='utf-8') as f:
+        f.write(guardar_mapa_html(mapa_folium))
+    return mapa['nombre'], ruta, len(df), time.perf_counter() - inicio
+
+def _generar_protegido(mapa, directorio_salida):
+    """Como generar_mapa, pero devuelve el error en lugar de detener el lote."""
+    try:
+        return generar_mapa(mapa, directorio_salida) + (None,)
+    except Exception as e:
+        return mapa['nombre'], None, 0, 0.0, f"{type(e).__name__}: {e}"
+
+def ejecutar_lote(estado, mapas, directorio_salida, procesos=None):
+    """Genera todos los mapas, en paralelo si `procesos` > 1; devuelve los resultados en orden de término."""
+    os.makedirs(directorio_salida, exist_ok=True)
+    procesos = procesos or os.cpu_count() or 1
+    procesos = min(procesos, len(mapas))
+    if procesos <= 1:
+        _inicializar(estado)
+        for mapa in mapas:
+            yield _generar_protegido(mapa, directorio_salida)
+        return
+
+    metodos = multiprocessing.get_all_start_methods()
+    contexto = multiprocessing.get_context('fork' if 'fork' in metodos else None)
+    with ProcessPoolExecutor(
+        max_workers=procesos,
+        mp_context=contexto,
+        initializer=_inicializar,
+        initargs=(estado,)
+    ) as pool:
+        futuros = [pool.submit(_generar_protegido, mapa, directorio_salida) for mapa in mapas]
+        for futuro in as_completed(futuros):
+            yield futuro.result()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Genera mapas de atenciones prehospitalarias por lotes.")
+    parser.add_argument('datos', help="Archivo de atenciones (Excel o CSV)")
+    parser.add_argument('geojson', help="Archivo de colonias (GeoJSON)")
+    parser.add_argument('especificacion', help="Especificación del lote (JSON)")
+    parser.add_argument('--salida', default='mapas', help="Directorio de los HTML generados (por defecto: mapas)")
+    parser.add_argument('--procesos', type=int, default=None, help="Procesos en paralelo (por defecto: núcleos disponibles)")
+    parser.add_argument('--por-bloques', action='store_true', help="Lee el archivo de atenciones por bloques (archivos muy grandes)")
+    args = parser.parse_args(argv)
+
+    inicio = time.perf_counter()
+    columnas, campo_geojson, generales, mapas, ruta_bases = leer_especificacion(args.especificacion)
+    estado = preparar_lote(
+        args.datos, args.geojson, columnas, campo_geojson, generales, mapas,
+        por_bloques=args.por_bloques, ruta_bases=ruta_bases
+    )
+    print(f"Datos listos: {len(estado['indice_fechas'])} atenciones válidas ({time.perf_counter() - inicio:.1f} s)")
+    if len(estado['indice_fechas']) == 0:
+        print("No hay datos válidos después de la limpieza.", file=sys.stderr)
+        return 1
+
+    generados = vacios = errores = 0
+    for nombre, ruta, atenciones, segundos, error in ejecutar_lote(estado, mapas, args.salida, args.procesos):
+        if error:
+            errores += 1
+            print(f"✗ {nombre}: {error}", file=sys.stderr)
+        elif ruta is None:
+            vacios += 1
+            print(f"– {nombre}: sin atenciones, no se generó")
+        else:
+            generados += 1
+            print(f"✓ {nombre}: {atenciones} atenciones → {ruta} ({segundos:.1f} s)")
+    print(
+        f"{generados} generados, {vacios} sin atenciones, {errores} con error de {len(mapas)} mapas "
+        f"en {time.perf_counter() - inicio:.1f} s"
+    )
+    return 1 if errores else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,439 @@
+# --- CONSTRUCCIÓN DEL MAPA ---
+# Funciones que arman el mapa Folium a partir de las atenciones ya limpias. No
+# dependen de Streamlit, así que las usan tanto la aplicación como el modo por
+# lotes; los errores se propagan y cada interfaz decide cómo mostrarlos.
+
+import copy
+import hashlib
+
+import folium
+from branca.element import Figure, JavascriptLink, MacroElement
+from jinja2 import Template
+
+from capas import capa_puntos, capa_calor
+from normalizacion import limpiar_propiedad_geojson
+from geometria import IndiceGeometrico, obtener_indice
+from composicion import ComposicionMapa, ID_MAPA
+from teselas import CapaTeselas, obtener_teselas
+from agrupamiento import CapaAgrupada, obtener_agrupamiento
+from coropletas import obtener_conteos, capa_coropletas, dias_del_rango
+from cubo_temporal import CuboDensidad, capa_calor_cubo, capa_calor_animada, PASOS_ANIMACION, RESOLUCION_ANIMACION
+from fechas import dias_de_fechas
+from cobertura import capa_cobertura, escala_cobertura
+from puntos_calientes import capa_puntos_calientes
+
+# Color de los puntos y de la leyenda de cada fuente de atención
+COLORES_FUENTES = {
+    'Protección Civil': '#007bff', 
+    'Servicios Médicos': '#800000'
+}
+
+# Clase CSS de las etiquetas con el nombre de cada colonia
+CLASE_ETIQUETA = 'etiqueta-colonia'
+
+class _EstiloEtiquetas(MacroElement):
+    """Regla CSS compartida por las etiquetas de colonias (en vez de un estilo en línea por etiqueta)."""
+
+    _template = Template("""
+        {% macro header(this, kwargs) %}
+        <style>
+            .{{ this.clase }} {
+                font-family: Arial;
+                font-size: 11px;
+                font-weight: bold;
+                color: #333;
+                text-shadow: 1px 1px 2px #FFF, -1px -1px 2px #FFF, 1px -1px 2px #FFF, -1px 1px 2px #FFF;
+                white-space: nowrap;
+                background: rgba(255,255,255,0.7);
+                padding: 2px 5px;
+                border-radius: 3px;
+            }
+        </style>
+        {% endmacro %}
+    """)
+
+    def __init__(self):
+        super().__init__()
+        self._name = 'EstiloEtiquetas'
+        self.clase = CLASE_ETIQUETA
+
+def obtener_centroide(feature):
+    """Calcula el centroide (ponderado por área) del polígono más grande en una feature GeoJSON."""
+    try:
+        return IndiceGeometrico.desde_geojson({'features': [feature]}).ancla(0)
+    except Exception:
+        return None
+
+def crear_leyenda_personalizada(color_map, usar_sm):
+    """Crea la leyenda personalizada de las fuentes (un bloque HTML fijo de la página)."""
+    if usar_sm:
+        legend_html = '''
+        <div id="legend" style="
+            position: fixed; 
+            bottom: 50px; 
+            left: 50px; 
+            width: 180px; 
+            height: auto; 
+            background: white; 
+            border: 2px solid grey; 
+            z-index: 9999; 
+            padding: 10px; 
+            font-size: 14px;
+            border-radius: 5px;
+            box-shadow: 0 0 10px rgba(0,0,0,0.2);
+            font-family: Arial, sans-serif;
+        ">
+        <div style="font-weight: bold; margin-bottom: 8px; border-bottom: 1px solid #ccc; padding-bottom: 5px;">
+            Fuente de Atención
+        </div>
+        <div style="margin-bottom: 5px;">
+            <span style="background: {color_pc}; width: 15px; height: 15px; display: inline-block; margin-right: 8px; border-radius: 50%; border: 1px solid #333;"></span>
+            Protección Civil
+        </div>
+        <div style="margin-bottom: 5px;">
+            <span style="background: {color_sm}; width: 15px; height: 15px; display: inline-block; margin-right: 8px; border-radius: 50%; border: 1px solid #333;"></span>
+            Servicios Médicos
+        </div>
+        </div>
+        '''.format(
+            color_pc=color_map['Protección Civil'],
+            color_sm=color_map['Servicios Médicos']
+        )
+    else:
+        legend_html = '''
+        <div id="legend" style="
+            position: fixed; 
+            bottom: 50px; 
+            left: 50px; 
+            width: 180px; 
+            height: auto; 
+            background: white; 
+            border: 2px solid grey; 
+            z-index: 9999; 
+            padding: 10px; 
+            font-size: 14px;
+            border-radius: 5px;
+            box-shadow: 0 0 10px rgba(0,0,0,0.2);
+            font-family: Arial, sans-serif;
+        ">
+        <div style="font-weight: bold; margin-bottom: 8px; border-bottom: 1px solid #ccc; padding-bottom: 5px;">
+            Atenciones Médicas
+        </div>
+        <div style="margin-bottom: 5px;">
+            <span style="background: {color_pc}; width: 15px; height: 15px; display: inline-block; margin-right: 8px; border-radius: 50%; border: 1px solid #333;"></span>
+            Todas las atenciones
+        </div>
+        </div>
+        '''.format(color_pc=color_map['Protección Civil'])
+    
+    return folium.Element(legend_html)
+
+# --- LEYENDAS ---
+# Las leyendas se agregan por nombre y al final, sobre el mapa ya armado. La
+# aplicación guarda el HTML del mapa sin ellas: las agrega a la figura para
+# st_folium y las inserta en el HTML solo al descargarlo, así que mostrarlas u
+# ocultarlas no vuelve a renderizar ni a guardar la página completa.
+
+def leyendas_del_mapa(usar_sm, escala=None, radio_cobertura=None):
+    """Leyendas nuevas por nombre: la escala de coropletas (o la leyenda de fuentes) y la de cobertura."""
+    leyendas = {}
+    if radio_cobertura is not None:
+        leyendas['leyenda_cobertura'] = escala_cobertura(radio_cobertura)
+    if escala is not None:
+        # La escala está en el caché compartido: cada mapa lleva su propia copia
+        leyendas['leyenda_coropletas'] = copy.copy(escala)
+    else:
+        leyendas['leyenda_fuentes'] = crear_leyenda_personalizada(COLORES_FUENTES, usar_sm)
+    return leyendas
+
+def agregar_leyendas(mapa, leyendas):
+    """Agrega las leyendas: las escalas son controles del mapa y el resto va en el HTML de la página."""
+    for nombre, leyenda in leyendas.items():
+        if isinstance(leyenda, MacroElement):
+            mapa.add_child(leyenda, name=nombre)
+        else:
+            mapa.get_root().html.add_child(leyenda, name=nombre)
+
+def insertar_leyendas(html, leyendas):
+    """Inserta las leyendas en el HTML de un mapa renderizado sin ellas.
+
+    Las escalas se renderizan aparte, colgadas de un elemento con el nombre fijo
+    del mapa (ver `ID_MAPA`), y sus scripts van después del script del mapa.
+    """
+    figura = Figure()
+    mapa = MacroElement()
+    mapa._name, mapa._id = 'map', ID_MAPA
+    figura.add_child(mapa)
+    agregar_leyendas(mapa, leyendas)
+    figura.render()
+    enlaces = ''.join(
+        elemento.render() for elemento in figura.header._children.values() if isinstance(elemento, JavascriptLink)
+    )
+    script = figura.script.render().strip()
+    fragmento = enlaces + figura.html.render() + (f'<script>\n{script}\n</script>' if script else '')
+    inicio, cierre, fin = html.rpartition('</html>')
+    if not cierre:
+        return html + fragmento
+    return inicio + fragmento + cierre + fin
+
+def crear_mapa(
+    df, gj_data, campo_geojson, col_lat, col_lon, col_colonia, col_fecha, *,
+    mostrar_leyenda=True, usar_sm=False, indice_geometrico=None, resolucion_calor=None, limites=None,
+    composicion=None, clave_geojson=None, clave_datos=None, puntos_en_teselas=False, modo_agregado=False,
+    agrupar_puntos=False, cubos_calor=None, rango_fechas=None, animacion_calor=None, cobertura=None,
+    puntos_calientes=None
+):
+    """Crea y configura el mapa Folium con todas sus capas.
+
+    Las opciones que siguen a `col_fecha` se pasan por nombre.
+
+    Con `composicion` las capas se reutilizan ya renderizadas mientras no cambie
+    su clave: las de colonias dependen de `clave_geojson` y las de atenciones de
+    `clave_datos`. Sin claves, todas las capas se construyen de nuevo.
+    Con `puntos_en_teselas` los puntos se dibujan como teselas raster, con
+    `agrupar_puntos` como grupos por zoom calculados en el servidor y con
+    `modo_agregado` se reemplazan puntos y calor por colonias coloreadas según
+    sus atenciones.
+    Con `cubos_calor` (ver `cubo_temporal.obtener_cubos`) y `rango_fechas` el
+    calor por celdas sale de las sumas acumuladas del cubo y no de las filas de
+    `df`. `animacion_calor` ('dia' o 'semana') agrega un mapa de calor animado.
+    Con `cobertura` (ver `cobertura.AnalisisCobertura`, alineado con las filas
+    de `df`) se agrega la capa de distancia a la base más cercana y con
+    `puntos_calientes` (ver `puntos_calientes.PuntosCalientes`) la de los grupos
+    de atenciones por densidad.
+    """
+    if composicion is None:
+        composicion = ComposicionMapa()
+
+    # Calcular centro del mapa
+    centro = [df[col_lat].mean(), df[col_lon].mean()]
+    mapa = folium.Map(
+        location=centro, 
+        zoom_start=13, 
+        tiles="CartoDB positron",
+        control_scale=True
+    )
+    mapa._id = ID_MAPA
+    
+    color_map = COLORES_FUENTES
+
+    clave_colonias = None
+    if clave_geojson is not None:
+        clave_colonias = (clave_geojson, campo_geojson, getattr(limites, 'parametros', None))
+    clave_atenciones = None
+    if clave_datos is not None:
+        clave_atenciones = (clave_datos, usar_sm, resolucion_calor, puntos_en_teselas, agrupar_puntos)
+    clave_coropletas = None
+    if clave_colonias is not None and clave_datos is not None:
+        clave_coropletas = (clave_colonias, clave_datos, usar_sm)
+
+    # CAPA DE COLONIAS
+    def construir_limites():
+        estilo_colonias = lambda x: {
+            'fillColor': '#ffffff', 
+            'color': '#808080', 
+            'weight': 1, 
+            'fillOpacity': 0.1
+        }
+        tooltip_colonias = folium.GeoJsonTooltip(
+            fields=[campo_geojson], 
+            aliases=['Colonia:'],
+            style="font-family: Arial; font-size: 12px;"
+        )
+        if limites is not None and limites.es_topojson:
+            return folium.TopoJson(
+                limites.datos,
+                'objects.colonias',
+                name='Límites de Colonias',
+                style_function=estilo_colonias,
+                tooltip=tooltip_colonias
+            )
+        if limites is not None:
+            datos_limites = limites.datos
+        else:
+            # El árbol GeoJSON se arma solo aquí, una vez por capa en caché
+            datos_limites = gj_data.a_geojson({campo_geojson: limpiar_propiedad_geojson(gj_data, campo_geojson)[0]})
+        return folium.GeoJson(
+            datos_limites, 
+            name='Límites de Colonias',
+            style_function=estilo_colonias,
+            tooltip=tooltip_colonias
+        )
+
+    # CAPA DE NOMBRES DE COLONIAS
+    def construir_nombres():
+        indice = indice_geometrico if indice_geometrico is not None else obtener_indice(gj_data)
+        nombres_limpios, nombres_originales = limpiar_propiedad_geojson(gj_data, campo_geojson)
+        capa_nombres = folium.FeatureGroup(name="Nombres de Colonias", show=False)
+        # Un solo bloque de estilo para todas las etiquetas
+        capa_nombres.add_child(_EstiloEtiquetas())
+        for i, nombre_limpio in enumerate(nombres_limpios):
+            centro_colonia = indice.ancla(i)
+            if centro_colonia and nombre_limpio:
+                nombre_display = nombres_originales.get(nombre_limpio, nombre_limpio).title()
+                folium.Marker(
+                    location=centro_colonia,
+                    icon=folium.DivIcon(
+                        html=f'<div class="{CLASE_ETIQUETA}">{nombre_display}</div>'
+                    )
+                ).add_to(capa_nombres)
+        return capa_nombres
+
+    if modo_agregado:
+        # CAPA COROPLÉTICA: los polígonos con sus conteos reemplazan a los límites
+        # Los mismos conteos que las métricas de la página, una vez por datos
+        clave_conteos = (clave_datos, usar_sm) if clave_datos is not None else None
+        conteos, escala = obtener_conteos(clave_conteos, df, col_colonia, usar_sm)
+        mapa.add_child(composicion.capa('coropletas', clave_coropletas, lambda: capa_coropletas(
+            gj_data, campo_geojson, conteos, escala, usar_sm, dias_del_rango(df, col_fecha), limites
+        )))
+    else:
+        mapa.add_child(composicion.capa('limites', clave_colonias, construir_limites))
+    mapa.add_child(composicion.capa('nombres', clave_colonias, construir_nombres))
+
+    def construir_puntos(df_fuente, nombre, color, etiqueta, valor, tooltip):
+        if not puntos_en_teselas:
+            return capa_puntos(
+                df_fuente, col_lat, col_lon, col_colonia, col_fecha,
+                nombre=nombre, color=color, etiqueta=etiqueta, valor=valor, tooltip=tooltip
+            )
+        lat = df_fuente[col_lat].to_numpy(dtype=float)
+        lon = df_fuente[col_lon].to_numpy(dtype=float)
+        # Teselas en disco por datos (archivo, columnas y rango de fechas) y fuente
+        if clave_datos is not None:
+            clave_teselas = (clave_datos, usar_sm, nombre)
+        else:
+            clave_teselas = hashlib.sha256(lat.tobytes() + lon.tobytes()).hexdigest()
+        return CapaTeselas(obtener_teselas(clave_teselas, lat, lon, color), name=nombre)
+
+    def construir_agrupados():
+        es_sm = (df['Fuente de Atención'] == 'Servicios Médicos').to_numpy() if usar_sm else None
+        # El índice se conserva por datos (archivo, columnas y rango de fechas)
+        clave_grupos = (clave_datos, usar_sm) if clave_datos is not None else None
+        indice = obtener_agrupamiento(clave_grupos, df, col_lat, col_lon, col_fecha, col_colonia, es_sm)
+        return CapaAgrupada(indice, color_map, usar_sm, name="📍 Atenciones agrupadas")
+
+    def construir_calor(df_fuente, nombre, show, fuente):
+        capa = folium.FeatureGroup(name=nombre, show=show)
+        if cubos_calor is not None and rango_fechas is not None:
+            capa_calor_cubo(cubos_calor[fuente], *rango_fechas).add_to(capa)
+        elif not df_fuente.empty:
+            capa_calor(df_fuente, col_lat, col_lon, resolucion_calor).add_to(capa)
+        return capa
+
+    def construir_animacion():
+        if cubos_calor is not None and rango_fechas is not None:
+            cubo, (inicio, fin) = cubos_calor['todas'], rango_fechas
+        else:
+            # Sin cubo precalculado (modo por lotes) se arma uno con las filas del mapa
+            dias = dias_de_fechas(df[col_fecha])
+            cubo = CuboDensidad(df[col_lat], df[col_lon], dias, resolucion_calor or RESOLUCION_ANIMACION)
+            inicio, fin = df[col_fecha].min().date(), df[col_fecha].max().date()
+        return capa_calor_animada(cubo, inicio, fin, PASOS_ANIMACION[animacion_calor])
+
+    if modo_agregado:
+        # Sin puntos ni calor: el mapa solo lleva los conteos por colonia
+        pass
+    elif usar_sm:
+        # Separar datos por fuente
+        df_pc = df[df['Fuente de Atención'] == 'Protección Civil']
+        df_sm = df[df['Fuente de Atención'] == 'Servicios Médicos']
+
+        # CAPAS DE PUNTOS (con distinción SM/PC): una FeatureCollection por fuente,
+        # o una sola capa de grupos con las dos fuentes
+        if agrupar_puntos:
+            capas_puntos = [composicion.capa('puntos_agrupados', clave_atenciones, construir_agrupados)]
+        else:
+            puntos_pc = composicion.capa('puntos_pc', clave_atenciones, lambda: construir_puntos(
+                df_pc,
+                nombre="📍 Protección Civil",
+                color=color_map['Protección Civil'],
+                etiqueta="Atendido por:",
+                valor="Protección Civil",
+                tooltip="Protección Civil"
+            ))
+            puntos_sm = composicion.capa('puntos_sm', clave_atenciones, lambda: construir_puntos(
+                df_sm,
+                nombre="📍 Servicios Médicos",
+                color=color_map['Servicios Médicos'],
+                etiqueta="Atendido por:",
+                valor="Servicios Médicos",
+                tooltip="Servicios Médicos"
+            ))
+            capas_puntos = [puntos_pc, puntos_sm]
+
+        # CAPAS DE CALOR (con distinción SM/PC)
+        calor_pc = composicion.capa('calor_pc', clave_atenciones, lambda: construir_calor(
+            df_pc, "🔥 Calor - Protección Civil", True, 'Protección Civil'
+        ))
+        calor_sm = composicion.capa('calor_sm', clave_atenciones, lambda: construir_calor(
+            df_sm, "🔥 Calor - Servicios Médicos", False, 'Servicios Médicos'
+        ))
+
+        # Agregar todas las capas al mapa
+        for capa in capas_puntos:
+            mapa.add_child(capa)
+        mapa.add_child(calor_pc)
+        mapa.add_child(calor_sm)
+    else:
+        # CAPA ÚNICA DE PUNTOS (sin distinción SM/PC)
+        if agrupar_puntos:
+            puntos_todos = composicion.capa('puntos_agrupados', clave_atenciones, construir_agrupados)
+        else:
+            puntos_todos = composicion.capa('puntos_todos', clave_atenciones, lambda: construir_puntos(
+                df,
+                nombre="📍 Todas las atenciones",
+                color=color_map['Protección Civil'],
+                etiqueta="Tipo:",
+                valor="Atención médica",
+                tooltip="Atención médica"
+            ))
+        calor_todos = composicion.capa('calor_todos', clave_atenciones, lambda: construir_calor(
+            df, "🔥 Calor - Todas las atenciones", True, 'todas'
+        ))
+
+        # Agregar capas al mapa
+        mapa.add_child(puntos_todos)
+        mapa.add_child(calor_todos)
+
+    # CALOR ANIMADO: un cuadro por día o por semana del rango
+    if animacion_calor and not modo_agregado:
+        clave_animacion = (clave_atenciones, animacion_calor) if clave_atenciones is not None else None
+        mapa.add_child(composicion.capa('calor_tiempo', clave_animacion, construir_animacion))
+
+    # COBERTURA DE BASES: celdas por distancia a la base más cercana
+    if cobertura is not None:
+        clave_cobertura = None
+        if clave_datos is not None and cobertura.clave is not None:
+            clave_cobertura = (clave_datos, cobertura.clave, cobertura.radio_m)
+        mapa.add_child(composicion.capa('cobertura', clave_cobertura, lambda: capa_cobertura(
+            cobertura, df[col_lat], df[col_lon]
+        )))
+
+    # PUNTOS CALIENTES: envolvente de cada grupo por densidad
+    if puntos_calientes is not None:
+        clave_calientes = None
+        if clave_datos is not None:
+            clave_calientes = (clave_datos, usar_sm, puntos_calientes.radio_m, puntos_calientes.min_atenciones)
+        mapa.add_child(composicion.capa('puntos_calientes', clave_calientes, lambda: capa_puntos_calientes(
+            puntos_calientes, usar_sm
+        )))
+
+    # Agregar leyenda personalizada si está activada
+    if mostrar_leyenda:
+        agregar_leyendas(mapa, leyendas_del_mapa(
+            usar_sm, escala if modo_agregado else None, cobertura.radio_m if cobertura is not None else None
+        ))
+
+    # Control de capas
+    folium.LayerControl(collapsed=True).add_to(mapa)
+    
+    return mapa
+
+def guardar_mapa_html(mapa):
+    """Renderiza el mapa completo en memoria y devuelve el HTML.
+
+    El render deja la figura lista, así que `st_folium(..., render=False)`
+    puede mostrar el mismo mapa sin volver a renderizarlo.
+    """
+    return mapa.get_root().render()
@@ -1,15 +1,28 @@
 # --- IMPORTS NECESARIOS ---
 import streamlit as st
 import pandas as pd
-import numpy as np
-import json
-import folium
-from folium.plugins import HeatMap
 from streamlit_folium import st_folium
-from io import BytesIO
-import unicodedata
-import base64
-import tempfile
+import uuid
+import functools
+from ingesta import (
+    cargar_datos, cargar_geojson, cargar_columnas, clave_archivo, leer_encabezado,
+    COORDENADA, FECHA, CATEGORIA
+)
+from geometria import obtener_indice
+from composicion import ComposicionMapa
+from mapa import crear_mapa, guardar_mapa_html, leyendas_del_mapa, agregar_leyendas, insertar_leyendas
+from exportacion import exportar_html, FORMATOS_EXPORTACION, NOMBRE_EXPORTACION
+from procesamiento import procesar_atenciones, ordenar_atenciones, COLUMNA_COLONIA_POLIGONO, COLUMNA_FUENTE
+from almacen import AlmacenAtenciones
+from cubo_temporal import obtener_cubos
+from simplificacion import obtener_limites
+from teselas import punto_mas_cercano, tolerancia_clic, ZOOM_MAX_TESELAS
+from union_espacial import reporte_discrepancias
+from coropletas import obtener_conteos, atenciones_sin_poligono
+from instrumentacion import Instrumentacion, memoria_proceso, MB
+from cache_compartido import cache
+from cobertura import IndiceBases, AnalisisCobertura, obtener_distancias, radio_cobertura, MINUTOS_COBERTURA, VELOCIDAD_KMH
+from puntos_calientes import obtener_puntos_calientes, RADIO_PUNTOS_CALIENTES, MIN_ATENCIONES_PUNTO_CALIENTE
 
 # --- CONFIGURACIÓN DE LA PÁGINA ---
 st.set_page_config(
@@ -18,323 +31,396 @@ st.set_page_config(
     layout="wide"
 )
 
-# --- INICIALIZACIÓN DE ESTADO ---
-if 'mapa_generado' not in st.session_state:
-    st.session_state.mapa_generado = False
-if 'mostrar_leyenda' not in st.session_state:
-    st.session_state.mostrar_leyenda = True
+# Formas de dibujar las atenciones en el mapa
+MODOS_PUNTOS = {
+    "Marcadores individuales": 'marcadores',
+    "Agrupados en el servidor (por zoom)": 'agrupados',
+    "Teselas raster (millones de puntos)": 'teselas',
+}
 
-# --- FUNCIONES DE PROCESAMIENTO MEJORADAS ---
+# Animación del mapa de calor por celdas
+ANIMACIONES_CALOR = {
+    "Sin animación": None,
+    "Por día": 'dia',
+    "Por semana": 'semana',
+}
 
-def limpiar_texto(texto):
-    """Normaliza un texto a minúsculas y sin acentos."""
-    if not isinstance(texto, str): 
-        return texto
-    try:
-        return unicodedata.normalize('NFD', texto).encode('ascii', 'ignore').decode('utf-8').lower().strip()
-    except (UnicodeError, AttributeError):
-        return str(texto).lower().strip()
+def recursos_del_mapa(config, sesion, instrumentacion):
+    """Objetos pesados del mapa a partir de las claves guardadas en la sesión.
 
-def obtener_centroide(feature):
-    """Calcula el centroide del polígono más grande en una feature GeoJSON."""
-    try:
-        geom = feature.get("geometry", {})
-        gtype, coords = geom.get("type"), geom.get("coordinates", [])
-        
-        if gtype == "Polygon": 
-            polygon_coords = coords[0]
-        elif gtype == "MultiPolygon": 
-            polygon_coords = max([poly[0] for poly in coords], key=len)
-        else: 
-            return None
-            
-        if not polygon_coords: 
-            return None
-            
-        longitudes, latitudes = zip(*polygon_coords)
-        return (sum(latitudes) / len(latitudes), sum(longitudes) / len(longitudes))
-    except Exception:
+    Devuelve (df_filtrado, gj_data, indice_geometrico, limites, cubos_calor,
+    cobertura), o None si el conjunto limpio, el GeoJSON o las bases ya no están
+    en el caché compartido.
+    """
+    limpios = cache.buscar(('limpieza', config['clave_limpieza']), sesion, 'limpieza')
+    gj_data = cache.buscar(('geojson', config['clave_geojson']), sesion, 'geojson')
+    if limpios is None or gj_data is None:
         return None
+    indice_fechas = limpios[0]
+    inicio_rango, fin_rango = config['rango']
+    indice_geometrico = obtener_indice(gj_data, config['clave_geojson'])
+
+    # Límites simplificados: se calculan una vez por GeoJSON y parámetros
+    limites = None
+    if config['tolerancia_limites'] is not None:
+        with instrumentacion.etapa('limites', colonias=len(gj_data)):
+            limites = obtener_limites(
+                gj_data,
+                indice_geometrico,
+                config['campo_geojson'],
+                config['tolerancia_limites'],
+                clave=config['clave_geojson'],
+                topojson=config['usar_topojson']
+            )
+        st.sidebar.caption(f"📉 Límites de colonias: {limites.resumen()}")
 
-def crear_leyenda_personalizada(mapa, color_map, usar_sm):
-    """Crea una leyenda personalizada para el mapa."""
-    if usar_sm:
-        legend_html = '''
-        <div id="legend" style="
-            position: fixed; 
-            bottom: 50px; 
-            left: 50px; 
-            width: 180px; 
-            height: auto; 
-            background: white; 
-            border: 2px solid grey; 
-            z-index: 9999; 
-            padding: 10px; 
-            font-size: 14px;
-            border-radius: 5px;
-            box-shadow: 0 0 10px rgba(0,0,0,0.2);
-            font-family: Arial, sans-serif;
-        ">
-        <div style="font-weight: bold; margin-bottom: 8px; border-bottom: 1px solid #ccc; padding-bottom: 5px;">
-            Fuente de Atención
-        </div>
-        <div style="margin-bottom: 5px;">
-            <span style="background: {color_pc}; width: 15px; height: 15px; display: inline-block; margin-right: 8px; border-radius: 50%; border: 1px solid #333;"></span>
-            Protección Civil
-        </div>
-        <div style="margin-bottom: 5px;">
-            <span style="background: {color_sm}; width: 15px; height: 15px; display: inline-block; margin-right: 8px; border-radius: 50%; border: 1px solid #333;"></span>
-            Servicios Médicos
-        </div>
-        </div>
-        '''.format(
-            color_pc=color_map['Protección Civil'],
-            color_sm=color_map['Servicios Médicos']
+    # Cubo de densidad del conjunto limpio: el calor de cualquier rango
+    # de fechas es la resta de dos de sus sumas acumuladas
+    cubos_calor = None
+    if config['resolucion_calor'] is not None and not config['modo_agregado']:
+        with instrumentacion.etapa('cubo_calor', filas=len(indice_fechas)):
+            cubos_calor = obtener_cubos(
+                (config['clave_limpieza'], config['resolucion_calor']),
+                indice_fechas.df,
+                config['col_lat'],
+                config['col_lon'],
+                indice_fechas.dias,
+                config['resolucion_calor'],
+                indice_fechas.df[COLUMNA_FUENTE] if config['usar_sm'] else None
+            )
+
+    # Distancia a la base más cercana: una vez por conjunto limpio y tabla de bases
+    cobertura = None
+    if config['clave_bases'] is not None:
+        bases = cache.buscar(('bases', config['clave_bases']), sesion, 'bases')
+        if bases is None:
+            return None
+        with instrumentacion.etapa('distancias_bases', filas=len(indice_fechas), bases=len(bases)):
+            distancias, base_cercana = obtener_distancias(
+                (config['clave_limpieza'], config['clave_bases']),
+                bases,
+                indice_fechas.df[config['col_lat']].to_numpy(dtype=float),
+                indice_fechas.df[config['col_lon']].to_numpy(dtype=float)
+            )
+        cobertura = AnalisisCobertura(
+            bases,
+            distancias[inicio_rango:fin_rango],
+            base_cercana[inicio_rango:fin_rango],
+            config['radio_bases'],
+            config['clave_bases']
         )
+    return (
+        indice_fechas.df.iloc[inicio_rango:fin_rango], gj_data, indice_geometrico, limites, cubos_calor, cobertura
+    )
+
+def clave_subida(archivo):
+    """Hash de un archivo subido, calculado una sola vez por subida y no en cada rerun."""
+    identificador = getattr(archivo, 'file_id', None)
+    if identificador is None:
+        return clave_archivo(archivo)
+    claves = st.session_state.setdefault('claves_subidas', {})
+    if identificador not in claves:
+        claves[identificador] = clave_archivo(archivo)
+    return claves[identificador]
+
+def registrar_mediciones(instrumentacion):
+    """Guarda la última medición de cada etapa para el diagnóstico."""
+    for medicion in instrumentacion.etapas:
+        st.session_state.mediciones[medicion['etapa']] = {**medicion, 'corrida': instrumentacion.corrida}
+
+# --- ÁREA PRINCIPAL EN FRAGMENTOS ---
+# Los controles de un fragmento solo vuelven a ejecutar ese fragmento: el clic
+# en las teselas rehace el mapa con sus capas ya renderizadas, la leyenda
+# además reutiliza el HTML guardado del mapa (que no la incluye) y las opciones
+# de descarga no tocan el mapa. La barra lateral
+# (y con ella lectura, limpieza y filtro) solo corre en las ejecuciones
+# completas, que reconstruyen también los fragmentos.
+#
+# Cada ejecución mide con su propia Instrumentacion, en
+# st.session_state.instrumentacion: la del script en una ejecución completa y
+# una corrida nueva cuando Streamlit vuelve a ejecutar solo un fragmento.
+
+def nueva_instrumentacion():
+    """Instrumentación de una corrida nueva de la sesión."""
+    st.session_state.corridas += 1
+    return Instrumentacion(
+        st.session_state.id_sesion,
+        st.session_state.corridas,
+        memoria_python=st.session_state.get('diagnostico_checkbox', False)
+    )
+
+def fragmento_medido(funcion):
+    """st.fragment cuyas reejecuciones sueltas miden en una corrida propia.
+
+    Dentro de una ejecución completa (o de otro fragmento) se usa la
+    instrumentación en curso; las mediciones de la corrida propia se registran
+    al terminar el fragmento.
+    """
+    @functools.wraps(funcion)
+    def envoltura(*args, **kwargs):
+        if st.session_state.get('instrumentacion') is not None:
+            return funcion(*args, **kwargs)
+        instrumentacion = st.session_state.instrumentacion = nueva_instrumentacion()
+        try:
+            return funcion(*args, **kwargs)
+        finally:
+            st.session_state.instrumentacion = None
+            registrar_mediciones(instrumentacion)
+    return st.fragment(envoltura)
+
+@fragmento_medido
+def area_metricas(config, df_filtrado, gj_data, cobertura, puntos_calientes):
+    """Métricas y reportes de las atenciones filtradas."""
+    instrumentacion = st.session_state.instrumentacion
+    # Mostrar métricas según si se usa SM o no
+    if config['usar_sm']:
+        conteo_pc = (df_filtrado['Fuente de Atención'] == 'Protección Civil').sum()
+        conteo_sm = (df_filtrado['Fuente de Atención'] == 'Servicios Médicos').sum()
+        
+        col1, col2, col3 = st.columns(3)
+        col1.metric("📊 Total de Atenciones", f"{conteo_pc + conteo_sm}")
+        col2.metric("🔵 Protección Civil", f"{conteo_pc}")
+        col3.metric("🔴 Servicios Médicos", f"{conteo_sm}")
     else:
-        legend_html = '''
-        <div id="legend" style="
-            position: fixed; 
-            bottom: 50px; 
-            left: 50px; 
-            width: 180px; 
-            height: auto; 
-            background: white; 
-            border: 2px solid grey; 
-            z-index: 9999; 
-            padding: 10px; 
-            font-size: 14px;
-            border-radius: 5px;
-            box-shadow: 0 0 10px rgba(0,0,0,0.2);
-            font-family: Arial, sans-serif;
-        ">
-        <div style="font-weight: bold; margin-bottom: 8px; border-bottom: 1px solid #ccc; padding-bottom: 5px;">
-            Atenciones Médicas
-        </div>
-        <div style="margin-bottom: 5px;">
-            <span style="background: {color_pc}; width: 15px; height: 15px; display: inline-block; margin-right: 8px; border-radius: 50%; border: 1px solid #333;"></span>
-            Todas las atenciones
-        </div>
-        </div>
-        '''.format(color_pc=color_map['Protección Civil'])
+        total_atenciones = len(df_filtrado)
+        col1, col2 = st.columns(2)
+        col1.metric("📊 Total de Atenciones", f"{total_atenciones}")
+        col2.metric("🔵 Todas las atenciones", f"{total_atenciones}")
     
-    mapa.get_root().html.add_child(folium.Element(legend_html))
+    # Reporte de discrepancias entre la colonia escrita y la del polígono
+    if st.session_state.get('reporte_colonias'):
+        resumen, discrepancias = st.session_state.reporte_colonias
+        with st.expander("🔎 Verificación de colonias por coordenadas"):
+            col1, col2, col3 = st.columns(3)
+            col1.metric("✅ Coinciden", f"{resumen['coinciden']}")
+            col2.metric("⚠️ No coinciden", f"{resumen['discrepan']}")
+            col3.metric("❔ Fuera de los polígonos", f"{resumen['fuera_de_poligonos']}")
+            if not discrepancias.empty:
+                st.markdown("**Discrepancias más frecuentes:**")
+                st.dataframe(discrepancias, use_container_width=True, hide_index=True)
 
-def crear_mapa(df, gj_data, campo_geojson, col_lat, col_lon, col_colonia, col_fecha, mostrar_leyenda=True, usar_sm=False):
-    """Crea y configura el mapa Folium con todas sus capas."""
-    try:
-        # Calcular centro del mapa
-        centro = [df[col_lat].mean(), df[col_lon].mean()]
-        mapa = folium.Map(
-            location=centro, 
-            zoom_start=13, 
-            tiles="CartoDB positron",
-            control_scale=True
+    if config['modo_agregado']:
+        # Los conteos se comparten con la capa coroplética del mapa
+        conteos = obtener_conteos(
+            (config['clave_datos'], config['usar_sm']), df_filtrado, config['col_colonia'], config['usar_sm']
+        )[0]
+        sin_poligono = atenciones_sin_poligono(
+            conteos,
+            gj_data,
+            config['campo_geojson']
         )
-        
-        color_map = {
-            'Protección Civil': '#007bff', 
-            'Servicios Médicos': '#800000'
-        }
-
-        # CAPA DE COLONIAS
-        nombres_originales = {}
-        for feature in gj_data['features']:
-            if campo_geojson in feature['properties']:
-                original = feature['properties'][campo_geojson]
-                limpio = limpiar_texto(original)
-                feature['properties'][campo_geojson] = limpio
-                nombres_originales[limpio] = original
-
-        folium.GeoJson(
-            gj_data, 
-            name='Límites de Colonias',
-            style_function=lambda x: {
-                'fillColor': '#ffffff', 
-                'color': '#808080', 
-                'weight': 1, 
-                'fillOpacity': 0.1
-            },
-            tooltip=folium.GeoJsonTooltip(
-                fields=[campo_geojson], 
-                aliases=['Colonia:'],
-                style="font-family: Arial; font-size: 12px;"
+        if sin_poligono:
+            st.caption(f"⚠️ {sin_poligono} atenciones tienen una colonia que no está en el GeoJSON y no se cuentan en el mapa.")
+
+    if cobertura is not None:
+        with st.expander("🚑 Cobertura de bases", expanded=True):
+            with instrumentacion.etapa('cobertura_colonias', filas=len(df_filtrado)):
+                resumen_cobertura = cobertura.resumen()
+                tabla_colonias = cobertura.por_colonia(df_filtrado[config['col_colonia']])
+            col1, col2, col3 = st.columns(3)
+            col1.metric("📏 Distancia mediana", f"{resumen_cobertura['mediana_m'] / 1000:.2f} km")
+            col2.metric("📐 Percentil 90", f"{resumen_cobertura['p90_m'] / 1000:.2f} km")
+            col3.metric(
+                "⚠️ Fuera del radio",
+                f"{resumen_cobertura['fuera']} ({resumen_cobertura['porcentaje_fuera']:.1f}%)"
             )
-        ).add_to(mapa)
-
-        # CAPA DE NOMBRES DE COLONIAS
-        capa_nombres = folium.FeatureGroup(name="Nombres de Colonias", show=False)
-        for feature in gj_data['features']:
-            centro_colonia = obtener_centroide(feature)
-            nombre_limpio = feature['properties'].get(campo_geojson)
-            if centro_colonia and nombre_limpio:
-                nombre_display = nombres_originales.get(nombre_limpio, nombre_limpio).title()
-                folium.Marker(
-                    location=centro_colonia,
-                    icon=folium.DivIcon(
-                        html=f'''
-                        <div style="
-                            font-family: Arial; 
-                            font-size: 11px; 
-                            font-weight: bold; 
-                            color: #333; 
-                            text-shadow: 1px 1px 2px #FFF, -1px -1px 2px #FFF, 1px -1px 2px #FFF, -1px 1px 2px #FFF;
-                            white-space: nowrap;
-                            background: rgba(255,255,255,0.7);
-                            padding: 2px 5px;
-                            border-radius: 3px;
-                        ">{nombre_display}</div>
-                        '''
-                    )
-                ).add_to(capa_nombres)
-        mapa.add_child(capa_nombres)
+            st.markdown(f"**Colonias por atenciones fuera del radio de {cobertura.radio_m / 1000:.1f} km:**")
+            st.dataframe(tabla_colonias, use_container_width=True, hide_index=True)
+            st.markdown("**Atenciones más cercanas a cada base:**")
+            st.dataframe(cobertura.por_base(), use_container_width=True, hide_index=True)
 
-        if usar_sm:
-            # CAPAS DE PUNTOS (con distinción SM/PC)
-            puntos_pc = folium.FeatureGroup(name="📍 Protección Civil", show=True)
-            puntos_sm = folium.FeatureGroup(name="📍 Servicios Médicos", show=True)
-            
-            # CAPAS DE CALOR (con distinción SM/PC)
-            calor_pc = folium.FeatureGroup(name="🔥 Calor - Protección Civil", show=True)
-            calor_sm = folium.FeatureGroup(name="🔥 Calor - Servicios Médicos", show=False)
-
-            # Separar datos por fuente
-            df_pc = df[df['Fuente de Atención'] == 'Protección Civil']
-            df_sm = df[df['Fuente de Atención'] == 'Servicios Médicos']
-
-            # Agregar puntos de Protección Civil
-            for _, row in df_pc.iterrows():
-                try:
-                    fecha_str = row[col_fecha].strftime('%d/%m/%Y') if hasattr(row[col_fecha], 'strftime') else str(row[col_fecha])
-                    popup_html = f"""
-                    <div style="font-family: Arial; font-size: 12px;">
-                        <b>Fecha:</b> {fecha_str}<br>
-                        <b>Colonia:</b> {row[col_colonia].title()}<br>
-                        <b>Atendido por:</b> Protección Civil
-                    </div>
-                    """
-                    folium.CircleMarker(
-                        location=[row[col_lat], row[col_lon]], 
-                        radius=6, 
-                        color=color_map['Protección Civil'],
-                        fill=True, 
-                        fill_color=color_map['Protección Civil'], 
-                        fill_opacity=0.8,
-                        popup=folium.Popup(popup_html, max_width=300),
-                        tooltip="Protección Civil"
-                    ).add_to(puntos_pc)
-                except Exception as e:
-                    continue
-
-            # Agregar puntos de Servicios Médicos
-            for _, row in df_sm.iterrows():
-                try:
-                    fecha_str = row[col_fecha].strftime('%d/%m/%Y') if hasattr(row[col_fecha], 'strftime') else str(row[col_fecha])
-                    popup_html = f"""
-                    <div style="font-family: Arial; font-size: 12px;">
-                        <b>Fecha:</b> {fecha_str}<br>
-                        <b>Colonia:</b> {row[col_colonia].title()}<br>
-                        <b>Atendido por:</b> Servicios Médicos
-                    </div>
-                    """
-                    folium.CircleMarker(
-                        location=[row[col_lat], row[col_lon]], 
-                        radius=6, 
-                        color=color_map['Servicios Médicos'],
-                        fill=True, 
-                        fill_color=color_map['Servicios Médicos'], 
-                        fill_opacity=0.8,
-                        popup=folium.Popup(popup_html, max_width=300),
-                        tooltip="Servicios Médicos"
-                    ).add_to(puntos_sm)
-                except Exception as e:
-                    continue
-
-            # Agregar mapas de calor
-            if not df_pc.empty:
-                HeatMap(
-                    df_pc[[col_lat, col_lon]].values, 
-                    radius=15,
-                    gradient={0.4: 'blue', 0.65: 'lime', 1: 'red'}
-                ).add_to(calor_pc)
-                
-            if not df_sm.empty:
-                HeatMap(
-                    df_sm[[col_lat, col_lon]].values, 
-                    radius=15,
-                    gradient={0.4: 'blue', 0.65: 'lime', 1: 'red'}
-                ).add_to(calor_sm)
-
-            # Agregar todas las capas al mapa
-            mapa.add_child(puntos_pc)
-            mapa.add_child(puntos_sm)
-            mapa.add_child(calor_pc)
-            mapa.add_child(calor_sm)
-        else:
-            # CAPA ÚNICA DE PUNTOS (sin distinción SM/PC)
-            puntos_todos = folium.FeatureGroup(name="📍 Todas las atenciones", show=True)
-            calor_todos = folium.FeatureGroup(name="🔥 Calor - Todas las atenciones", show=True)
-
-            # Agregar todos los puntos
-            for _, row in df.iterrows():
-                try:
-                    fecha_str = row[col_fecha].strftime('%d/%m/%Y') if hasattr(row[col_fecha], 'strftime') else str(row[col_fecha])
-                    popup_html = f"""
-                    <div style="font-family: Arial; font-size: 12px;">
-                        <b>Fecha:</b> {fecha_str}<br>
-                        <b>Colonia:</b> {row[col_colonia].title()}<br>
-                        <b>Tipo:</b> Atención médica
-                    </div>
-                    """
-                    folium.CircleMarker(
-                        location=[row[col_lat], row[col_lon]], 
-                        radius=6, 
-                        color=color_map['Protección Civil'],
-                        fill=True, 
-                        fill_color=color_map['Protección Civil'], 
-                        fill_opacity=0.8,
-                        popup=folium.Popup(popup_html, max_width=300),
-                        tooltip="Atención médica"
-                    ).add_to(puntos_todos)
-                except Exception as e:
-                    continue
-
-            # Agregar mapa de calor único
-            if not df.empty:
-                HeatMap(
-                    df[[col_lat, col_lon]].values, 
-                    radius=15,
-                    gradient={0.4: 'blue', 0.65: 'lime', 1: 'red'}
-                ).add_to(calor_todos)
-
-            # Agregar capas al mapa
-            mapa.add_child(puntos_todos)
-            mapa.add_child(calor_todos)
-
-        # Agregar leyenda personalizada si está activada
-        if mostrar_leyenda:
-            crear_leyenda_personalizada(mapa, color_map, usar_sm)
-
-        # Control de capas
-        folium.LayerControl(collapsed=True).add_to(mapa)
-        
-        return mapa
-        
-    except Exception as e:
-        st.error(f"Error al crear el mapa: {str(e)}")
-        return None
+    if puntos_calientes is not None:
+        with st.expander("🎯 Puntos calientes", expanded=True):
+            st.markdown(
+                f"**{puntos_calientes.resumen()}** (radio de {puntos_calientes.radio_m} m, "
+                f"al menos {puntos_calientes.min_atenciones} atenciones)"
+            )
+            if len(puntos_calientes):
+                columnas_tabla = [c for c in puntos_calientes.tabla.columns if c not in ('lat', 'lon')]
+                if not config['usar_sm']:
+                    columnas_tabla = [c for c in columnas_tabla if c not in ('Protección Civil', 'Servicios Médicos')]
+                st.dataframe(puntos_calientes.tabla[columnas_tabla], use_container_width=True, hide_index=True)
+
+@fragmento_medido
+def area_mapa(config, df_filtrado, gj_data, indice_geometrico, limites, cubos_calor, cobertura, puntos_calientes):
+    """Mapa con su leyenda y la atención seleccionada; la descarga es un fragmento anidado."""
+    instrumentacion = st.session_state.instrumentacion
+    mostrar_leyenda = st.checkbox(
+        "Mostrar leyenda de colores", 
+        value=True,
+        key="leyenda_checkbox"
+    )
 
-def guardar_mapa_html(mapa):
-    """Guarda el mapa como archivo HTML temporal."""
+    # Crear el mapa: las capas ya renderizadas se reutilizan y solo cambia lo que no tiene clave
+    with st.spinner("Generando mapa..."):
+        try:
+            with instrumentacion.etapa('crear_mapa', filas=len(df_filtrado), colonias=len(gj_data)):
+                # La leyenda se agrega después, fuera del HTML guardado
+                mapa_final = crear_mapa(
+                    df_filtrado, 
+                    gj_data, 
+                    config['campo_geojson'], 
+                    config['col_lat'], 
+                    config['col_lon'], 
+                    config['col_colonia'],
+                    config['col_fecha'],
+                    mostrar_leyenda=False,
+                    usar_sm=config['usar_sm'],
+                    indice_geometrico=indice_geometrico,
+                    resolucion_calor=config['resolucion_calor'],
+                    limites=limites,
+                    composicion=st.session_state.composicion,
+                    clave_geojson=config['clave_geojson'],
+                    clave_datos=config['clave_datos'],
+                    puntos_en_teselas=config['puntos_en_teselas'],
+                    modo_agregado=config['modo_agregado'],
+                    agrupar_puntos=config['agrupar_puntos'],
+                    cubos_calor=cubos_calor,
+                    rango_fechas=config['rango_fechas'],
+                    animacion_calor=config['animacion_calor'],
+                    cobertura=cobertura,
+                    puntos_calientes=puntos_calientes
+                )
+        except Exception as e:
+            st.error(f"Error al crear el mapa: {str(e)}")
+            return
+
+    # Un solo render por combinación de parámetros: el HTML (sin leyenda) se
+    # guarda en el caché compartido para la descarga y st_folium usa la figura
+    # ya renderizada
+    clave_html = tuple(config.items())
+    renderizado = []
+    def renderizar():
+        renderizado.append(True)
+        return guardar_mapa_html(mapa_final)
     try:
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.html', mode='w', encoding='utf-8') as tmp_file:
-            mapa.save(tmp_file.name)
-            with open(tmp_file.name, 'r', encoding='utf-8') as f:
-                html_content = f.read()
-        return html_content
+        with instrumentacion.etapa('html') as conteos:
+            html_mapa = cache.obtener(
+                ('html', clave_html), renderizar, sesion=st.session_state.id_sesion, ranura='html'
+            )
+            conteos['bytes'] = len(html_mapa.encode('utf-8'))
     except Exception as e:
         st.error(f"Error al guardar el mapa: {str(e)}")
-        return None
+        return
+
+    # La leyenda va en la figura que ve st_folium y en la descarga, no en el HTML guardado
+    parametros_leyenda = None
+    if mostrar_leyenda:
+        escala = None
+        if config['modo_agregado']:
+            escala = obtener_conteos(
+                (config['clave_datos'], config['usar_sm']), df_filtrado, config['col_colonia'], config['usar_sm']
+            )[1]
+        parametros_leyenda = dict(
+            usar_sm=config['usar_sm'],
+            escala=escala,
+            radio_cobertura=cobertura.radio_m if cobertura is not None else None
+        )
+        agregar_leyendas(mapa_final, leyendas_del_mapa(**parametros_leyenda))
+
+    # Mostrar el mapa con clave única
+    # Con teselas no hay popups: se devuelve el clic para buscar el punto más cercano
+    with instrumentacion.etapa('st_folium'):
+        estado_mapa = st_folium(
+            mapa_final, 
+            width=1200, 
+            height=600, 
+            returned_objects=['last_clicked', 'zoom'] if config['puntos_en_teselas'] else [],
+            render=not renderizado,
+            key="mapa_principal"
+        )
+
+    clic = (estado_mapa or {}).get('last_clicked') if config['puntos_en_teselas'] else None
+    if clic:
+        posicion = punto_mas_cercano(
+            df_filtrado[config['col_lat']],
+            df_filtrado[config['col_lon']],
+            clic['lat'],
+            clic['lng'],
+            tolerancia_clic(clic['lat'], estado_mapa.get('zoom') or ZOOM_MAX_TESELAS)
+        )
+        if posicion is None:
+            st.caption("No hay atenciones cerca del punto seleccionado.")
+        else:
+            fila = df_filtrado.iloc[posicion]
+            st.info(
+                f"**Fecha:** {fila[config['col_fecha']].strftime('%d/%m/%Y')}  \n"
+                f"**Colonia:** {str(fila[config['col_colonia']]).title()}  \n"
+                f"**Fuente:** {fila['Fuente de Atención']}"
+            )
+
+    area_descarga(clave_html, parametros_leyenda)
+
+@fragmento_medido
+def area_descarga(clave_html, parametros_leyenda=None):
+    """Opciones y botón de descarga del HTML guardado del mapa, con la leyenda si se muestra."""
+    instrumentacion = st.session_state.instrumentacion
+    # --- BOTONES DE DESCARGA ---
+    st.markdown("---")
+    st.subheader("📥 Descargar Mapa")
+    
+    col_download1, col_download2 = st.columns(2)
+    
+    with col_download1:
+        formato_descarga = st.selectbox(
+            "Formato de descarga:",
+            list(FORMATOS_EXPORTACION),
+            index=1,
+            key="formato_descarga_select"
+        )
+        minificar_descarga = st.checkbox(
+            "Minificar el HTML (más ligero)",
+            value=True,
+            key="minificar_checkbox"
+        )
+        extension, mime = FORMATOS_EXPORTACION[formato_descarga]
+        # La sesión retiene el HTML en su ranura 'html' mientras el mapa no cambie
+        html_mapa = cache.buscar(('html', clave_html), st.session_state.id_sesion, 'html')
+
+        def empaquetar_descarga():
+            # Se ejecuta al hacer clic, fuera de la ejecución: la medición solo queda en el log
+            with instrumentacion.etapa('exportacion', formato=formato_descarga, minificar=minificar_descarga) as conteos:
+                html_descarga = html_mapa
+                if parametros_leyenda is not None:
+                    html_descarga = insertar_leyendas(html_mapa, leyendas_del_mapa(**parametros_leyenda))
+                datos_descarga = exportar_html(html_descarga, formato_descarga, minificar_descarga)[0]
+                conteos['bytes'] = len(datos_descarga)
+            return datos_descarga
+
+        # El archivo se empaqueta al hacer clic, en memoria y sin volver a renderizar
+        st.download_button(
+            label="💾 Descargar mapa",
+            data=empaquetar_descarga,
+            file_name=f"{NOMBRE_EXPORTACION}{extension}",
+            mime=mime,
+            on_click="ignore",
+            disabled=html_mapa is None,
+            use_container_width=True,
+            key="download_html"
+        )
+    
+    with col_download2:
+        st.info("""
+        **Para guardar como imagen:**
+        1. Haz clic derecho en el mapa
+        2. Selecciona *'Guardar imagen como...'*
+        3. Elige formato PNG o JPG
+        """)
+
+# --- INICIALIZACIÓN DE ESTADO ---
+if 'mapa_generado' not in st.session_state:
+    st.session_state.mapa_generado = False
+if 'id_sesion' not in st.session_state:
+    # Identifica las líneas de log de la sesión y sus entradas del caché compartido
+    st.session_state.id_sesion = uuid.uuid4().hex[:12]
+    st.session_state.corridas = 0
+    # Última medición de cada etapa (las etapas en caché no se repiten en cada rerun)
+    st.session_state.mediciones = {}
+if 'composicion' not in st.session_state:
+    # Claves de las capas ya renderizadas (las capas están en el caché compartido)
+    st.session_state.composicion = ComposicionMapa(sesion=st.session_state.id_sesion)
+# Mediciones de esta ejecución completa (los fragmentos la usan mientras corre)
+instrumentacion = st.session_state.instrumentacion = nueva_instrumentacion()
 
 # --- INTERFAZ DE STREAMLIT MEJORADA ---
 
@@ -357,42 +443,214 @@ with st.sidebar:
         type=['geojson', 'json'],
         key="geojson_uploader"
     )
+    uploaded_bases_file = st.file_uploader(
+        "Sube las bases y hospitales (opcional, Excel o CSV con nombre, latitud y longitud)",
+        type=['xlsx', 'csv'],
+        key="bases_uploader"
+    )
+    lectura_por_bloques = st.checkbox(
+        "Lectura por bloques (archivos muy grandes)",
+        value=False,
+        key="lectura_bloques_checkbox",
+        help="Lee solo las columnas asignadas, por bloques y con tipos compactos, para usar menos memoria."
+    )
+    usar_almacen = st.checkbox(
+        "Acumular en el almacén histórico",
+        value=False,
+        key="almacen_checkbox",
+        help="Guarda en disco solo las atenciones que el almacén todavía no tiene y genera el mapa con todo el historial acumulado."
+    )
 
-    # Opciones de visualización
+    # Opciones de visualización (la leyenda está junto al mapa)
     st.subheader("🎨 Opciones de Visualización")
-    mostrar_leyenda = st.checkbox(
-        "Mostrar leyenda de colores", 
-        value=st.session_state.mostrar_leyenda,
-        key="leyenda_checkbox"
+
+    modo_agregado = st.checkbox(
+        "Mapa agregado por colonia (coropletas)",
+        value=False,
+        key="agregado_checkbox",
+        help="Colorea cada colonia por su número de atenciones en lugar de dibujar cada punto. Ideal para rangos de varios años."
+    )
+
+    agregar_calor = False
+    if not modo_agregado:
+        agregar_calor = st.checkbox(
+            "Agregar el mapa de calor por celdas (más ligero)",
+            value=True,
+            key="agregar_calor_checkbox",
+            help="Envía al navegador una celda con peso por zona en lugar de cada coordenada."
+        )
+    resolucion_calor = None
+    animacion_calor = None
+    if agregar_calor:
+        resolucion_calor = st.slider(
+            "Tamaño de celda del mapa de calor (metros):",
+            min_value=10,
+            max_value=500,
+            value=50,
+            step=10,
+            key="resolucion_calor_slider"
+        )
+        animacion_calor = ANIMACIONES_CALOR[st.radio(
+            "Animación del calor en el tiempo:",
+            list(ANIMACIONES_CALOR),
+            index=0,
+            key="animacion_calor_radio",
+            help="Agrega una capa de calor con un cuadro por día o por semana del rango de fechas."
+        )]
+
+    simplificar = st.checkbox(
+        "Simplificar límites de colonias (más ligero)",
+        value=True,
+        key="simplificar_checkbox",
+        help="Reduce vértices y decimales de los polígonos sin separar colonias vecinas."
+    )
+    tolerancia_limites = None
+    usar_topojson = False
+    if simplificar:
+        tolerancia_limites = st.slider(
+            "Tolerancia de simplificación (metros):",
+            min_value=0,
+            max_value=50,
+            value=5,
+            step=1,
+            key="tolerancia_slider",
+            help="5 m equivale aproximadamente a un píxel con zoom 15."
+        )
+        usar_topojson = st.checkbox(
+            "Enviar límites como TopoJSON",
+            value=False,
+            key="topojson_checkbox"
+        )
+
+    puntos_en_teselas = False
+    agrupar_puntos = False
+    if not modo_agregado:
+        dibujo_puntos = st.radio(
+            "Dibujo de las atenciones:",
+            list(MODOS_PUNTOS),
+            index=0,
+            key="modo_puntos_radio",
+            help=(
+                "Agrupados: el servidor calcula grupos por zoom y de cerca se ven los puntos. "
+                "Teselas: los puntos se pintan en imágenes en el servidor; haz clic en el mapa para ver la atención más cercana."
+            )
+        )
+        puntos_en_teselas = MODOS_PUNTOS[dibujo_puntos] == 'teselas'
+        agrupar_puntos = MODOS_PUNTOS[dibujo_puntos] == 'agrupados'
+
+    detectar_calientes = st.checkbox(
+        "Detectar puntos calientes",
+        value=False,
+        key="puntos_calientes_checkbox",
+        help="Agrupa las atenciones filtradas por densidad y dibuja cada zona con sus conteos."
+    )
+    radio_calientes = None
+    min_calientes = MIN_ATENCIONES_PUNTO_CALIENTE
+    if detectar_calientes:
+        radio_calientes = st.slider(
+            "Radio de vecindad de los puntos calientes (metros):",
+            min_value=50,
+            max_value=500,
+            value=RADIO_PUNTOS_CALIENTES,
+            step=10,
+            key="radio_calientes_slider"
+        )
+        min_calientes = st.slider(
+            "Atenciones mínimas dentro del radio:",
+            min_value=3,
+            max_value=500,
+            value=MIN_ATENCIONES_PUNTO_CALIENTE,
+            step=1,
+            key="min_calientes_slider",
+            help="Un punto forma parte del núcleo de una zona si tiene al menos estas atenciones (él incluido) dentro del radio."
+        )
+
+    radio_bases = None
+    if uploaded_bases_file:
+        minutos_cobertura = st.slider(
+            "Tiempo de respuesta objetivo (minutos):",
+            min_value=1,
+            max_value=30,
+            value=MINUTOS_COBERTURA,
+            step=1,
+            key="minutos_cobertura_slider"
+        )
+        velocidad_kmh = st.slider(
+            "Velocidad media de las unidades (km/h):",
+            min_value=10,
+            max_value=80,
+            value=VELOCIDAD_KMH,
+            step=5,
+            key="velocidad_slider",
+            help="El radio de cobertura es la distancia en línea recta que se recorre en el tiempo objetivo."
+        )
+        radio_bases = radio_cobertura(minutos_cobertura, velocidad_kmh)
+        st.caption(f"🚑 Radio de cobertura: {radio_bases / 1000:.1f} km")
+
+    st.checkbox(
+        "🛠️ Mostrar diagnóstico de rendimiento",
+        value=False,
+        key="diagnostico_checkbox",
+        help="Tiempo, memoria y volumen de datos de cada etapa. La memoria de Python se mide solo si el servidor se inició con MAPAS_MEMORIA_PYTHON=1."
     )
-    
-    # Actualizar estado
-    st.session_state.mostrar_leyenda = mostrar_leyenda
 
     # Variables para almacenar selecciones
+    id_sesion = st.session_state.id_sesion
     df = None
     gj_data = None
     
     if uploaded_data_file and uploaded_geojson_file:
         try:
-            # Cargar DataFrames
-            if uploaded_data_file.name.endswith('.xlsx'):
-                df = pd.read_excel(uploaded_data_file)
-            else:
-                df = pd.read_csv(uploaded_data_file)
-            
-            gj_data = json.load(uploaded_geojson_file)
+            # Cargar DataFrames (desde caché si el contenido ya se había parseado)
+            with instrumentacion.etapa('lectura_atenciones', bytes=uploaded_data_file.size) as conteos:
+                clave_datos_archivo = clave_subida(uploaded_data_file)
+                if lectura_por_bloques:
+                    # Solo el encabezado; las columnas se leen al asignarlas
+                    columnas_disponibles = leer_encabezado(uploaded_data_file)
+                else:
+                    # Compartido entre sesiones pero sin retener: se puede volver a leer del disco
+                    df = cache.obtener(
+                        ('datos', clave_datos_archivo),
+                        lambda: cargar_datos(uploaded_data_file, hash_archivo=clave_datos_archivo)
+                    )
+                    columnas_disponibles = df.columns.tolist()
+                    conteos['filas'] = len(df)
+                conteos['columnas'] = len(columnas_disponibles)
+            with instrumentacion.etapa('lectura_colonias', bytes=uploaded_geojson_file.size) as conteos:
+                clave_geojson = clave_subida(uploaded_geojson_file)
+                gj_data = cache.obtener(
+                    ('geojson', clave_geojson),
+                    lambda: cargar_geojson(uploaded_geojson_file, hash_archivo=clave_geojson),
+                    sesion=id_sesion,
+                    ranura='geojson'
+                )
+                conteos['colonias'] = len(gj_data)
             st.success("✅ ¡Archivos cargados correctamente!")
             
         except Exception as e:
             st.error(f"Error al leer los archivos: {e}")
             st.stop()
+
+        # Las bases son opcionales: si no se pueden leer, el mapa sigue sin cobertura
+        clave_bases = None
+        if uploaded_bases_file:
+            try:
+                with instrumentacion.etapa('lectura_bases', bytes=uploaded_bases_file.size) as conteos:
+                    clave_bases = clave_subida(uploaded_bases_file)
+                    bases = cache.obtener(
+                        ('bases', clave_bases),
+                        lambda: IndiceBases.desde_tabla(cargar_datos(uploaded_bases_file, hash_archivo=clave_bases)),
+                        sesion=id_sesion,
+                        ranura='bases'
+                    )
+                    conteos['bases'] = len(bases)
+            except Exception as e:
+                st.error(f"Error al leer las bases: {e}")
+                clave_bases = None
             
         # PASO 2: Mapeo de columnas
         st.subheader("2. Asigna las columnas")
         
-        columnas_disponibles = df.columns.tolist()
-        
         col_lat = st.selectbox(
             "Columna de LATITUD:", 
             columnas_disponibles, 
@@ -435,56 +693,133 @@ with st.sidebar:
                 key="sm_select"
             )
         
-        # Selección del campo del GeoJSON
-        try:
-            campos_geojson = list(gj_data['features'][0]['properties'].keys())
-            campo_geojson_seleccionado = st.selectbox(
-                "Campo con nombre de la colonia en GeoJSON:", 
-                campos_geojson, 
-                index=None,
-                key="geojson_field_select"
-            )
-        except (IndexError, KeyError):
+        # Selección del campo del GeoJSON (columnas de propiedades, sin recorrer las features)
+        campos_geojson = gj_data.campos
+        if len(gj_data) == 0 or not campos_geojson:
             st.error("El archivo GeoJSON no tiene un formato válido o está vacío.")
             st.stop()
+        campo_geojson_seleccionado = st.selectbox(
+            "Campo con nombre de la colonia en GeoJSON:", 
+            campos_geojson, 
+            index=None,
+            key="geojson_field_select"
+        )
+
+        # Verificación de la colonia contra los polígonos (opcional)
+        verificar_colonia = st.checkbox(
+            "Verificar la colonia con las coordenadas (polígonos del GeoJSON)",
+            value=False,
+            key="verificar_colonia_checkbox"
+        )
+        asignar_colonia = False
+        if verificar_colonia:
+            asignar_colonia = st.checkbox(
+                "Usar en el mapa la colonia del polígono",
+                value=False,
+                key="asignar_colonia_checkbox"
+            )
 
         # Validar que las columnas esenciales han sido seleccionadas
         columnas_esenciales = [col_lat, col_lon, col_colonia, col_fecha, campo_geojson_seleccionado]
         
         if all(columnas_esenciales):
             try:
-                # PROCESAMIENTO DE DATOS
-                df_procesado = df.copy()
-                
                 # Determinar si se usa distinción SM/PC
                 usar_distincion_sm = usar_sm and col_sm is not None
-                
-                if usar_distincion_sm:
-                    df_procesado['Fuente de Atención'] = np.where(
-                        df_procesado[col_sm].apply(limpiar_texto) == 'sm', 
-                        'Servicios Médicos', 
-                        'Protección Civil'
+
+                def leer_por_bloques(tipos_columnas):
+                    barra = st.progress(0.0, text="Leyendo atenciones por bloques...")
+                    with instrumentacion.etapa('lectura_por_bloques', bytes=uploaded_data_file.size) as conteos:
+                        df = cargar_columnas(
+                            uploaded_data_file,
+                            tipos_columnas,
+                            hash_archivo=clave_datos_archivo,
+                            progreso=lambda fraccion: barra.progress(min(fraccion, 1.0), text="Leyendo atenciones por bloques...")
+                        )
+                        conteos['filas'] = len(df)
+                    barra.empty()
+                    return df
+
+                # ALMACÉN HISTÓRICO: cada archivo se agrega una vez por sesión; solo
+                # las filas que el almacén no tiene se limpian y se guardan
+                clave_fuente = clave_datos_archivo
+                if usar_almacen:
+                    almacen = AlmacenAtenciones(
+                        col_lat, col_lon, col_colonia, col_fecha, col_sm if usar_distincion_sm else None
                     )
-                else:
-                    # Si no se usa SM, todas las atenciones son de Protección Civil
-                    df_procesado['Fuente de Atención'] = 'Protección Civil'
-                
-                df_procesado[col_colonia] = df_procesado[col_colonia].apply(limpiar_texto)
-                df_procesado[col_lat] = pd.to_numeric(df_procesado[col_lat], errors='coerce')
-                df_procesado[col_lon] = pd.to_numeric(df_procesado[col_lon], errors='coerce')
-                df_procesado[col_fecha] = pd.to_datetime(df_procesado[col_fecha], errors='coerce')
-                
-                # Filtrar datos válidos
-                df_limpio = df_procesado.dropna(subset=[col_lat, col_lon, col_fecha, col_colonia])
-                
-                if df_limpio.empty:
+                    agregados = st.session_state.setdefault('archivos_almacenados', {})
+                    clave_agregado = (clave_datos_archivo, almacen.ruta)
+                    if clave_agregado not in agregados:
+                        if lectura_por_bloques:
+                            # Como texto, para que las claves de fila coincidan con la lectura completa
+                            df = leer_por_bloques({columna: CATEGORIA for columna in almacen.columnas})
+                        with instrumentacion.etapa('almacen', filas=len(df)) as conteos:
+                            agregados[clave_agregado] = almacen.agregar(df)
+                            conteos.update(agregados[clave_agregado])
+                    resumen_almacen = agregados[clave_agregado]
+                    st.caption(
+                        f"🗄️ Almacén: {resumen_almacen['nuevas']:,} filas nuevas "
+                        f"({resumen_almacen['descartadas']:,} inválidas), "
+                        f"{resumen_almacen['existentes']:,} ya guardadas. "
+                        f"Historial: {almacen.resumen()}."
+                    )
+                    # Cambia cuando cualquier sesión agrega filas nuevas
+                    clave_fuente = ('almacen', almacen.ruta, almacen.version)
+
+                # PROCESAMIENTO DE DATOS: se limpia y ordena por fecha solo cuando
+                # cambian el archivo o las columnas; el filtro de fechas lo reutiliza.
+                # El resultado se comparte entre las sesiones con la misma clave.
+                clave_limpieza = (
+                    clave_fuente, lectura_por_bloques, clave_geojson, col_lat, col_lon, col_colonia, col_fecha,
+                    col_sm if usar_distincion_sm else None,
+                    campo_geojson_seleccionado, verificar_colonia, asignar_colonia
+                )
+
+                def limpiar_datos():
+                    df_fuente = df
+                    if usar_almacen:
+                        with instrumentacion.etapa('lectura_almacen') as conteos:
+                            df_fuente = almacen.leer_limpias()
+                            conteos['filas'] = len(df_fuente)
+                    elif lectura_por_bloques:
+                        tipos_columnas = {col_lat: COORDENADA, col_lon: COORDENADA, col_fecha: FECHA, col_colonia: CATEGORIA}
+                        if usar_distincion_sm:
+                            tipos_columnas[col_sm] = CATEGORIA
+                        df_fuente = leer_por_bloques(tipos_columnas)
+                    opciones_union = dict(
+                        gj_data=gj_data,
+                        campo_geojson=campo_geojson_seleccionado,
+                        clave_geojson=clave_geojson,
+                        verificar_colonia=verificar_colonia,
+                        asignar_colonia=asignar_colonia
+                    )
+                    with instrumentacion.etapa('limpieza', filas=len(df_fuente)) as conteos:
+                        if usar_almacen:
+                            # Las filas del almacén ya están limpias: solo se unen y se ordenan
+                            indice_fechas, colonia_escrita = ordenar_atenciones(
+                                df_fuente, col_lat, col_lon, col_colonia, col_fecha, **opciones_union
+                            )
+                        else:
+                            indice_fechas, colonia_escrita = procesar_atenciones(
+                                df_fuente, col_lat, col_lon, col_colonia, col_fecha,
+                                col_sm if usar_distincion_sm else None, **opciones_union
+                            )
+                        conteos['filas_validas'] = len(indice_fechas)
+                    return indice_fechas, colonia_escrita
+
+                indice_fechas, colonia_escrita = cache.obtener(
+                    ('limpieza', clave_limpieza), limpiar_datos, sesion=id_sesion, ranura='limpieza'
+                )
+
+                if len(indice_fechas) == 0:
                     st.warning("⚠️ No hay datos válidos después de la limpieza.")
                     st.stop()
                 
                 st.subheader("3. Filtra por fecha")
                 
-                fecha_min = df_limpio[col_fecha].min().date()
-                fecha_max = df_limpio[col_fecha].max().date()
+                # Extremos del índice ordenado, sin recorrer la columna
+                fecha_min = indice_fechas.fecha_min
+                fecha_max = indice_fechas.fecha_max
                 
                 fecha_inicio, fecha_fin = st.date_input(
                     "Selecciona el rango de fechas:",
@@ -495,22 +830,50 @@ with st.sidebar:
                 )
                 
                 if fecha_inicio and fecha_fin:
-                    # Filtrar el DataFrame
-                    df_filtrado = df_limpio[
-                        (df_limpio[col_fecha].dt.date >= fecha_inicio) &
-                        (df_limpio[col_fecha].dt.date <= fecha_fin)
-                    ]
-                    
-                    # Guardar en session_state para usar en el área principal
-                    st.session_state.df_filtrado = df_filtrado
+                    # Filtrar el DataFrame: slice del rango con searchsorted
+                    with instrumentacion.etapa('filtro_fechas') as conteos:
+                        inicio_rango, fin_rango = indice_fechas.posiciones(fecha_inicio, fecha_fin)
+                        df_filtrado = indice_fechas.df.iloc[inicio_rango:fin_rango]
+                        conteos['filas'] = len(df_filtrado)
+
+                    # En la sesión solo quedan claves y parámetros; el área principal
+                    # obtiene los datos del caché compartido
+                    st.session_state.reporte_colonias = (
+                        reporte_discrepancias(
+                            colonia_escrita.iloc[inicio_rango:fin_rango],
+                            df_filtrado[COLUMNA_COLONIA_POLIGONO]
+                        )
+                        if verificar_colonia else None
+                    )
+                    # Clave de todo lo que determina las capas de atenciones
+                    clave_datos = (
+                        clave_fuente, col_lat, col_lon, col_colonia, col_fecha, col_sm,
+                        campo_geojson_seleccionado if verificar_colonia else None,
+                        verificar_colonia, asignar_colonia, fecha_inicio, fecha_fin
+                    )
                     st.session_state.config = {
-                        'gj_data': gj_data,
+                        'clave_limpieza': clave_limpieza,
+                        'rango': (inicio_rango, fin_rango),
+                        'clave_geojson': clave_geojson,
+                        'clave_datos': clave_datos,
                         'campo_geojson': campo_geojson_seleccionado,
                         'col_lat': col_lat,
                         'col_lon': col_lon,
                         'col_colonia': col_colonia,
                         'col_fecha': col_fecha,
-                        'usar_sm': usar_distincion_sm
+                        'usar_sm': usar_distincion_sm,
+                        'resolucion_calor': resolucion_calor,
+                        'tolerancia_limites': tolerancia_limites,
+                        'usar_topojson': usar_topojson,
+                        'puntos_en_teselas': puntos_en_teselas,
+                        'modo_agregado': modo_agregado,
+                        'agrupar_puntos': agrupar_puntos,
+                        'rango_fechas': (fecha_inicio, fecha_fin),
+                        'animacion_calor': animacion_calor,
+                        'clave_bases': clave_bases,
+                        'radio_bases': radio_bases,
+                        'radio_calientes': radio_calientes,
+                        'min_calientes': min_calientes
                     }
                     st.session_state.mapa_generado = True
                     
@@ -518,84 +881,68 @@ with st.sidebar:
                 st.error(f"Error al procesar los datos: {str(e)}")
 
 # --- ÁREA PRINCIPAL PARA MOSTRAR EL MAPA ---
-if (st.session_state.mapa_generado and 
-    'df_filtrado' in st.session_state and 
-    not st.session_state.df_filtrado.empty):
-    
-    df_filtrado = st.session_state.df_filtrado
+df_filtrado = None
+datos_descartados = False
+if st.session_state.mapa_generado and 'config' in st.session_state:
     config = st.session_state.config
-    
-    st.success(f"🗺️ Mostrando {len(df_filtrado)} atenciones en el mapa.")
-    
-    # Mostrar métricas según si se usa SM o no
-    if config['usar_sm']:
-        conteo_pc = (df_filtrado['Fuente de Atención'] == 'Protección Civil').sum()
-        conteo_sm = (df_filtrado['Fuente de Atención'] == 'Servicios Médicos').sum()
-        
-        col1, col2, col3 = st.columns(3)
-        col1.metric("📊 Total de Atenciones", f"{conteo_pc + conteo_sm}")
-        col2.metric("🔵 Protección Civil", f"{conteo_pc}")
-        col3.metric("🔴 Servicios Médicos", f"{conteo_sm}")
+    recursos = recursos_del_mapa(config, st.session_state.id_sesion, instrumentacion)
+    if recursos is None:
+        datos_descartados = True
     else:
-        total_atenciones = len(df_filtrado)
-        col1, col2 = st.columns(2)
-        col1.metric("📊 Total de Atenciones", f"{total_atenciones}")
-        col2.metric("🔵 Todas las atenciones", f"{total_atenciones}")
-    
-    # Crear y mostrar el mapa
-    with st.spinner("Generando mapa..."):
-        mapa_final = crear_mapa(
-            df_filtrado, 
-            config['gj_data'], 
-            config['campo_geojson'], 
-            config['col_lat'], 
-            config['col_lon'], 
-            config['col_colonia'],
-            config['col_fecha'],
-            st.session_state.mostrar_leyenda,
-            config['usar_sm']
-        )
+        df_filtrado, gj_data, indice_geometrico, limites, cubos_calor, cobertura = recursos
+
+if df_filtrado is not None and not df_filtrado.empty:
     
-    if mapa_final:
-        # Mostrar el mapa con clave única
-        st_folium(
-            mapa_final, 
-            width=1200, 
-            height=600, 
-            returned_objects=[],
-            key="mapa_principal"
-        )
-        
-        # --- BOTONES DE DESCARGA ---
-        st.markdown("---")
-        st.subheader("📥 Descargar Mapa")
-        
-        col_download1, col_download2 = st.columns(2)
-        
-        with col_download1:
-            if st.button("💾 Descargar como HTML", use_container_width=True, key="download_html"):
-                with st.spinner("Generando archivo HTML..."):
-                    html_content = guardar_mapa_html(mapa_final)
-                    if html_content:
-                        st.download_button(
-                            label="📥 Descargar HTML",
-                            data=html_content,
-                            file_name="mapa_atenciones_prehospitalarias.html",
-                            mime="text/html",
-                            key="final_download"
-                        )
-        
-        with col_download2:
-            st.info("""
-            **Para guardar como imagen:**
-            1. Haz clic derecho en el mapa
-            2. Selecciona *'Guardar imagen como...'*
-            3. Elige formato PNG o JPG
-            """)
-
-elif (uploaded_data_file and uploaded_geojson_file and 
-      'df_filtrado' in st.session_state and 
-      st.session_state.df_filtrado.empty):
+    st.success(f"🗺️ Mostrando {len(df_filtrado)} atenciones en el mapa.")
+
+    # Puntos calientes de las atenciones filtradas (compartidos por datos y parámetros)
+    puntos_calientes = None
+    if config['radio_calientes'] is not None:
+        with instrumentacion.etapa('puntos_calientes', filas=len(df_filtrado)) as conteos:
+            puntos_calientes = obtener_puntos_calientes(
+                (config['clave_datos'], config['usar_sm']),
+                df_filtrado,
+                config['col_lat'],
+                config['col_lon'],
+                config['col_colonia'],
+                config['radio_calientes'],
+                config['min_calientes'],
+                (df_filtrado[COLUMNA_FUENTE] == 'Servicios Médicos').to_numpy() if config['usar_sm'] else None
+            )
+            conteos['grupos'] = len(puntos_calientes)
+
+    area_metricas(config, df_filtrado, gj_data, cobertura, puntos_calientes)
+    area_mapa(config, df_filtrado, gj_data, indice_geometrico, limites, cubos_calor, cobertura, puntos_calientes)
+
+elif uploaded_data_file and uploaded_geojson_file and df_filtrado is not None:
     st.warning("⚠️ No se encontraron datos para el rango de fechas seleccionado.")
+elif datos_descartados:
+    st.info("🔄 Los datos de esta sesión ya no están en memoria. Vuelve a cargar los archivos para generar el mapa.")
 else:
     st.info("👋 ¡Bienvenido! Por favor, sube tus archivos y configura las opciones en la barra lateral para generar el mapa.")
+
+# --- DIAGNÓSTICO DE RENDIMIENTO ---
+registrar_mediciones(instrumentacion)
+# Desde aquí, las reejecuciones de un fragmento abren su propia corrida
+st.session_state.instrumentacion = None
+
+if st.session_state.get('diagnostico_checkbox') and st.session_state.mediciones:
+    with st.expander("🛠️ Diagnóstico de rendimiento", expanded=True):
+        rss_actual, rss_pico = memoria_proceso()
+        col1, col2, col3 = st.columns(3)
+        col1.metric("⏱️ Esta ejecución", f"{instrumentacion.total_segundos():.2f} s")
+        col2.metric("💾 Memoria del proceso", f"{rss_actual / MB:.0f} MB" if rss_actual else "—")
+        col3.metric("📈 Pico de memoria", f"{rss_pico / MB:.0f} MB" if rss_pico else "—")
+        tabla_mediciones = pd.DataFrame(list(st.session_state.mediciones.values()))
+        # Las etapas en caché conservan la medición de la ejecución en que corrieron
+        tabla_mediciones.insert(1, 'esta_ejecucion', tabla_mediciones.pop('corrida') == instrumentacion.corrida)
+        st.dataframe(tabla_mediciones, use_container_width=True, hide_index=True)
+        st.caption(
+            f"Sesión {st.session_state.id_sesion}. Cada etapa se registra también como una línea JSON en el log del servidor."
+        )
+        estado_cache = cache.estadisticas()
+        st.caption(
+            f"Caché compartido: {estado_cache['entradas']} entradas ({estado_cache['retenidas']} retenidas por "
+            f"{estado_cache['sesiones']} sesiones), {estado_cache['mb']} de {estado_cache['limite_mb']} MB, "
+            f"{estado_cache['aciertos']} aciertos, {estado_cache['fallos']} fallos, {estado_cache['desalojos']} desalojos."
+        )
@@ -0,0 +1,61 @@
+# --- NORMALIZACIÓN DE TEXTO POR VALORES ÚNICOS ---
+# Los nombres de colonia y los valores de la columna SM tienen pocos cientos de
+# valores distintos repartidos en cientos de miles de filas. Cada valor distinto
+# se normaliza una sola vez (memo acotado compartido entre reruns de Streamlit)
+# y las columnas resultantes se devuelven como categóricas.
+
+import unicodedata
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+# Máximo de textos distintos recordados entre reruns
+TAMANO_MEMO = 65536
+
+@lru_cache(maxsize=TAMANO_MEMO)
+def _normalizar(texto):
+    try:
+        return unicodedata.normalize('NFD', texto).encode('ascii', 'ignore').decode('utf-8').lower().strip()
+    except (UnicodeError, AttributeError):
+        return str(texto).lower().strip()
+
+def limpiar_memo():
+    """Olvida los textos ya normalizados (p. ej. para medir la normalización desde cero)."""
+    _normalizar.cache_clear()
+
+def limpiar_texto(texto):
+    """Normaliza un texto a minúsculas y sin acentos."""
+    if not isinstance(texto, str):
+        return texto
+    return _normalizar(texto)
+
+def limpiar_columna(serie):
+    """Normaliza una columna de texto por valores únicos y la devuelve como categórica."""
+    codigos, unicos = pd.factorize(serie, use_na_sentinel=True)
+    limpios = [limpiar_texto(valor) for valor in unicos]
+
+    # Valores distintos pueden normalizarse al mismo texto ('Centro' y 'CENTRO ')
+    codigos_limpios, categorias = pd.factorize(pd.Series(limpios, dtype=object), use_na_sentinel=True)
+    codigos_limpios = np.append(codigos_limpios, -1)
+    nuevos_codigos = codigos_limpios[codigos]
+
+    return pd.Series(
+        pd.Categorical.from_codes(nuevos_codigos, categories=pd.Index(categorias, dtype=object)),
+        index=serie.index,
+        name=serie.name
+    )
+
+def limpiar_propiedad_geojson(gj_data, campo):
+    """Devuelve la propiedad normalizada de cada feature de las colonias y {limpio: original}.
+
+    Las colonias (ColoniasGeoJSON) no se modifican.
+    """
+    nombres_originales = {}
+    limpios = []
+    for original in gj_data.columna(campo):
+        limpio = limpiar_texto(original)
+        if original is not None:
+            nombres_originales[limpio] = original
+        limpios.append(limpio)
+    return limpios, nombres_originales
@@ -0,0 +1,113 @@
+# --- LIMPIEZA DE ATENCIONES ---
+# Pasos que convierten el archivo de atenciones en el conjunto limpio y ordenado
+# por fecha que usan los mapas. Sin Streamlit, para que la aplicación y el modo
+# por lotes limpien los datos exactamente igual.
+
+import numpy as np
+import pandas as pd
+
+from fechas import IndiceFechas
+from geometria import obtener_indice
+from normalizacion import limpiar_columna, limpiar_texto
+from union_espacial import colonia_espacial, nombres_de_features
+
+# Columna agregada con la colonia obtenida por unión espacial
+COLUMNA_COLONIA_POLIGONO = 'Colonia (coordenadas)'
+
+# Columna con la fuente de cada atención
+COLUMNA_FUENTE = 'Fuente de Atención'
+
+def columna_fuente(df, col_sm=None):
+    """Fuente de cada atención según la columna SM (normalizada por valores únicos)."""
+    if col_sm is None:
+        # Si no se usa SM, todas las atenciones son de Protección Civil
+        return 'Protección Civil'
+    return np.where(limpiar_columna(df[col_sm]) == 'sm', 'Servicios Médicos', 'Protección Civil')
+
+def _por_categoria(serie, convertir):
+    """Aplica `convertir` a la serie; si es categórica, una vez por categoría y sin dejarla categórica."""
+    if not isinstance(serie.dtype, pd.CategoricalDtype):
+        return convertir(serie)
+    convertidas = convertir(pd.Series(serie.cat.categories, dtype=object))
+    # Las celdas vacías (código -1) quedan como NaN/NaT
+    return pd.Series(convertidas.array.take(serie.cat.codes.to_numpy(), allow_fill=True), index=serie.index)
+
+def limpiar_atenciones(df, col_lat, col_lon, col_colonia, col_fecha, col_sm=None, columnas_extra=()):
+    """Convierte tipos, normaliza la colonia, agrega la fuente y descarta las filas inválidas.
+
+    Solo se conservan las columnas asignadas y `columnas_extra`.
+    """
+    # Solo las columnas asignadas (sin copiar el resto del archivo)
+    columnas_usadas = list(dict.fromkeys(
+        [col_lat, col_lon, col_colonia, col_fecha]
+        + ([col_sm] if col_sm is not None else [])
+        + list(columnas_extra)
+    ))
+    df_procesado = df[columnas_usadas]
+
+    df_procesado[COLUMNA_FUENTE] = columna_fuente(df_procesado, col_sm)
+    df_procesado[col_colonia] = limpiar_columna(df_procesado[col_colonia])
+    a_numero = lambda serie: pd.to_numeric(serie, errors='coerce')
+    df_procesado[col_lat] = _por_categoria(df_procesado[col_lat], a_numero)
+    df_procesado[col_lon] = _por_categoria(df_procesado[col_lon], a_numero)
+    df_procesado[col_fecha] = _por_categoria(
+        df_procesado[col_fecha], lambda serie: pd.to_datetime(serie, errors='coerce')
+    )
+
+    # Filtrar datos válidos
+    return df_procesado.dropna(subset=[col_lat, col_lon, col_fecha, col_colonia])
+
+def procesar_atenciones(df, col_lat, col_lon, col_colonia, col_fecha, col_sm=None,
+                        gj_data=None, campo_geojson=None, clave_geojson=None,
+                        verificar_colonia=False, asignar_colonia=False, columnas_extra=()):
+    """Limpia las atenciones y las ordena por fecha.
+
+    Devuelve (IndiceFechas, colonia_escrita). `colonia_escrita` es la colonia del
+    archivo, alineada con el índice, cuando se verifica contra los polígonos; si
+    no, None. Solo se conservan las columnas asignadas y `columnas_extra`.
+    """
+    df_limpio = limpiar_atenciones(df, col_lat, col_lon, col_colonia, col_fecha, col_sm, columnas_extra)
+    return ordenar_atenciones(
+        df_limpio, col_lat, col_lon, col_colonia, col_fecha,
+        gj_data, campo_geojson, clave_geojson, verificar_colonia, asignar_colonia
+    )
+
+def ordenar_atenciones(df_limpio, col_lat, col_lon, col_colonia, col_fecha,
+                       gj_data=None, campo_geojson=None, clave_geojson=None,
+                       verificar_colonia=False, asignar_colonia=False):
+    """Une con los polígonos y ordena por fecha atenciones que ya pasaron por `limpiar_atenciones`.
+
+    Devuelve lo mismo que `procesar_atenciones`. La unión espacial solo se hace
+    cuando se verifica la colonia.
+    """
+    colonia_escrita = None
+    # Unión espacial: colonia del polígono que contiene cada punto
+    if verificar_colonia and not df_limpio.empty:
+        colonia_escrita = df_limpio[col_colonia]
+        colonia_poligono = colonia_espacial(
+            obtener_indice(gj_data, clave_geojson),
+            nombres_de_features(gj_data, campo_geojson),
+            df_limpio[col_lat],
+            df_limpio[col_lon]
+        )
+        colonia_poligono.index = df_limpio.index
+        df_limpio = df_limpio.assign(**{COLUMNA_COLONIA_POLIGONO: colonia_poligono})
+        if asignar_colonia:
+            # Fuera de todo polígono se conserva la colonia escrita
+            df_limpio[col_colonia] = colonia_poligono.astype(object).fillna(
+                df_limpio[col_colonia].astype(object)
+            ).astype('category')
+
+    # Orden por fecha (una vez) y colonia escrita alineada al mismo orden
+    indice_fechas = IndiceFechas(df_limpio, col_fecha)
+    if colonia_escrita is not None:
+        colonia_escrita = colonia_escrita.iloc[indice_fechas.orden]
+    return indice_fechas, colonia_escrita
+
+def filtrar_valores(df, filtros):
+    """Conserva las filas cuyo valor normalizado está en la lista de cada columna de `filtros`."""
+    mascara = np.ones(len(df), dtype=bool)
+    for columna, valores in filtros.items():
+        permitidos = {limpiar_texto(valor) for valor in valores}
+        mascara &= limpiar_columna(df[columna]).isin(permitidos).to_numpy()
+    return df[mascara]
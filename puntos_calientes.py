@@ -0,0 +1,437 @@
+# --- PUNTOS CALIENTES (AGRUPAMIENTO POR DENSIDAD) ---
+# Detecta zonas con muchas atenciones al estilo DBSCAN: un punto es núcleo si
+# tiene al menos `min_atenciones` atenciones (él incluido) a `radio_m` metros o
+# menos, los núcleos a esa distancia forman el mismo grupo y los puntos no
+# núcleo cerca de un núcleo se suman a su grupo.
+#
+# Las vecindades salen de una rejilla uniforme con celdas de radio/√2: dos
+# puntos de la misma celda siempre son vecinos, así que en una celda con
+# `min_atenciones` puntos todos son núcleo sin medir distancias, y los vecinos
+# de un punto solo pueden estar en las 21 celdas de su alrededor. Una celda
+# vecina que queda entera dentro del radio cuenta completa y una que queda
+# entera fuera se salta; las distancias solo se miden, por bloques de pares con
+# NumPy, contra las celdas que corta el círculo. Para unir dos celdas núcleo se comparan a lo más REPRESENTANTES_CELDA
+# núcleos por celda (en celdas más pobladas, los extremos en 8 direcciones), y
+# los grupos son las componentes conexas del grafo de celdas.
+#
+# Cada grupo se dibuja como la envolvente convexa de sus puntos, con atenciones
+# por fuente, área y colonia más frecuente, para poder compararlos entre meses.
+
+import numpy as np
+import pandas as pd
+import folium
+
+from capas import METROS_POR_GRADO, DECIMALES_COORDENADAS
+from cache_compartido import cache
+
+# --- CONFIGURACIÓN ---
+RADIO_PUNTOS_CALIENTES = 150
+MIN_ATENCIONES_PUNTO_CALIENTE = 20
+# Grupos dibujados en el mapa, de mayor a menor
+MAX_PUNTOS_CALIENTES = 300
+# Máximo de pares de puntos medidos a la vez
+TAMANO_BLOQUE = 2_000_000
+# Núcleos por celda comparados al unir celdas vecinas
+REPRESENTANTES_CELDA = 12
+
+# Celdas vecinas (dx, dy) que pueden tener puntos a menos del radio; las
+# esquinas del cuadro de 5 x 5 quedan siempre más lejos
+# (de la más cercana a la más lejana: los conteos llegan antes al mínimo)
+VECINAS = sorted(
+    [(dx, dy) for dx in range(-2, 3) for dy in range(-2, 3) if (abs(dx), abs(dy)) != (2, 2)],
+    key=lambda d: d[0] ** 2 + d[1] ** 2
+)
+# Mitad de las vecinas (sin la propia celda): cada par de celdas se revisa una vez
+VECINAS_ADELANTE = [(dx, dy) for dx, dy in VECINAS if (dx, dy) > (0, 0)]
+
+ESTILO_PUNTO_CALIENTE = {'fillColor': '#e31a1c', 'color': '#800026', 'weight': 2, 'fillOpacity': 0.25}
+
+def _expandir(inicios, conteos):
+    """Para tramos [inicio, inicio + conteo): (tramo de cada elemento, posición del elemento)."""
+    tramo = np.repeat(np.arange(len(conteos)), conteos)
+    desplazamiento = np.repeat(inicios - (np.cumsum(conteos) - conteos), conteos)
+    return tramo, np.arange(len(tramo)) + desplazamiento
+
+def _bloques(conteos, tamano=TAMANO_BLOQUE):
+    """Cortes de una lista de tramos en grupos de a lo más ~`tamano` elementos."""
+    acumulado = np.cumsum(conteos)
+    cortes = np.searchsorted(acumulado, np.arange(tamano, acumulado[-1] if len(acumulado) else 0, tamano))
+    return np.unique(np.r_[0, cortes + 1, len(conteos)].clip(0, len(conteos)))
+
+def _huecos_eje(f, d, lado):
+    """Distancias mínima y máxima, sobre un eje, de cada punto a la celda desplazada `d`."""
+    if d > 0:
+        return d * lado - f, (d + 1) * lado - f
+    if d < 0:
+        return f + (-d - 1) * lado, f - d * lado
+    return np.zeros_like(f), np.maximum(f, lado - f)
+
+class _Rejilla:
+    """Puntos ordenados por celda de lado radio/√2, con el tramo de cada celda."""
+
+    def __init__(self, x, y, radio_m):
+        self.radio2 = radio_m ** 2
+        self.lado = lado = radio_m / np.sqrt(2)
+        cx = np.floor((x - x.min()) / lado).astype(np.int64)
+        cy = np.floor((y - y.min()) / lado).astype(np.int64)
+        # Posición de cada punto dentro de su celda
+        fx = (x - x.min()) - cx * lado
+        fy = (y - y.min()) - cy * lado
+        cy += 2
+        # Dos celdas de margen: sumar un desplazamiento a la clave no salta de columna
+        self.ancho = int(cy.max()) + 5
+        clave = cx * self.ancho + cy
+        self.orden = np.argsort(clave, kind='stable')
+        self.x, self.y = x[self.orden], y[self.orden]
+        self.fx, self.fy = fx[self.orden], fy[self.orden]
+        self.celdas, self.inicio, self.conteo = np.unique(clave[self.orden], return_index=True, return_counts=True)
+        self.celda = np.repeat(np.arange(len(self.celdas)), self.conteo)
+
+    def vecina(self, celdas, dx, dy):
+        """Índice de la celda desplazada (dx, dy) de cada celda, o -1 si no tiene puntos."""
+        buscada = self.celdas[celdas] + dx * self.ancho + dy
+        posicion = np.searchsorted(self.celdas, buscada).clip(0, len(self.celdas) - 1)
+        return np.where(self.celdas[posicion] == buscada, posicion, -1)
+
+    def alcance(self, filas, dx, dy):
+        """(dentro, toca): si la celda (dx, dy) de cada punto queda entera a <= radio o la corta el círculo."""
+        cerca_x, lejos_x = _huecos_eje(self.fx[filas], dx, self.lado)
+        cerca_y, lejos_y = _huecos_eje(self.fy[filas], dy, self.lado)
+        return lejos_x ** 2 + lejos_y ** 2 <= self.radio2, cerca_x ** 2 + cerca_y ** 2 <= self.radio2
+
+    def pares_cercanos(self, filas, inicios, conteos, puntos=None):
+        """Pares (fila, punto) a distancia <= radio, con cada fila contra el tramo [inicio, inicio + conteo).
+
+        Con `puntos`, los tramos son posiciones en ese arreglo de puntos.
+        """
+        cortes = _bloques(conteos)
+        for desde, hasta in zip(cortes[:-1], cortes[1:]):
+            tramo, posiciones = _expandir(inicios[desde:hasta], conteos[desde:hasta])
+            puntos_tramo = posiciones if puntos is None else puntos[posiciones]
+            p = filas[desde:hasta][tramo]
+            cerca = (self.x[p] - self.x[puntos_tramo]) ** 2 + (self.y[p] - self.y[puntos_tramo]) ** 2 <= self.radio2
+            yield p[cerca], puntos_tramo[cerca]
+
+def _extremos(tramo, inicios, x, y):
+    """Para puntos ordenados por tramo: el primer punto extremo de cada tramo en 8 direcciones."""
+    elegidos = []
+    for valores in (x, -x, y, -y, x + y, -x - y, x - y, y - x):
+        maximos = np.maximum.reduceat(valores, inicios)
+        extremos = np.flatnonzero(valores == maximos[tramo])
+        _, primeros = np.unique(tramo[extremos], return_index=True)
+        elegidos.append(extremos[primeros])
+    return np.unique(np.concatenate(elegidos))
+
+def _componentes(n, origen, destino):
+    """Etiqueta (mínimo índice) de la componente conexa de cada nodo de un grafo no dirigido."""
+    etiqueta = np.arange(n)
+    if len(origen) == 0:
+        return etiqueta
+    nodos = np.r_[origen, destino]
+    vecinos = np.r_[destino, origen]
+    orden = np.argsort(nodos, kind='stable')
+    nodos, vecinos = nodos[orden], vecinos[orden]
+    unicos, inicios = np.unique(nodos, return_index=True)
+    while True:
+        # Cada raíz se cuelga de la menor etiqueta vecina y luego se comprimen los caminos
+        minimo = np.minimum.reduceat(etiqueta[vecinos], inicios)
+        raices = etiqueta[unicos]
+        cambia = minimo < raices
+        if not cambia.any():
+            return etiqueta
+        np.minimum.at(etiqueta, raices[cambia], minimo[cambia])
+        while True:
+            siguiente = etiqueta[etiqueta]
+            if np.array_equal(siguiente, etiqueta):
+                break
+            etiqueta = siguiente
+
+def _envolvente(x, y):
+    """Vértices de la envolvente convexa (cadena monótona), en sentido antihorario."""
+    puntos = sorted(set(zip(x.tolist(), y.tolist())))
+    if len(puntos) < 3:
+        return puntos
+
+    def cruz(o, a, b):
+        return (a[0] - o[0]) * (b[1] - o[1]) - (a[1] - o[1]) * (b[0] - o[0])
+
+    inferior, superior = [], []
+    for p in puntos:
+        while len(inferior) >= 2 and cruz(inferior[-2], inferior[-1], p) <= 0:
+            inferior.pop()
+        inferior.append(p)
+    for p in reversed(puntos):
+        while len(superior) >= 2 and cruz(superior[-2], superior[-1], p) <= 0:
+            superior.pop()
+        superior.append(p)
+    return inferior[:-1] + superior[:-1]
+
+def _fuera_del_octagono(x, y):
+    """Descarta los puntos dentro del octágono de los 8 extremos (no pueden ser vértices)."""
+    if len(x) < 16:
+        return x, y
+    indices = [np.argmax(v) for v in (x, x + y, y, y - x, -x, -x - y, -y, x - y)]
+    ox, oy = x[indices], y[indices]
+    # Octágono en sentido antihorario: un punto queda dentro si está a la izquierda de todas las aristas
+    siguiente_x, siguiente_y = np.roll(ox, -1), np.roll(oy, -1)
+    dentro = np.ones(len(x), dtype=bool)
+    for ax, ay, bx, by in zip(ox, oy, siguiente_x, siguiente_y):
+        dentro &= (bx - ax) * (y - ay) - (by - ay) * (x - ax) > 0
+    return x[~dentro], y[~dentro]
+
+def _area(vertices):
+    if len(vertices) < 3:
+        return 0.0
+    x, y = np.asarray(vertices).T
+    return 0.5 * abs(np.dot(x, np.roll(y, -1)) - np.dot(y, np.roll(x, -1)))
+
+def agrupar_por_densidad(x, y, radio_m, min_atenciones):
+    """Etiqueta de grupo de cada punto (coordenadas en metros), -1 para el ruido.
+
+    Devuelve (etiquetas, candidatos): los candidatos son los puntos que bastan
+    para la envolvente de cada grupo (extremos de cada celda en 8 direcciones).
+    """
+    n = len(x)
+    if n == 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    rejilla = _Rejilla(x, y, radio_m)
+    celda, conteo = rejilla.celda, rejilla.conteo
+    n_celdas = len(conteo)
+
+    # NÚCLEOS: en celdas densas todos; en las demás se cuentan los vecinos. Las
+    # celdas enteras dentro del radio suman sin medir y solo las que corta el
+    # círculo se miden punto a punto. Una celda cuyo vecindario completo no
+    # llega al mínimo no tiene núcleos.
+    todas = np.arange(n_celdas)
+    vecindario = conteo.copy()
+    for dx, dy in VECINAS[1:]:
+        vecina = rejilla.vecina(todas, dx, dy)
+        vecindario += np.where(vecina >= 0, conteo[vecina], 0)
+    nucleo = conteo[celda] >= min_atenciones
+    vecinos = conteo[celda].astype(np.int64)
+    pendientes = ~nucleo & (vecindario[celda] >= min_atenciones)
+    for dx, dy in VECINAS[1:]:
+        filas = np.flatnonzero(pendientes & (vecinos < min_atenciones))
+        vecina = rejilla.vecina(celda[filas], dx, dy)
+        filas, vecina = filas[vecina >= 0], vecina[vecina >= 0]
+        dentro, toca = rejilla.alcance(filas, dx, dy)
+        vecinos[filas[dentro]] += conteo[vecina[dentro]]
+        corta = toca & ~dentro
+        for p, _ in rejilla.pares_cercanos(filas[corta], rejilla.inicio[vecina[corta]], conteo[vecina[corta]]):
+            vecinos += np.bincount(p, minlength=n)
+    nucleo |= vecinos >= min_atenciones
+
+    # REPRESENTANTES: todos los núcleos de la celda o sus extremos en 8 direcciones
+    nucleos = np.flatnonzero(nucleo)
+    celda_nucleo = celda[nucleos]
+    por_celda = np.bincount(celda_nucleo, minlength=n_celdas)
+    pocos = por_celda[celda_nucleo] <= REPRESENTANTES_CELDA
+    representantes = [nucleos[pocos]]
+    muchos = nucleos[~pocos]
+    if len(muchos):
+        _, tramo, = np.unique(celda[muchos], return_inverse=True)
+        inicio_muchos = np.r_[0, np.flatnonzero(np.diff(tramo)) + 1]
+        representantes.append(muchos[_extremos(tramo, inicio_muchos, rejilla.x[muchos], rejilla.y[muchos])])
+    representantes = np.unique(np.concatenate(representantes))
+    celdas_rep, inicio_rep, conteo_rep = np.unique(celda[representantes], return_index=True, return_counts=True)
+    inicio_celda_rep = np.zeros(n_celdas, dtype=np.int64)
+    conteo_celda_rep = np.zeros(n_celdas, dtype=np.int64)
+    inicio_celda_rep[celdas_rep] = inicio_rep
+    conteo_celda_rep[celdas_rep] = conteo_rep
+
+    # UNIÓN DE CELDAS NÚCLEO: hay arista si dos representantes están a <= radio
+    origen, destino = [], []
+    for dx, dy in VECINAS_ADELANTE:
+        vecina = rejilla.vecina(celdas_rep, dx, dy)
+        con_vecina = vecina >= 0
+        a, b = celdas_rep[con_vecina], vecina[con_vecina]
+        b_nucleo = conteo_celda_rep[b] > 0
+        a, b = a[b_nucleo], b[b_nucleo]
+        if len(a) == 0:
+            continue
+        # Filas: representantes de cada celda a; tramos: representantes de su celda b
+        tramo, posicion = _expandir(inicio_celda_rep[a], conteo_celda_rep[a])
+        filas_rep = representantes[posicion]
+        b_de_fila = b[tramo]
+        x_rep, y_rep = rejilla.x[representantes], rejilla.y[representantes]
+        cortes = _bloques(conteo_celda_rep[b_de_fila])
+        for desde, hasta in zip(cortes[:-1], cortes[1:]):
+            par, puntos = _expandir(inicio_celda_rep[b_de_fila[desde:hasta]], conteo_celda_rep[b_de_fila[desde:hasta]])
+            p = filas_rep[desde:hasta][par]
+            cerca = (rejilla.x[p] - x_rep[puntos]) ** 2 + (rejilla.y[p] - y_rep[puntos]) ** 2 <= rejilla.radio2
+            origen.append(celda[p[cerca]])
+            destino.append(b_de_fila[desde:hasta][par[cerca]])
+
+    # Componentes conexas del grafo de celdas (una arista por par de celdas)
+    aristas = np.unique(np.concatenate(origen) * n_celdas + np.concatenate(destino)) if origen else np.empty(0, np.int64)
+    etiqueta_celda = _componentes(n_celdas, aristas // n_celdas, aristas % n_celdas)
+
+    etiquetas = np.full(n, -1, dtype=np.int64)
+    etiquetas[nucleos] = etiqueta_celda[celda_nucleo]
+
+    # BORDES: puntos no núcleo a <= radio de algún núcleo; los núcleos de una
+    # celda están todos en el mismo grupo
+    inicio_nucleos = np.cumsum(por_celda) - por_celda
+    for dx, dy in VECINAS:
+        filas = np.flatnonzero(etiquetas < 0)
+        vecina = rejilla.vecina(celda[filas], dx, dy)
+        con_nucleos = vecina >= 0
+        con_nucleos[con_nucleos] = por_celda[vecina[con_nucleos]] > 0
+        filas, vecina = filas[con_nucleos], vecina[con_nucleos]
+        dentro, toca = rejilla.alcance(filas, dx, dy)
+        etiquetas[filas[dentro]] = etiqueta_celda[vecina[dentro]]
+        corta = toca & ~dentro
+        for p, q in rejilla.pares_cercanos(
+            filas[corta], inicio_nucleos[vecina[corta]], por_celda[vecina[corta]], puntos=nucleos
+        ):
+            etiquetas[p] = etiqueta_celda[celda[q]]
+
+    # Candidatos a la envolvente: extremos en 8 direcciones de cada celda con grupo
+    agrupados = np.flatnonzero(etiquetas >= 0)
+    candidatos = np.empty(0, dtype=np.int64)
+    if len(agrupados):
+        _, tramo = np.unique(celda[agrupados], return_inverse=True)
+        inicios = np.r_[0, np.flatnonzero(np.diff(tramo)) + 1]
+        candidatos = agrupados[_extremos(tramo, inicios, rejilla.x[agrupados], rejilla.y[agrupados])]
+
+    # De vuelta al orden original
+    resultado = np.empty(n, dtype=np.int64)
+    resultado[rejilla.orden] = etiquetas
+    return resultado, rejilla.orden[candidatos]
+
+class PuntosCalientes:
+    """Grupos de atenciones por densidad con su envolvente convexa y conteos."""
+
+    def __init__(self, lat, lon, radio_m, min_atenciones, es_sm=None, colonias=None):
+        lat = np.asarray(lat, dtype=np.float64)
+        lon = np.asarray(lon, dtype=np.float64)
+        self.radio_m = radio_m
+        self.min_atenciones = min_atenciones
+        validos = np.flatnonzero(np.isfinite(lat) & np.isfinite(lon))
+        self.etiquetas = np.full(len(lat), -1, dtype=np.int64)
+        self.poligonos = []
+        self.tabla = pd.DataFrame(
+            columns=['Grupo', 'Atenciones', 'Protección Civil', 'Servicios Médicos', 'Área (km²)', 'Colonia principal', 'lat', 'lon']
+        )
+        if len(validos) == 0:
+            return
+
+        # Proyección local equirectangular en metros
+        escala_lon = METROS_POR_GRADO * np.cos(np.radians(lat[validos].mean()))
+        x, y = lon[validos] * escala_lon, lat[validos] * METROS_POR_GRADO
+        etiquetas, candidatos = agrupar_por_densidad(x, y, radio_m, min_atenciones)
+        en_grupo = etiquetas >= 0
+        if not en_grupo.any():
+            return
+
+        # Grupos numerados de 1 en adelante, del más grande al más chico
+        grupos, inversa, tamanos = np.unique(etiquetas[en_grupo], return_inverse=True, return_counts=True)
+        rango = np.empty(len(grupos), dtype=np.int64)
+        rango[np.argsort(-tamanos, kind='stable')] = np.arange(len(grupos))
+        numeros = np.full(len(etiquetas), -1, dtype=np.int64)
+        numeros[en_grupo] = rango[inversa]
+        self.etiquetas[validos] = numeros
+        n_grupos = len(grupos)
+
+        atenciones = np.bincount(numeros[en_grupo], minlength=n_grupos)
+        sm = np.zeros(n_grupos, dtype=np.int64)
+        if es_sm is not None:
+            sm = np.bincount(numeros[en_grupo], weights=np.asarray(es_sm)[validos][en_grupo], minlength=n_grupos).astype(np.int64)
+        principal = [''] * n_grupos
+        if colonias is not None:
+            # Colonia más frecuente por grupo: tabla grupo x colonia con bincount
+            codigos, unicas = pd.factorize(np.asarray(colonias)[validos][en_grupo])
+            columnas = len(unicas) + 1
+            tabla = np.bincount(
+                numeros[en_grupo] * columnas + codigos + 1, minlength=n_grupos * columnas
+            ).reshape(n_grupos, columnas)
+            mas_frecuente = tabla[:, 1:].argmax(axis=1) if len(unicas) else np.zeros(n_grupos, dtype=np.int64)
+            principal = [
+                str(unicas[c]).title() if len(unicas) and tabla[k, c + 1] else ''
+                for k, c in enumerate(mas_frecuente.tolist())
+            ]
+
+        # Envolventes a partir de los candidatos de cada grupo
+        candidatos = candidatos[numeros[candidatos] >= 0]
+        orden = np.argsort(numeros[candidatos], kind='stable')
+        candidatos = candidatos[orden]
+        cortes = np.searchsorted(numeros[candidatos], np.arange(n_grupos + 1))
+        areas = np.zeros(n_grupos)
+        for k in range(n_grupos):
+            puntos = candidatos[cortes[k]:cortes[k + 1]]
+            vertices = _envolvente(*_fuera_del_octagono(x[puntos], y[puntos]))
+            areas[k] = _area(vertices)
+            if len(vertices) < 3:
+                # Atenciones en la misma dirección: un círculo chico alrededor
+                cx, cy = np.mean(x[puntos]), np.mean(y[puntos])
+                angulos = np.linspace(0, 2 * np.pi, 12, endpoint=False)
+                radio = radio_m / 4
+                vertices = list(zip((cx + radio * np.cos(angulos)).tolist(), (cy + radio * np.sin(angulos)).tolist()))
+            self.poligonos.append([
+                [round(vx / escala_lon, DECIMALES_COORDENADAS), round(vy / METROS_POR_GRADO, DECIMALES_COORDENADAS)]
+                for vx, vy in vertices
+            ])
+
+        centro_x = np.bincount(numeros[en_grupo], weights=x[en_grupo], minlength=n_grupos) / atenciones
+        centro_y = np.bincount(numeros[en_grupo], weights=y[en_grupo], minlength=n_grupos) / atenciones
+        self.tabla = pd.DataFrame({
+            'Grupo': np.arange(1, n_grupos + 1),
+            'Atenciones': atenciones,
+            'Protección Civil': atenciones - sm,
+            'Servicios Médicos': sm,
+            'Área (km²)': np.round(areas / 1e6, 3),
+            'Colonia principal': principal,
+            'lat': np.round(centro_y / METROS_POR_GRADO, DECIMALES_COORDENADAS),
+            'lon': np.round(centro_x / escala_lon, DECIMALES_COORDENADAS),
+        })
+
+    def __len__(self):
+        return len(self.poligonos)
+
+    def resumen(self):
+        en_grupos = int((self.etiquetas >= 0).sum())
+        return f"{len(self)} puntos calientes con {en_grupos} de {len(self.etiquetas)} atenciones"
+
+# --- CAPA DEL MAPA ---
+
+def capa_puntos_calientes(calientes, usar_sm=False, nombre="🎯 Puntos calientes", maximo=MAX_PUNTOS_CALIENTES):
+    """Polígonos (envolvente convexa) de los grupos más grandes con sus conteos."""
+    features = []
+    for fila, anillo in zip(calientes.tabla.head(maximo).to_dict('records'), calientes.poligonos):
+        propiedades = {
+            'grupo': int(fila['Grupo']),
+            'atenciones': int(fila['Atenciones']),
+            'area': f"{fila['Área (km²)']:.3f} km²",
+            'colonia': fila['Colonia principal'],
+        }
+        if usar_sm:
+            propiedades['pc'] = int(fila['Protección Civil'])
+            propiedades['sm'] = int(fila['Servicios Médicos'])
+        features.append({
+            'type': 'Feature',
+            'geometry': {'type': 'Polygon', 'coordinates': [anillo + anillo[:1]]},
+            'properties': propiedades,
+        })
+    campos = ['grupo', 'atenciones', 'area', 'colonia']
+    alias = ['Punto caliente:', 'Atenciones:', 'Área:', 'Colonia principal:']
+    if usar_sm:
+        campos += ['pc', 'sm']
+        alias += ['Protección Civil:', 'Servicios Médicos:']
+    capa = folium.FeatureGroup(name=nombre, show=True)
+    if features:
+        folium.GeoJson(
+            {'type': 'FeatureCollection', 'features': features},
+            style_function=lambda x: ESTILO_PUNTO_CALIENTE,
+            tooltip=folium.GeoJsonTooltip(fields=campos, aliases=alias, style="font-family: Arial; font-size: 12px;")
+        ).add_to(capa)
+    return capa
+
+# --- CACHÉ POR DATOS Y PARÁMETROS ---
+
+def obtener_puntos_calientes(clave, df, col_lat, col_lon, col_colonia, radio_m, min_atenciones, es_sm=None):
+    """Devuelve los puntos calientes de las atenciones, compartidos entre sesiones para la misma clave."""
+    def construir():
+        return PuntosCalientes(df[col_lat], df[col_lon], radio_m, min_atenciones, es_sm, df[col_colonia])
+    if clave is None:
+        return construir()
+    return cache.obtener(('puntos_calientes', clave, radio_m, min_atenciones), construir)
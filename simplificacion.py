@@ -0,0 +1,273 @@
+# --- SIMPLIFICACIÓN Y CUANTIZACIÓN DE LÍMITES DE COLONIAS ---
+# Antes de incrustar los polígonos en el mapa se cuantizan las coordenadas a
+# una precisión fija y se simplifican con Douglas–Peucker arco por arco. Los
+# anillos se parten en los vértices donde cambian los vecinos (uniones), de
+# modo que un borde compartido por dos colonias es un solo arco simplificado
+# una sola vez: las colonias vecinas siguen encajando sin huecos ni traslapes.
+# Opcionalmente el resultado se emite como TopoJSON (arcos compartidos).
+
+import json
+
+import numpy as np
+
+from normalizacion import limpiar_texto
+from cache_compartido import cache
+
+# Decimales conservados (~1.1 m en latitud)
+DECIMALES_LIMITES = 5
+METROS_POR_GRADO = 111_320.0
+
+class LimitesSimplificados:
+    """Límites de colonias listos para incrustar, con el ahorro de bytes obtenido."""
+
+    def __init__(self, datos, es_topojson, bytes_originales, bytes_simplificados, vertices_originales, vertices_simplificados, parametros=None):
+        self.datos = datos
+        self.es_topojson = es_topojson
+        self.bytes_originales = bytes_originales
+        self.bytes_simplificados = bytes_simplificados
+        self.vertices_originales = vertices_originales
+        self.vertices_simplificados = vertices_simplificados
+        # (campo, tolerancia, decimales, topojson): identifica el resultado en cachés
+        self.parametros = parametros
+
+    @property
+    def bytes_ahorrados(self):
+        return self.bytes_originales - self.bytes_simplificados
+
+    def resumen(self):
+        """Texto corto con el ahorro obtenido."""
+        porcentaje = 100 * self.bytes_ahorrados / self.bytes_originales if self.bytes_originales else 0
+        return (
+            f"{self.bytes_originales / 1e6:.2f} MB → {self.bytes_simplificados / 1e6:.2f} MB "
+            f"(−{porcentaje:.0f}%), {self.vertices_originales} → {self.vertices_simplificados} vértices"
+        )
+
+# --- DOUGLAS–PEUCKER ---
+
+def _douglas_peucker(xy, tolerancia):
+    """Devuelve la máscara de vértices conservados (los extremos siempre se conservan)."""
+    n = len(xy)
+    conservar = np.zeros(n, dtype=bool)
+    conservar[0] = conservar[-1] = True
+    pila = [(0, n - 1)]
+    while pila:
+        i, j = pila.pop()
+        if j <= i + 1:
+            continue
+        a, b = xy[i], xy[j]
+        tramo = xy[i + 1:j] - a
+        direccion = b - a
+        largo = np.hypot(direccion[0], direccion[1])
+        if largo == 0:
+            distancia = np.hypot(tramo[:, 0], tramo[:, 1])
+        else:
+            distancia = np.abs(direccion[0] * tramo[:, 1] - direccion[1] * tramo[:, 0]) / largo
+        k = int(np.argmax(distancia))
+        if distancia[k] > tolerancia:
+            medio = i + 1 + k
+            conservar[medio] = True
+            pila.append((i, medio))
+            pila.append((medio, j))
+    return conservar
+
+# --- TOPOLOGÍA: UNIONES Y ARCOS ---
+
+def _uniones(ids, inicio_anillos):
+    """Marca los puntos donde los anillos que lo comparten no tienen los mismos vecinos."""
+    n_puntos = int(ids.max()) + 1 if len(ids) else 0
+    largo = np.diff(inicio_anillos)
+    posicion = np.arange(len(ids))
+    inicio_de = np.repeat(inicio_anillos[:-1], largo)
+    fin_de = np.repeat(inicio_anillos[1:], largo)
+    anterior = np.where(posicion == inicio_de, fin_de - 1, posicion - 1)
+    siguiente = np.where(posicion == fin_de - 1, inicio_de, posicion + 1)
+
+    a, b = ids[anterior], ids[siguiente]
+    par = np.minimum(a, b).astype(np.int64) * n_puntos + np.maximum(a, b)
+    combinaciones = np.unique(np.column_stack([ids, par]), axis=0)
+    vecindades = np.bincount(combinaciones[:, 0], minlength=n_puntos)
+    return vecindades > 1
+
+def _clave_arco(secuencia):
+    """Clave canónica del arco (igual en ambos sentidos) y si va en sentido canónico."""
+    directo = secuencia.tobytes()
+    inverso = secuencia[::-1].tobytes()
+    if directo <= inverso:
+        return directo, True
+    return inverso, False
+
+def _construir_topologia(enteros, inicio_anillos):
+    """Parte los anillos (abiertos) en arcos y devuelve los arcos únicos y su uso por anillo."""
+    _, ids = np.unique(enteros[:, 0] * (int(enteros[:, 1].max()) + 1) + enteros[:, 1], return_inverse=True)
+    ids = ids.ravel()
+    es_union = _uniones(ids, inicio_anillos)
+
+    arcos, indice_arcos, anillos = [], {}, []
+    for r in range(len(inicio_anillos) - 1):
+        anillo = ids[inicio_anillos[r]:inicio_anillos[r + 1]]
+        if len(anillo) == 0:
+            anillos.append([])
+            continue
+        posiciones = np.flatnonzero(es_union[anillo])
+        if len(posiciones) == 0:
+            # Anillo aislado: se rota al punto menor para que coincida con su gemelo
+            giro = int(np.argmin(anillo))
+            anillo = np.roll(anillo, -giro)
+            tramos = [np.append(anillo, anillo[0])]
+        else:
+            anillo = np.roll(anillo, -int(posiciones[0]))
+            posiciones = np.append(posiciones - posiciones[0], len(anillo))
+            cerrado = np.append(anillo, anillo[0])
+            tramos = [cerrado[p:q + 1] for p, q in zip(posiciones[:-1], posiciones[1:])]
+
+        referencias = []
+        for tramo in tramos:
+            clave, directo = _clave_arco(tramo)
+            if clave not in indice_arcos:
+                indice_arcos[clave] = len(arcos)
+                arcos.append(tramo if directo else tramo[::-1])
+            i = indice_arcos[clave]
+            referencias.append(i if directo else ~i)
+        anillos.append(referencias)
+    return ids, arcos, anillos
+
+# --- SIMPLIFICACIÓN COMPLETA ---
+
+def _cuantizar(indice, decimales):
+    escala = 10.0 ** -decimales
+    origen = np.floor(indice.coordenadas.min(axis=0))
+    enteros = np.round((indice.coordenadas - origen) / escala).astype(np.int64)
+    return enteros, origen, escala
+
+def _anillos_abiertos(indice, enteros):
+    """Quita el vértice de cierre repetido y los repetidos consecutivos tras cuantizar."""
+    inicios = indice.inicio_anillos
+    largo = np.diff(inicios)
+    anillo_de = np.repeat(np.arange(len(largo)), largo)
+    posicion = np.arange(len(enteros))
+    es_ultimo = posicion == np.repeat(inicios[1:] - 1, largo)
+    repetido = np.zeros(len(enteros), dtype=bool)
+    repetido[1:] = (enteros[1:] == enteros[:-1]).all(axis=1) & (anillo_de[1:] == anillo_de[:-1])
+    cierre = es_ultimo & (enteros == enteros[np.repeat(inicios[:-1], largo)]).all(axis=1)
+    conservar = ~(repetido | cierre)
+    nuevos_largos = np.bincount(anillo_de[conservar], minlength=len(largo))
+    return enteros[conservar], np.concatenate([[0], np.cumsum(nuevos_largos)]).astype(np.int64)
+
+def simplificar_limites(gj_data, indice, campo, tolerancia_m, decimales=DECIMALES_LIMITES, topojson=False):
+    """Cuantiza y simplifica los límites preservando bordes compartidos; devuelve LimitesSimplificados."""
+    propiedades = [{campo: limpiar_texto(valor)} for valor in gj_data.columna(campo)]
+    bytes_originales = gj_data.bytes_geojson
+    parametros = (campo, float(tolerancia_m), decimales, topojson)
+    vertices_originales = len(indice.coordenadas)
+
+    if vertices_originales == 0:
+        vacio = {'type': 'FeatureCollection', 'features': []}
+        return LimitesSimplificados(vacio, False, bytes_originales, len(json.dumps(vacio)), 0, 0, parametros)
+
+    enteros, origen, escala = _cuantizar(indice, decimales)
+    enteros, inicio_anillos = _anillos_abiertos(indice, enteros)
+    ids, arcos, anillos = _construir_topologia(enteros, inicio_anillos)
+
+    # Coordenadas únicas por id y simplificación de cada arco en metros locales
+    puntos = np.zeros((int(ids.max()) + 1, 2), dtype=np.int64)
+    puntos[ids] = enteros
+    factor_x = np.cos(np.radians(origen[1] + puntos[:, 1].mean() * escala)) * METROS_POR_GRADO * escala
+    factor_y = METROS_POR_GRADO * escala
+    arcos_simplificados = []
+    for arco in arcos:
+        xy = puntos[arco] * np.array([factor_x, factor_y])
+        if tolerancia_m > 0 and len(arco) > 2:
+            arco = arco[_douglas_peucker(xy, tolerancia_m)]
+        arcos_simplificados.append(arco)
+
+    # Un anillo que colapsa (menos de 4 vértices) recupera sus arcos completos;
+    # al restaurar el arco compartido, la colonia vecina también lo usa
+    for referencias in anillos:
+        if referencias and len(_recorrer_anillo(referencias, arcos_simplificados)) < 4:
+            for i in referencias:
+                j = i if i >= 0 else ~i
+                arcos_simplificados[j] = arcos[j]
+
+    datos = (_a_topojson if topojson else _a_geojson)(
+        indice, anillos, arcos, arcos_simplificados, puntos, origen, escala, decimales, propiedades
+    )
+    vertices_simplificados = sum(len(a) for a in arcos_simplificados)
+    return LimitesSimplificados(
+        datos, topojson, bytes_originales, len(json.dumps(datos)), vertices_originales, vertices_simplificados, parametros
+    )
+
+def _recorrer_anillo(referencias, arcos):
+    """Une los arcos de un anillo (en su sentido) en una secuencia cerrada de ids."""
+    partes = []
+    for i in referencias:
+        arco = arcos[i] if i >= 0 else arcos[~i][::-1]
+        partes.append(arco[:-1])
+    if not partes:
+        return np.empty(0, dtype=np.int64)
+    anillo = np.concatenate(partes)
+    return np.append(anillo, anillo[0])
+
+def _a_geojson(indice, anillos, arcos, arcos_simplificados, puntos, origen, escala, decimales, propiedades):
+    coordenadas = np.round(origen + puntos * escala, decimales)
+    features = []
+    for k in range(indice.n_features):
+        poligonos = []
+        for parte in range(indice.inicio_features[k], indice.inicio_features[k + 1]):
+            anillos_parte = []
+            for r in range(indice.inicio_partes[parte], indice.inicio_partes[parte + 1]):
+                anillo = _recorrer_anillo(anillos[r], arcos_simplificados)
+                if len(anillo) < 4:
+                    continue
+                anillos_parte.append(coordenadas[anillo].tolist())
+            if anillos_parte:
+                poligonos.append(anillos_parte)
+        if len(poligonos) == 1:
+            geometria = {'type': 'Polygon', 'coordinates': poligonos[0]}
+        elif poligonos:
+            geometria = {'type': 'MultiPolygon', 'coordinates': poligonos}
+        else:
+            geometria = None
+        features.append({'type': 'Feature', 'properties': propiedades[k], 'geometry': geometria})
+    return {'type': 'FeatureCollection', 'features': features}
+
+def _a_topojson(indice, anillos, arcos, arcos_simplificados, puntos, origen, escala, decimales, propiedades):
+    # Arcos con coordenadas enteras codificadas en deltas, como pide la especificación
+    arcos_delta = []
+    for arco in arcos_simplificados:
+        xy = puntos[arco]
+        arcos_delta.append(np.vstack([xy[:1], np.diff(xy, axis=0)]).tolist())
+
+    geometrias = []
+    for k in range(indice.n_features):
+        poligonos = []
+        for parte in range(indice.inicio_features[k], indice.inicio_features[k + 1]):
+            anillos_parte = [
+                [int(i) for i in anillos[r]]
+                for r in range(indice.inicio_partes[parte], indice.inicio_partes[parte + 1])
+                if len(_recorrer_anillo(anillos[r], arcos_simplificados)) >= 4
+            ]
+            if anillos_parte:
+                poligonos.append(anillos_parte)
+        if len(poligonos) == 1:
+            geometrias.append({'type': 'Polygon', 'arcs': poligonos[0], 'properties': propiedades[k]})
+        elif poligonos:
+            geometrias.append({'type': 'MultiPolygon', 'arcs': poligonos, 'properties': propiedades[k]})
+        else:
+            geometrias.append({'type': None, 'properties': propiedades[k]})
+    return {
+        'type': 'Topology',
+        'transform': {'scale': [escala, escala], 'translate': [float(origen[0]), float(origen[1])]},
+        'objects': {'colonias': {'type': 'GeometryCollection', 'geometries': geometrias}},
+        'arcs': arcos_delta,
+    }
+
+# --- CACHÉ POR GEOJSON ---
+
+def obtener_limites(gj_data, indice, campo, tolerancia_m, clave=None, topojson=False):
+    """Devuelve los límites simplificados, compartidos entre sesiones para la misma clave y parámetros."""
+    if clave is None:
+        return simplificar_limites(gj_data, indice, campo, tolerancia_m, topojson=topojson)
+    return cache.obtener(
+        ('limites', clave, campo, float(tolerancia_m), topojson),
+        lambda: simplificar_limites(gj_data, indice, campo, tolerancia_m, topojson=topojson)
+    )
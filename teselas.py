@@ -0,0 +1,288 @@
+# --- TESELAS RASTER DE PUNTOS ---
+# Con millones de atenciones, Leaflet no puede dibujar un CircleMarker por
+# punto. En este modo los puntos se rasterizan en el servidor a teselas XYZ
+# PNG (proyección Web Mercator vectorizada con NumPy) para un rango de zooms,
+# una capa por fuente con su color. Las teselas se guardan en disco por clave
+# de datos y se incrustan como data URI en una capa Leaflet, así el mapa sigue
+# funcionando igual en la app, en la descarga y en el modo por lotes. Para
+# "¿qué hay aquí?" se busca en el servidor el punto más cercano al clic.
+
+import os
+import zlib
+import base64
+import struct
+import shutil
+import hashlib
+import tempfile
+
+import numpy as np
+from folium.map import Layer
+from folium.utilities import remove_empty
+from folium.template import Template
+
+# --- CONFIGURACIÓN ---
+DIRECTORIO_TESELAS = os.environ.get(
+    "MAPAS_TESELAS_DIR",
+    os.path.join(os.path.expanduser("~"), ".cache", "mapas_prehospitalarios", "teselas")
+)
+# Conjuntos de teselas conservados en disco (se borran los menos usados)
+MAX_CONJUNTOS_TESELAS = 32
+
+TAMANO_TESELA = 256
+ZOOM_MIN_TESELAS = 10
+ZOOM_MAX_TESELAS = 15
+# Radio en píxeles del punto dibujado y opacidad (0-255), como fill_opacity=0.8
+RADIO_PUNTO_TESELA = 3
+OPACIDAD_PUNTO_TESELA = 204
+
+# Cambiar este valor invalida todas las teselas guardadas con un formato anterior.
+VERSION_TESELAS = "1"
+
+# Latitud máxima representable en Web Mercator
+LATITUD_MAXIMA = 85.05112878
+
+# --- PROYECCIÓN Y RASTERIZACIÓN ---
+
+def proyectar_mercator(lat, lon):
+    """Coordenadas Web Mercator en píxeles de zoom 0 (0 a 256) de cada punto."""
+    lat = np.clip(np.asarray(lat, dtype=np.float64), -LATITUD_MAXIMA, LATITUD_MAXIMA)
+    lon = np.asarray(lon, dtype=np.float64)
+    x = (lon + 180.0) / 360.0 * TAMANO_TESELA
+    seno = np.sin(np.radians(lat))
+    y = (0.5 - np.log((1 + seno) / (1 - seno)) / (4 * np.pi)) * TAMANO_TESELA
+    return x, y
+
+def _color_rgb(color_hex):
+    color_hex = color_hex.lstrip('#')
+    return bytes(int(color_hex[i:i + 2], 16) for i in (0, 2, 4))
+
+def _bloque_png(tipo, datos):
+    return (
+        struct.pack('>I', len(datos)) + tipo + datos
+        + struct.pack('>I', zlib.crc32(tipo + datos) & 0xFFFFFFFF)
+    )
+
+def _png_paleta(indices, color_rgb):
+    """PNG de paleta con dos entradas: 0 transparente y 1 el color del punto.
+
+    Un byte por píxel en vez de cuatro: se comprime varias veces más rápido
+    y ocupa menos que un PNG RGBA.
+    """
+    alto, ancho = indices.shape
+    filas = np.zeros((alto, ancho + 1), dtype=np.uint8)
+    filas[:, 1:] = indices
+    return b''.join([
+        b'\x89PNG\r\n\x1a\n',
+        _bloque_png(b'IHDR', struct.pack('>IIBBBBB', ancho, alto, 8, 3, 0, 0, 0)),
+        _bloque_png(b'PLTE', b'\x00\x00\x00' + color_rgb),
+        _bloque_png(b'tRNS', bytes([0, OPACIDAD_PUNTO_TESELA])),
+        _bloque_png(b'IDAT', zlib.compress(filas.tobytes(), 6)),
+        _bloque_png(b'IEND', b''),
+    ])
+
+def _unicos(valores):
+    """Valores únicos ordenados (ordenar es más rápido que np.unique con hash en arreglos grandes)."""
+    valores = np.sort(valores)
+    if len(valores) == 0:
+        return valores
+    return valores[np.r_[True, valores[1:] != valores[:-1]]]
+
+def _disco(radio):
+    """Desplazamientos (dx, dy) de los píxeles de un disco del radio dado."""
+    dy, dx = np.mgrid[-radio:radio + 1, -radio:radio + 1]
+    dentro = dx ** 2 + dy ** 2 <= radio ** 2 + radio
+    return dx[dentro].astype(np.int64), dy[dentro].astype(np.int64)
+
+def _pixeles_unicos(x, y, zoom):
+    """Píxeles globales (x, y) distintos donde caen los puntos en un zoom."""
+    limite = TAMANO_TESELA * 2 ** zoom
+    px = np.clip(np.floor(x * 2 ** zoom).astype(np.int64), 0, limite - 1)
+    py = np.clip(np.floor(y * 2 ** zoom).astype(np.int64), 0, limite - 1)
+    # En zooms bajos muchos puntos caen en el mismo píxel
+    unicos = _unicos((px << 32) | py)
+    return unicos >> 32, unicos & 0xFFFFFFFF
+
+def _teselas_tocadas(px, py, zoom, radio):
+    """(posición del píxel, clave de tesela) por cada tesela que toca el disco de cada píxel.
+
+    Un disco cerca del borde pinta también la tesela vecina (hasta cuatro en
+    una esquina); basta revisar las esquinas de su recuadro.
+    """
+    maximo = TAMANO_TESELA * 2 ** zoom - 1
+    claves = np.empty((len(px), 4), dtype=np.int64)
+    for i, (ox, oy) in enumerate(((-radio, -radio), (radio, -radio), (-radio, radio), (radio, radio))):
+        tx = np.clip(px + ox, 0, maximo) // TAMANO_TESELA
+        ty = np.clip(py + oy, 0, maximo) // TAMANO_TESELA
+        claves[:, i] = (tx << 32) | ty
+    claves.sort(axis=1)
+    distintas = np.ones(claves.shape, dtype=bool)
+    distintas[:, 1:] = claves[:, 1:] != claves[:, :-1]
+    posiciones, columnas = np.nonzero(distintas)
+    return posiciones, claves[posiciones, columnas]
+
+def generar_teselas(lat, lon, color, zoom_min=ZOOM_MIN_TESELAS, zoom_max=ZOOM_MAX_TESELAS, radio=RADIO_PUNTO_TESELA):
+    """Rasteriza los puntos en teselas PNG; devuelve {"z/x/y": bytes} solo de teselas no vacías."""
+    lat = np.asarray(lat, dtype=np.float64)
+    lon = np.asarray(lon, dtype=np.float64)
+    validos = np.isfinite(lat) & np.isfinite(lon)
+    x, y = proyectar_mercator(lat[validos], lon[validos])
+    color_rgb = _color_rgb(color)
+    dx, dy = _disco(radio)
+
+    teselas = {}
+    if len(x) == 0:
+        return teselas
+    # Lienzo con margen: los discos de píxeles vecinos (hasta `radio` fuera de la
+    # tesela) se pintan completos y el margen se recorta
+    margen = 2 * radio
+    lienzo = np.zeros((TAMANO_TESELA + 2 * margen, TAMANO_TESELA + 2 * margen), dtype=np.uint8)
+    for zoom in range(zoom_min, zoom_max + 1):
+        px, py = _pixeles_unicos(x, y, zoom)
+        posiciones, claves = _teselas_tocadas(px, py, zoom, radio)
+        orden = np.argsort(claves, kind='stable')
+        posiciones, claves = posiciones[orden], claves[orden]
+        limites = np.flatnonzero(np.diff(claves)) + 1
+        for inicio, fin in zip(np.r_[0, limites], np.r_[limites, len(claves)]):
+            tx, ty = claves[inicio] >> 32, claves[inicio] & 0xFFFFFFFF
+            puntos = posiciones[inicio:fin]
+            columnas = px[puntos] - tx * TAMANO_TESELA + margen
+            filas = py[puntos] - ty * TAMANO_TESELA + margen
+            lienzo[filas[:, None] + dy[None, :], columnas[:, None] + dx[None, :]] = 1
+            teselas[f"{zoom}/{tx}/{ty}"] = _png_paleta(
+                lienzo[margen:margen + TAMANO_TESELA, margen:margen + TAMANO_TESELA], color_rgb
+            )
+            lienzo[:] = 0
+    return teselas
+
+# --- CACHÉ EN DISCO ---
+
+def _directorio_conjunto(clave, directorio):
+    nombre = hashlib.sha256(repr((VERSION_TESELAS, clave)).encode()).hexdigest()[:32]
+    return os.path.join(directorio, nombre)
+
+def _leer_conjunto(ruta):
+    """Lee las teselas guardadas de un conjunto y lo marca como usado recientemente."""
+    teselas = {}
+    for raiz, _, archivos in os.walk(ruta):
+        for archivo in archivos:
+            if not archivo.endswith('.png'):
+                continue
+            z_x = os.path.relpath(raiz, ruta).replace(os.sep, '/')
+            with open(os.path.join(raiz, archivo), 'rb') as f:
+                teselas[f"{z_x}/{archivo[:-4]}"] = f.read()
+    os.utime(ruta)
+    return teselas
+
+def _escribir_conjunto(teselas, ruta):
+    """Escribe las teselas en un directorio temporal y lo renombra al destino."""
+    directorio = os.path.dirname(ruta)
+    os.makedirs(directorio, exist_ok=True)
+    ruta_tmp = tempfile.mkdtemp(dir=directorio, suffix='.tmp')
+    try:
+        for nombre, png in teselas.items():
+            z, x, y = nombre.split('/')
+            os.makedirs(os.path.join(ruta_tmp, z, x), exist_ok=True)
+            with open(os.path.join(ruta_tmp, z, x, f"{y}.png"), 'wb') as f:
+                f.write(png)
+        os.replace(ruta_tmp, ruta)
+    finally:
+        if os.path.exists(ruta_tmp):
+            shutil.rmtree(ruta_tmp, ignore_errors=True)
+
+def desalojar_teselas(directorio=None, maximo=MAX_CONJUNTOS_TESELAS):
+    """Borra los conjuntos de teselas menos usados hasta dejar `maximo`."""
+    directorio = directorio or DIRECTORIO_TESELAS
+    if not os.path.isdir(directorio):
+        return
+    conjuntos = []
+    for nombre in os.listdir(directorio):
+        ruta = os.path.join(directorio, nombre)
+        if nombre.endswith('.tmp') or not os.path.isdir(ruta):
+            continue
+        try:
+            conjuntos.append((os.stat(ruta).st_mtime, ruta))
+        except OSError:
+            continue
+    for _, ruta in sorted(conjuntos)[:max(0, len(conjuntos) - maximo)]:
+        shutil.rmtree(ruta, ignore_errors=True)
+
+def obtener_teselas(clave, lat, lon, color, zoom_min=ZOOM_MIN_TESELAS, zoom_max=ZOOM_MAX_TESELAS,
+                    radio=RADIO_PUNTO_TESELA, directorio=None):
+    """Devuelve las teselas de los puntos, desde disco si ya se generaron para la misma clave."""
+    directorio = directorio or DIRECTORIO_TESELAS
+    ruta = _directorio_conjunto((clave, color, zoom_min, zoom_max, radio), directorio)
+    if os.path.isdir(ruta):
+        try:
+            return _leer_conjunto(ruta)
+        except OSError:
+            shutil.rmtree(ruta, ignore_errors=True)
+
+    teselas = generar_teselas(lat, lon, color, zoom_min, zoom_max, radio)
+    try:
+        _escribir_conjunto(teselas, ruta)
+        desalojar_teselas(directorio)
+    except OSError:
+        # Si no se puede guardar en disco se siguen usando las teselas generadas
+        pass
+    return teselas
+
+# --- CAPA DEL MAPA ---
+
+class CapaTeselas(Layer):
+    """Capa Leaflet que muestra teselas PNG incrustadas como data URI."""
+
+    _template = Template("""
+        {% macro script(this, kwargs) %}
+            var {{ this.get_name() }}_teselas = {{ this.teselas|tojson }};
+            var {{ this.get_name() }} = new (L.GridLayer.extend({
+                createTile: function(coords) {
+                    var src = {{ this.get_name() }}_teselas[coords.z + '/' + coords.x + '/' + coords.y];
+                    if (!src) {
+                        return document.createElement('div');
+                    }
+                    var tile = document.createElement('img');
+                    tile.alt = '';
+                    tile.src = src;
+                    return tile;
+                }
+            }))(
+                {{ this.options|tojavascript }}
+            );
+        {% endmacro %}
+    """)
+
+    def __init__(self, teselas, zoom_min=ZOOM_MIN_TESELAS, zoom_max=ZOOM_MAX_TESELAS,
+                 name=None, overlay=True, control=True, show=True):
+        super().__init__(name=name, overlay=overlay, control=control, show=show)
+        self._name = 'CapaTeselas'
+        self.teselas = {
+            nombre: "data:image/png;base64," + base64.b64encode(png).decode('ascii')
+            for nombre, png in teselas.items()
+        }
+        self.options = remove_empty(
+            tile_size=TAMANO_TESELA,
+            min_native_zoom=zoom_min,
+            max_native_zoom=zoom_max,
+            # Más lejos que esto se pedirían demasiadas teselas escaladas
+            min_zoom=max(0, zoom_min - 2),
+        )
+
+# --- BÚSQUEDA DEL PUNTO MÁS CERCANO ---
+
+def punto_mas_cercano(lat, lon, lat_clic, lon_clic, tolerancia_m):
+    """Posición del punto más cercano al clic si está a menos de `tolerancia_m` metros; si no, None."""
+    lat = np.asarray(lat, dtype=np.float64)
+    lon = np.asarray(lon, dtype=np.float64)
+    if len(lat) == 0:
+        return None
+    # Distancia equirectangular: basta a la escala de un clic
+    metros_por_grado = 111_320.0
+    dy = (lat - lat_clic) * metros_por_grado
+    dx = (lon - lon_clic) * metros_por_grado * np.cos(np.radians(lat_clic))
+    distancias = dx * dx + dy * dy
+    i = int(np.nanargmin(distancias))
+    return i if distancias[i] <= tolerancia_m ** 2 else None
+
+def tolerancia_clic(lat, zoom, pixeles=RADIO_PUNTO_TESELA + 3):
+    """Metros que ocupan `pixeles` en pantalla a una latitud y zoom dados."""
+    return pixeles * 156_543.03 * np.cos(np.radians(lat)) / 2 ** zoom
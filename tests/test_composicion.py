@@ -0,0 +1,103 @@
+# --- CAPAS REUTILIZADAS EN STREAMLIT-FOLIUM ---
+# streamlit-folium no usa el HTML de la figura: arma el mapa con la macro
+# `script` de cada hijo. Las capas guardadas tienen que salir también por ahí,
+# y las leyendas, que se agregan después de guardar el HTML del mapa.
+
+import datetime
+import json
+
+import pytest
+from streamlit_folium import _get_html, _get_map_string
+
+from benchmark import COLUMNAS_SINTETICAS, CAMPO_SINTETICO, generar_atenciones, generar_colonias
+from cache_compartido import cache
+from composicion import CapaRenderizada, ComposicionMapa, ID_MAPA
+from coropletas import obtener_conteos
+from geojson_columnar import leer_geojson
+from geometria import obtener_indice
+from mapa import agregar_leyendas, crear_mapa, guardar_mapa_html, insertar_leyendas, leyendas_del_mapa
+from procesamiento import procesar_atenciones
+
+@pytest.fixture(autouse=True)
+def cache_vacio():
+    cache.limpiar()
+    yield
+    cache.limpiar()
+
+@pytest.fixture(scope='module')
+def datos():
+    c = COLUMNAS_SINTETICAS
+    gj = generar_colonias(colonias=16, vertices=12)
+    indice_fechas, _ = procesar_atenciones(
+        generar_atenciones(400, gj), c['lat'], c['lon'], c['colonia'], c['fecha'], c['sm']
+    )
+    df = indice_fechas.filtrar(datetime.date(2024, 1, 1), datetime.date(2024, 12, 31))
+    colonias = leer_geojson(json.dumps(gj).encode('utf-8'))
+    return df, colonias
+
+def _crear(datos, composicion, **opciones):
+    c = COLUMNAS_SINTETICAS
+    df, colonias = datos
+    return crear_mapa(
+        df, colonias, CAMPO_SINTETICO, c['lat'], c['lon'], c['colonia'], c['fecha'],
+        usar_sm=True, indice_geometrico=obtener_indice(colonias), resolucion_calor=50, composicion=composicion,
+        clave_geojson='colonias', clave_datos='atenciones', **opciones
+    )
+
+def _capas_guardadas(mapa):
+    return [hijo for hijo in mapa._children.values() if isinstance(hijo, CapaRenderizada)]
+
+def _script_st_folium(mapa):
+    # Mismo orden que st_folium: render de la figura y luego el script del mapa
+    mapa.get_root().render()
+    return _get_map_string(mapa)
+
+@pytest.mark.parametrize('opciones', [{}, {'agrupar_puntos': True}, {'modo_agregado': True}])
+def test_st_folium_declara_cada_capa_guardada(datos, opciones):
+    mapa = _crear(datos, ComposicionMapa(), **opciones)
+    capas = _capas_guardadas(mapa)
+    assert capas
+    nombres = [capa.get_name() for capa in capas]
+    script = _script_st_folium(mapa)
+    for nombre in nombres:
+        assert f"var {nombre} " in script
+
+def test_capas_reutilizadas_en_el_mapa_del_siguiente_rerun(datos):
+    composicion = ComposicionMapa()
+    primero = _crear(datos, composicion)
+    # st_folium cambia los _id del mapa y de sus hijos; las piezas guardadas no deben depender de ellos
+    _script_st_folium(primero)
+    piezas = {capa.get_name(): capa.piezas for capa in _capas_guardadas(primero)}
+
+    segundo = _crear(datos, composicion)
+    capas = _capas_guardadas(segundo)
+    assert {capa.get_name(): capa.piezas for capa in capas} == piezas
+    script = _script_st_folium(segundo)
+    for capa in capas:
+        assert f"var {capa.get_name()} " in script
+    # Las capas guardadas apuntan al id fijo del mapa, que st_folium renombra
+    assert f"map_{ID_MAPA}" not in script
+    assert "L.heatLayer(" in script and "L.geoJson(" in script
+
+@pytest.mark.parametrize('modo_agregado', [False, True])
+def test_leyenda_fuera_del_html_guardado(datos, modo_agregado):
+    df, _ = datos
+    mapa = _crear(datos, ComposicionMapa(), mostrar_leyenda=False, modo_agregado=modo_agregado)
+    html = guardar_mapa_html(mapa)
+    escala = None
+    if modo_agregado:
+        escala = obtener_conteos(None, df, COLUMNAS_SINTETICAS['colonia'], True)[1]
+    parametros = dict(usar_sm=True, escala=escala)
+
+    # st_folium muestra la leyenda agregada después del render (render=False)
+    agregar_leyendas(mapa, leyendas_del_mapa(**parametros))
+    mapa.render()
+    en_pagina, script = _get_html(mapa), _get_map_string(mapa)
+    # La descarga la inserta en el HTML guardado, con el id fijo del mapa
+    descarga = insertar_leyendas(html, leyendas_del_mapa(**parametros))
+    assert descarga.startswith(html[:-len('</html>')]) and descarga.endswith('</html>')
+    if modo_agregado:
+        assert ".legend.addTo(map_div)" in script
+        assert f".legend.addTo(map_{ID_MAPA})" in descarga and "d3.min.js" in descarga
+    else:
+        assert "Fuente de Atención" in en_pagina and "Fuente de Atención" in descarga
@@ -0,0 +1,181 @@
+# --- UNIÓN ESPACIAL PUNTO EN POLÍGONO ---
+# Asigna a cada atención la colonia del GeoJSON que contiene sus coordenadas.
+# Primero una rejilla uniforme sobre las cajas envolventes reduce los polígonos
+# candidatos de cada punto; después un ray casting vectorizado con NumPy decide
+# (regla par-impar, por lo que los huecos quedan resueltos solos).
+
+import numpy as np
+import pandas as pd
+
+from normalizacion import limpiar_texto, limpiar_columna
+
+# Máximo de elementos (puntos x aristas) evaluados a la vez en el ray casting
+TAMANO_BLOQUE = 2_000_000
+
+class RejillaPoligonos:
+    """Rejilla uniforme que lista, por celda, las features cuya caja la toca."""
+
+    def __init__(self, indice, celdas_por_feature=4):
+        self.indice = indice
+        cajas = indice.cajas
+        validas = np.flatnonzero(~np.isnan(cajas).any(axis=1))
+        self.validas = validas
+        if len(validas) == 0:
+            self.origen = np.zeros(2)
+            self.tamano = np.ones(2)
+            self.dimension = np.ones(2, dtype=np.int64)
+            self.inicio_celdas = np.zeros(2, dtype=np.int64)
+            self.features_celda = np.empty(0, dtype=np.int64)
+            return
+
+        minimo = cajas[validas, :2].min(axis=0)
+        maximo = cajas[validas, 2:].max(axis=0)
+        extension = np.maximum(maximo - minimo, 1e-9)
+        # Aproximadamente `celdas_por_feature` celdas por polígono
+        lado = max(1, int(np.sqrt(len(validas) * celdas_por_feature)))
+        self.origen = minimo
+        self.dimension = np.array([lado, lado], dtype=np.int64)
+        self.tamano = extension / lado
+
+        c0 = self._celda(cajas[validas, :2])
+        c1 = self._celda(cajas[validas, 2:])
+        features, celdas = [], []
+        for k, (ix0, iy0), (ix1, iy1) in zip(validas, c0, c1):
+            ix, iy = np.meshgrid(np.arange(ix0, ix1 + 1), np.arange(iy0, iy1 + 1))
+            ids = (iy * self.dimension[0] + ix).ravel()
+            celdas.append(ids)
+            features.append(np.full(len(ids), k, dtype=np.int64))
+        celdas = np.concatenate(celdas)
+        features = np.concatenate(features)
+
+        orden = np.argsort(celdas, kind='stable')
+        n_celdas = int(self.dimension.prod())
+        self.features_celda = features[orden]
+        self.inicio_celdas = np.concatenate(
+            [[0], np.cumsum(np.bincount(celdas, minlength=n_celdas))]
+        ).astype(np.int64)
+
+    def _celda(self, lonlat):
+        """Coordenadas enteras de celda (recortadas a la rejilla)."""
+        celda = np.floor((lonlat - self.origen) / self.tamano).astype(np.int64)
+        return np.clip(celda, 0, self.dimension - 1)
+
+    def candidatos(self, lon, lat):
+        """Devuelve pares (punto, feature) cuya celda coincide."""
+        lonlat = np.column_stack([lon, lat])
+        dentro = (
+            (lonlat >= self.origen).all(axis=1)
+            & (lonlat <= self.origen + self.tamano * self.dimension).all(axis=1)
+        )
+        puntos = np.flatnonzero(dentro)
+        celda = self._celda(lonlat[puntos])
+        ids = celda[:, 1] * self.dimension[0] + celda[:, 0]
+        inicio = self.inicio_celdas[ids]
+        cuantos = self.inicio_celdas[ids + 1] - inicio
+        punto_par = np.repeat(puntos, cuantos)
+        # Posición de cada par dentro de la lista de su celda
+        desplazamiento = np.arange(cuantos.sum()) - np.repeat(np.cumsum(cuantos) - cuantos, cuantos)
+        feature_par = self.features_celda[np.repeat(inicio, cuantos) + desplazamiento]
+        return punto_par, feature_par
+
+def rejilla_de(indice):
+    """Devuelve la rejilla del índice, construyéndola la primera vez."""
+    rejilla = getattr(indice, '_rejilla', None)
+    if rejilla is None:
+        rejilla = RejillaPoligonos(indice)
+        indice._rejilla = rejilla
+    return rejilla
+
+def _aristas_de_feature(indice, k):
+    """Extremos (x1, y1, x2, y2) de todas las aristas de los anillos de la feature k."""
+    primer_anillo = indice.inicio_partes[indice.inicio_features[k]]
+    ultimo_anillo = indice.inicio_partes[indice.inicio_features[k + 1]]
+    inicios = indice.inicio_anillos[primer_anillo:ultimo_anillo]
+    fines = indice.inicio_anillos[primer_anillo + 1:ultimo_anillo + 1]
+    a = indice.coordenadas[inicios[0]:fines[-1]]
+    siguiente = np.arange(1, len(a) + 1)
+    siguiente[fines - inicios[0] - 1] = inicios - inicios[0]
+    b = a[siguiente]
+    return a[:, 0], a[:, 1], b[:, 0], b[:, 1]
+
+def _dentro(px, py, aristas):
+    """Ray casting par-impar de los puntos contra todas las aristas de una feature."""
+    x1, y1, x2, y2 = aristas
+    resultado = np.zeros(len(px), dtype=bool)
+    paso = max(1, TAMANO_BLOQUE // max(1, len(x1)))
+    for inicio in range(0, len(px), paso):
+        bx = px[inicio:inicio + paso, None]
+        by = py[inicio:inicio + paso, None]
+        cruza = (y1 > by) != (y2 > by)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            x_corte = (x2 - x1) * (by - y1) / (y2 - y1) + x1
+        cruces = np.count_nonzero(cruza & (bx < x_corte), axis=1)
+        resultado[inicio:inicio + paso] = (cruces % 2) == 1
+    return resultado
+
+def asignar_poligonos(indice, lat, lon):
+    """Devuelve, por punto, el índice de la feature que lo contiene (-1 si ninguna)."""
+    lat = np.asarray(lat, dtype=np.float64)
+    lon = np.asarray(lon, dtype=np.float64)
+    asignado = np.full(len(lat), -1, dtype=np.int64)
+    if len(lat) == 0 or indice.n_features == 0:
+        return asignado
+
+    punto_par, feature_par = rejilla_de(indice).candidatos(lon, lat)
+
+    # Se descartan pares fuera de la caja envolvente del polígono
+    cajas = indice.cajas[feature_par]
+    en_caja = (
+        (lon[punto_par] >= cajas[:, 0]) & (lon[punto_par] <= cajas[:, 2])
+        & (lat[punto_par] >= cajas[:, 1]) & (lat[punto_par] <= cajas[:, 3])
+    )
+    punto_par, feature_par = punto_par[en_caja], feature_par[en_caja]
+    if len(feature_par) == 0:
+        return asignado
+
+    # Se procesan las features en orden; si hay traslapes gana la de menor índice
+    orden = np.lexsort((punto_par, feature_par))
+    punto_par, feature_par = punto_par[orden], feature_par[orden]
+    limites = np.flatnonzero(np.diff(feature_par)) + 1
+    for puntos, k in zip(np.split(punto_par, limites), feature_par[np.r_[0, limites]]):
+        puntos = puntos[asignado[puntos] < 0]
+        if len(puntos) == 0:
+            continue
+        dentro = _dentro(lon[puntos], lat[puntos], _aristas_de_feature(indice, k))
+        asignado[puntos[dentro]] = k
+    return asignado
+
+def nombres_de_features(gj_data, campo):
+    """Nombre normalizado de cada feature de las colonias (None si no tiene el campo)."""
+    return np.array([limpiar_texto(valor) for valor in gj_data.columna(campo)], dtype=object)
+
+def colonia_espacial(indice, nombres, lat, lon):
+    """Devuelve como categórica la colonia del polígono que contiene cada punto."""
+    asignado = asignar_poligonos(indice, lat, lon)
+    valores = np.append(nombres, None)[np.where(asignado >= 0, asignado, len(nombres))]
+    return limpiar_columna(pd.Series(valores, dtype=object))
+
+# --- REPORTE DE DISCREPANCIAS ---
+
+def reporte_discrepancias(colonia_escrita, colonia_poligono, limite=20):
+    """Compara la colonia escrita con la del polígono y resume coincidencias y discrepancias."""
+    escrita = pd.Series(colonia_escrita).astype(object).to_numpy()
+    poligono = pd.Series(colonia_poligono).astype(object).to_numpy()
+    sin_poligono = pd.isna(poligono)
+    coincide = ~sin_poligono & (escrita == poligono)
+    discrepa = ~sin_poligono & ~coincide
+
+    resumen = {
+        'total': int(len(escrita)),
+        'coinciden': int(coincide.sum()),
+        'discrepan': int(discrepa.sum()),
+        'fuera_de_poligonos': int(sin_poligono.sum()),
+    }
+    pares = (
+        pd.DataFrame({'Colonia escrita': escrita[discrepa], 'Colonia por coordenadas': poligono[discrepa]})
+        .value_counts()
+        .head(limite)
+        .rename('Atenciones')
+        .reset_index()
+    )
+    return resumen, pares